@@ -4,3 +4,7 @@ class SynopticDataValidationError(Exception):
 
 class SynopticDataError(Exception):
     pass
+
+
+class SynopticDataDeadlineError(SynopticDataError):
+    pass
@@ -1,26 +1,76 @@
+import hashlib
 import logging
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
 from datetime import datetime
+from itertools import chain
 from os import environ
 from os.path import splitext
+from tempfile import SpooledTemporaryFile
+from threading import Event
+from time import (
+    monotonic,
+    perf_counter,
+)
 from typing import (
+    IO,
     Dict,
+    Iterable,
+    Iterator,
     List,
+    NamedTuple,
+    Optional,
+    Set,
+    TypeVar,
     Union,
 )
 
-import requests
 from azure.core.exceptions import HttpResponseError
 from azure.functions import TimerRequest
-from azure.storage.filedatalake import FileSystemClient
-from requests import HTTPError
+from azure.storage.filedatalake import (
+    ContentSettings,
+    FileSystemClient,
+)
+from requests.exceptions import RequestException
 
 from GetActualTenMinSynopticData.errors import (
+    SynopticDataDeadlineError,
     SynopticDataError,
     SynopticDataValidationError,
 )
+from GetActualTenMinSynopticData.knmi_client import (
+    KNMIClient,
+    get_knmi_client,
+)
+from GetActualTenMinSynopticData.manifest import (
+    MANIFEST_PATH,
+    RETRY_QUEUE_PATH,
+    WATERMARK_PATH,
+    FileInfo,
+    RetryQueue,
+    UploadManifest,
+    advance_watermark,
+    load_watermark,
+    save_watermark,
+)
 from GetActualTenMinSynopticData.models import validate_file_extension
-from loganalytics.law import LogAnalyticsWorkspaceLogger
-from storage.adls import get_adls_client
+from loganalytics.law import (
+    DEFAULT_CLOSE_TIMEOUT,
+    LogAnalyticsWorkspaceLogger,
+)
+from loganalytics.logger import SupportsLog
+from loganalytics.spool import get_spool_path
+from storage.adls import (
+    SINGLE_SHOT_THRESHOLD,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_MAX_CONCURRENCY,
+    get_adls_client,
+    tune_upload,
+)
 
 KNMI_API_ROOT = "https://api.dataplatform.knmi.nl/open-data/v1"
 
@@ -28,33 +78,430 @@ SYNOPTIC_ENDPOINT = (
     f"{KNMI_API_ROOT}/datasets/Actuele10mindataKNMIstations/versions/2/files"
 )
 
+# Files requested per listing page, the maximum the KNMI API allows
+MAX_RESULTS = 1000
+
+# Bytes read from a download at a time, and kept in memory before spilling to disk, when streaming
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Files transferred at the same time. Transfers mostly wait on the network, so threads suffice
+DEFAULT_MAX_WORKERS = 8
+
+# Seconds a run may start new transfers for. Below the default Function timeout of 5 minutes, so
+# running transfers can finish and the state is saved before the host stops the invocation
+DEFAULT_TIME_BUDGET = 240.0
+
+T = TypeVar("T")
+
+
+class TransferResult(NamedTuple):
+    filename: str
+    size: int
+    seconds: float
+    error: Optional[str] = None
+    md5: Optional[str] = None
+    unchanged: bool = False
+    # Not transferred because the deadline of the run was reached, left for the next run
+    deferred: bool = False
+
+
+class StreamedFile(NamedTuple):
+    size: int
+    md5: str
+    unchanged: bool
+
+
+class ProcessReport(NamedTuple):
+    results: List[TransferResult]
+    seconds: float
+    skipped: int = 0
+    queued: int = 0
+    dead_letters: int = 0
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.failed
+
+    @property
+    def failed(self) -> List[TransferResult]:
+        return [
+            result
+            for result in self.results
+            if result.error is not None and not result.deferred
+        ]
+
+    @property
+    def deferred(self) -> List[TransferResult]:
+        return [result for result in self.results if result.deferred]
+
+    @property
+    def unchanged(self) -> List[TransferResult]:
+        return [result for result in self.results if result.unchanged]
+
+    @property
+    def byte_count(self) -> int:
+        return sum(
+            result.size
+            for result in self.results
+            if result.error is None and not result.unchanged
+        )
+
+    def summary(self) -> str:
+        transferred = (
+            len(self.results)
+            - len(self.failed)
+            - len(self.unchanged)
+            - len(self.deferred)
+        )
+        megabytes = self.byte_count / 1e6
+        seconds = self.seconds or 1e-9
+        summary = (
+            f"Transferred {transferred} files ({megabytes:.2f} MB) in {self.seconds:.2f}s: "
+            f"{megabytes / seconds:.2f} MB/s. Skipped {self.skipped} already uploaded files and "
+            f"{len(self.unchanged)} downloaded files with unchanged content. "
+            f"Failed {len(self.failed)} files, {self.queued} files queued for retry, "
+            f"{self.dead_letters} files given up on. Deferred {len(self.deferred)} files to the "
+            f"next run"
+        )
+        for result in self.failed:
+            summary += f"\n{result.filename} failed: {result.error}"
+        return summary
+
 
 class Processor:
     def __init__(
         self,
-        logger: LogAnalyticsWorkspaceLogger,
+        logger: SupportsLog,
         adls_client: FileSystemClient,
+        max_results: int = MAX_RESULTS,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        knmi_client: Optional[KNMIClient] = None,
+        manifest_path: Optional[str] = MANIFEST_PATH,
+        incremental: bool = False,
+        watermark_path: str = WATERMARK_PATH,
+        streaming: bool = False,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        retry_queue_path: Optional[str] = RETRY_QUEUE_PATH,
+        single_shot_threshold: int = SINGLE_SHOT_THRESHOLD,
+        upload_chunk_size: int = UPLOAD_CHUNK_SIZE,
+        upload_max_concurrency: int = UPLOAD_MAX_CONCURRENCY,
+        deadline: Optional[float] = None,
     ):
+        """
+        :param max_results: Files requested per listing page
+        :param max_workers: Files downloaded and uploaded at the same time
+        :param knmi_client: Client for all KNMI requests. Defaults to the cached client of this
+          process with a connection pool sized for max_workers
+        :param manifest_path: ADLS path of the manifest of uploaded files, None to upload every
+          listed file
+        :param incremental: Only list files after the watermark, the last filename a previous run
+          processed together with all files before it
+        :param watermark_path: ADLS path of the watermark
+        :param streaming: Download each file in chunks to a temporary file instead of into memory
+          first, and upload it with at most chunk_size bytes read at once, bounding memory per
+          transfer by chunk_size
+        :param chunk_size: Bytes per chunk when streaming
+        :param retry_queue_path: ADLS path of the queue of failed files to retry in later runs,
+          None to not retry failed files
+        :param single_shot_threshold: Largest file uploaded to ADLS in a single request
+        :param upload_chunk_size: Bytes per append request for larger files
+        :param upload_max_concurrency: Maximum parallel append requests per larger file
+        :param deadline: time.monotonic() time after which no new files are started and KNMI
+          requests no longer wait for the rate limit, so the run ends before the Function timeout.
+          None to not limit the run
+        """
         self.logger = logger
         self.adls_client = adls_client
+        self.max_results = max_results
+        self.max_workers = max_workers
+        self.knmi_client = knmi_client or get_knmi_client(
+            pool_maxsize=max(1, max_workers)
+        )
+        self.manifest_path = manifest_path
+        self.incremental = incremental
+        self.watermark_path = watermark_path
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.retry_queue_path = retry_queue_path
+        self.single_shot_threshold = single_shot_threshold
+        self.upload_chunk_size = upload_chunk_size
+        self.upload_max_concurrency = upload_max_concurrency
+        self.deadline = deadline
+        self._stopped = Event()
+
+    def process(self, api_key: str) -> ProcessReport:
+        """
+        Transfer all listed files from KNMI to ADLS on a pool of max_workers threads, so URL
+        lookups, downloads and uploads of different files overlap. At most max_workers files are
+        in flight, the listing is only read further when a transfer finishes. The next listing
+        page is fetched in the background while the files of the current page are transferred.
+
+        Every file is processed independently, a file that fails validation or transfer is
+        reported as failed without stopping the others. Failed transfers are put on the retry
+        queue and retried with exponential backoff by later runs, before the listed files. Files
+        that failed MAX_ATTEMPTS times stay in the queue as dead letters and are skipped.
 
-    def process(self, api_key: str):
-        file_list = self.get_file_list(api_key)
-        for f in file_list:
-            fname = f["filename"]
-            if not isinstance(fname, str):
-                raise SynopticDataValidationError(
-                    f"Invalid type {type(fname)}: for {fname}"
+        Files recorded in the manifest with the same size and lastModified are skipped. The
+        manifest and retry queue are saved at the end, also when the listing fails, so finished
+        uploads are kept.
+
+        When incremental, KNMI is asked for the files after the watermark only. The watermark is
+        advanced past the files that were uploaded, skipped or queued for retry, but never past a
+        failed file that is not queued.
+
+        With a deadline no new files are started once it is reached, or once a KNMI request
+        would have to wait past it for the rate limit. Those files are reported as deferred and
+        are not put on the retry queue, the next run lists them again.
+        """
+        started = perf_counter()
+        now = datetime.utcnow()
+        manifest = (
+            UploadManifest.load(self.adls_client, self.manifest_path)
+            if self.manifest_path
+            else None
+        )
+        retry_queue = (
+            RetryQueue.load(self.adls_client, self.retry_queue_path)
+            if self.retry_queue_path
+            else None
+        )
+        watermark = (
+            load_watermark(self.adls_client, self.watermark_path)
+            if self.incremental
+            else None
+        )
+        if watermark:
+            self.logger.log(
+                message=f"Listing files after watermark {watermark}",
+                severity=logging.INFO,
+            )
+        due = retry_queue.due(now) if retry_queue is not None else []
+        files: Iterable = chain(
+            ((f, False) for f in due),
+            (
+                (f, True)
+                for f in self.iter_file_list(
+                    api_key, start_after_filename=watermark, prefetch=True
                 )
-            if not validate_file_extension(fname):
-                raise SynopticDataValidationError(
-                    f"Invalid file extension for file: {fname}"
+            ),
+        )
+        results: List[TransferResult] = []
+        listed: List[str] = []
+        seen: Set[str] = set()
+        processed: Set[str] = set()
+        skipped = 0
+        self._stopped = Event()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+                in_flight: Dict[Future, FileInfo] = {}
+                # A failing listing page leaves the loop while transfers are in flight, they are
+                # still collected so their outcome is recorded in the manifest and retry queue
+                try:
+                    for f, is_listed in self._until_deadline(files):
+                        fname = str(f["filename"])
+                        if is_listed:
+                            listed.append(fname)
+                        if fname in seen:
+                            continue
+                        seen.add(fname)
+                        try:
+                            self.validate_filename(f["filename"])
+                        except SynopticDataValidationError as e:
+                            # Invalid files can never succeed, they do not hold back the watermark
+                            results.append(TransferResult(fname, 0, 0.0, str(e)))
+                            processed.add(fname)
+                            continue
+                        if retry_queue is not None and retry_queue.is_waiting(
+                            fname, now
+                        ):
+                            processed.add(fname)
+                            continue
+                        if manifest is not None and manifest.is_uploaded(f):
+                            processed.add(fname)
+                            skipped += 1
+                            continue
+                        if len(in_flight) >= max(1, self.max_workers):
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            results.extend(
+                                self._collect(done, in_flight, manifest, retry_queue)
+                            )
+                            if self._stopped.is_set():
+                                break
+                        previous_md5 = (
+                            manifest.get_md5(fname) if manifest is not None else None
+                        )
+                        in_flight[
+                            executor.submit(
+                                self.transfer_file, fname, api_key, previous_md5
+                            )
+                        ] = f
+                finally:
+                    results.extend(
+                        self._collect(
+                            wait(in_flight).done, in_flight, manifest, retry_queue
+                        )
+                    )
+            # An incremental or interrupted listing is incomplete, pruning with it would drop the
+            # entries of files that were not listed
+            if not self.incremental and not self._stopped.is_set():
+                if manifest is not None:
+                    manifest.prune(set(listed))
+                if retry_queue is not None:
+                    retry_queue.prune(set(listed))
+        finally:
+            if manifest is not None and manifest.changed:
+                manifest.save(self.adls_client, self.manifest_path)  # type: ignore
+            if retry_queue is not None and retry_queue.changed:
+                retry_queue.save(self.adls_client, self.retry_queue_path)  # type: ignore
+            if self.incremental:
+                for result in results:
+                    if result.error is None or (
+                        retry_queue is not None
+                        and result.filename in retry_queue.entries
+                    ):
+                        processed.add(result.filename)
+                new_watermark = advance_watermark(watermark, listed, processed)
+                if new_watermark is not None and new_watermark != watermark:
+                    save_watermark(self.adls_client, new_watermark, self.watermark_path)
+
+        if self._stopped.is_set():
+            self.logger.log(
+                message="Deadline reached, leaving the remaining files for the next run",
+                severity=logging.WARNING,
+            )
+        report = ProcessReport(
+            results,
+            perf_counter() - started,
+            skipped=skipped,
+            queued=(
+                len(retry_queue.entries) - len(retry_queue.dead_letters)
+                if retry_queue is not None
+                else 0
+            ),
+            dead_letters=(
+                len(retry_queue.dead_letters) if retry_queue is not None else 0
+            ),
+        )
+        self.logger.log(
+            message=report.summary(),
+            severity=logging.INFO if report.succeeded else logging.ERROR,
+        )
+        if self.knmi_client.rate_limiter is not None:
+            self.logger.log(
+                message=f"KNMI rate limiter: {self.knmi_client.rate_limiter.summary()}",
+                severity=logging.INFO,
+            )
+        return report
+
+    def deadline_reached(self) -> bool:
+        return self.deadline is not None and monotonic() >= self.deadline
+
+    def _until_deadline(self, files: Iterable[T]) -> Iterator[T]:
+        """
+        Yield files until the deadline is reached or a KNMI request would have to wait past it,
+        the remaining files are left for the next run
+        """
+        try:
+            for f in files:
+                if self.deadline_reached():
+                    self._stopped.set()
+                if self._stopped.is_set():
+                    return
+                yield f
+        except SynopticDataDeadlineError:
+            self._stopped.set()
+
+    @staticmethod
+    def validate_filename(fname: Union[str, int]):
+        if not isinstance(fname, str):
+            raise SynopticDataValidationError(
+                f"Invalid type {type(fname)}: for {fname}"
+            )
+        if not validate_file_extension(fname):
+            raise SynopticDataValidationError(
+                f"Invalid file extension for file: {fname}"
+            )
+
+    @staticmethod
+    def _collect(
+        done: Set[Future],
+        in_flight: Dict[Future, FileInfo],
+        manifest: Optional[UploadManifest],
+        retry_queue: Optional[RetryQueue],
+    ) -> List[TransferResult]:
+        """
+        Return the results of finished transfers, record successes in the manifest and put
+        failures on the retry queue. Deferred transfers are left for the next run as they are
+        """
+        results = []
+        for future in done:
+            file_info = in_flight.pop(future)
+            result = future.result()
+            results.append(result)
+            if result.deferred:
+                continue
+            if result.error is None:
+                if manifest is not None:
+                    manifest.record(file_info, result.md5)
+                if retry_queue is not None:
+                    retry_queue.remove(result.filename)
+            elif retry_queue is not None:
+                retry_queue.record_failure(file_info, result.error, datetime.utcnow())
+        return results
+
+    def transfer_file(
+        self, filename: str, api_key: str, previous_md5: Optional[str] = None
+    ) -> TransferResult:
+        """
+        Download a file and upload it to ADLS, errors are returned in the result. The MD5 of the
+        content is computed during the download, if it equals previous_md5 the upload is skipped.
+        """
+        started = perf_counter()
+        try:
+            if self.streaming:
+                size, md5, unchanged = self.stream_file_to_adls(
+                    filename, api_key, previous_md5
                 )
-            file_content = self.get_file_content(fname, api_key)
-            self.upload_file_content_to_adls(data=file_content, filename=fname)
+            else:
+                file_content = self.get_file_content(filename, api_key)
+                size = len(file_content)
+                md5 = hashlib.md5(file_content).hexdigest()
+                unchanged = md5 == previous_md5
+                if not unchanged:
+                    self.upload_file_content_to_adls(
+                        data=file_content, filename=filename, md5=md5
+                    )
+        except SynopticDataDeadlineError as e:
+            self._stopped.set()
+            return TransferResult(
+                filename, 0, perf_counter() - started, str(e), deferred=True
+            )
+        except (SynopticDataError, RequestException, HttpResponseError) as e:
+            return TransferResult(filename, 0, perf_counter() - started, str(e))
+        if unchanged:
+            self.logger.log(
+                message=f"Skipped upload of {filename}, content is unchanged",
+                severity=logging.INFO,
+            )
+        return TransferResult(
+            filename, size, perf_counter() - started, md5=md5, unchanged=unchanged
+        )
 
-    def get_file_list(self, api_key: str) -> List[Dict[str, Union[str, int]]]:
-        """Get list of files from KNMI API. Example response from KNMI API:
+    def get_file_list(self, api_key: str) -> List[FileInfo]:
+        """Get list of all files from KNMI API, following every page. See iter_file_list"""
+        return list(self.iter_file_list(api_key))
+
+    def iter_file_list(
+        self,
+        api_key: str,
+        start_after_filename: Optional[str] = None,
+        prefetch: bool = False,
+    ) -> Iterator[FileInfo]:
+        """Lazily yield files from KNMI API, so downloads can start before the listing completes.
+        Without prefetch the next page is only requested when the files of the previous page have
+        been consumed. With prefetch the next page is requested on a background thread as soon as
+        a page arrives, so it is fetched while the files of the current page are downloaded.
+        Example page from KNMI API:
         {
             "isTruncated": true,
             "resultCount": 1,
@@ -66,26 +513,88 @@ class Processor:
                 },
             ],
             "maxResults": 10,
-            "startAfterFilename": ""
-        }"""
-        headers = {"Authorization": api_key}
+            "startAfterFilename": "",
+            "nextPageToken": "..."
+        }
+        Files are listed in ascending filename order, which is chronological for KNMI filenames.
+        Pages are followed with nextPageToken when KNMI returns one, otherwise with
+        startAfterFilename set to the last filename of the previous page.
+
+        :param api_key: KNMI API key
+        :param start_after_filename: Only list files sorted after this filename
+        :param prefetch: Request the next page while the current page is consumed
+        """
+        first_params = self._list_params()
+        if start_after_filename:
+            first_params["startAfterFilename"] = start_after_filename
+        params: Optional[Dict[str, Union[str, int]]] = first_params
+
+        if not prefetch:
+            while params is not None:
+                page = self._get_file_list_page(api_key, params)
+                params = self._next_list_params(page)
+                yield from page["files"]
+            return
 
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page: Optional[Future] = executor.submit(
+                self._get_file_list_page, api_key, first_params
+            )
+            while next_page is not None:
+                page = next_page.result()
+                params = self._next_list_params(page)
+                next_page = (
+                    executor.submit(self._get_file_list_page, api_key, params)
+                    if params is not None
+                    else None
+                )
+                yield from page["files"]
+
+    def _next_list_params(self, page: dict) -> Optional[Dict[str, Union[str, int]]]:
+        """Return the params of the page after page, None if page is the last page"""
+        files = page["files"]
+        if not page.get("isTruncated") or not files:
+            return None
+        params = self._list_params()
+        if page.get("nextPageToken"):
+            params["nextPageToken"] = page["nextPageToken"]
+        else:
+            params["startAfterFilename"] = files[-1]["filename"]
+        return params
+
+    def _list_params(self) -> Dict[str, Union[str, int]]:
+        return {"maxResults": self.max_results, "orderBy": "filename", "sorting": "asc"}
+
+    def _get_file_list_page(
+        self, api_key: str, params: Dict[str, Union[str, int]]
+    ) -> dict:
         try:
-            resp = requests.get(url=SYNOPTIC_ENDPOINT, headers=headers)
-        except HTTPError as err:
+            resp = self.knmi_client.get(
+                SYNOPTIC_ENDPOINT,
+                api_key=api_key,
+                deadline=self.deadline,
+                params=params,
+            )
+        except RequestException as err:
             raise SynopticDataError(
-                f"Unexpected HTTPError while getting file list from {SYNOPTIC_ENDPOINT}: "
-                f"{str(err)}"
+                f"Unexpected {type(err).__name__} while getting file list from "
+                f"{SYNOPTIC_ENDPOINT}: {str(err)}"
             )
         if resp.status_code == 200:
+            try:
+                page = resp.json()
+                file_count = len(page["files"])
+            except (ValueError, KeyError, TypeError) as err:
+                raise SynopticDataError(
+                    f"Invalid file list from {SYNOPTIC_ENDPOINT}: {type(err).__name__} "
+                    f"{str(err)} Content: {str(resp.content)}"
+                )
             self.logger.log(
-                message=f"Successfully got {len(resp.json()['files'])} filenames from: "
+                message=f"Successfully got {file_count} filenames from: "
                 f"{SYNOPTIC_ENDPOINT}",
                 severity=logging.INFO,
             )
-            # TODO: KNMI Returns is_truncated value. Use this to determine if theres more files
-            #  to get then get these. For now just grab whatever comes in
-            return resp.json()["files"]
+            return page
 
         else:
             raise SynopticDataError(
@@ -95,52 +604,101 @@ class Processor:
 
     def get_file_content(self, filename: str, api_key: str) -> bytes:
         """Get file content of a specific KNMI files"""
+        content_url = self.get_content_url(filename, api_key)
+        try:
+            file_resp = self.knmi_client.get(content_url)
+        except RequestException as err:
+            raise SynopticDataError(
+                f"Unexpected {type(err).__name__} while getting content from url "
+                f"{content_url}:"
+                f" {str(err)}"
+            )
+
+        if file_resp.status_code == 200:
+            return file_resp.content
+        else:
+            raise SynopticDataError(
+                f"Unexpected status code {file_resp.status_code} for getting content from url "
+                f"{content_url} Content: {str(file_resp.content)}"
+            )
+
+    def get_content_url(self, filename: str, api_key: str) -> str:
+        """Get the temporary download URL of a specific KNMI file"""
         url = f"{SYNOPTIC_ENDPOINT}/{filename}/url"
-        headers = {"Authorization": api_key}
         try:
-            resp = requests.get(url=url, headers=headers)
-        except HTTPError as err:
+            resp = self.knmi_client.get(url, api_key=api_key, deadline=self.deadline)
+        except RequestException as err:
             raise SynopticDataError(
-                f"Unexpected HTTPError while getting content URL from {url}: {str(err)}"
+                f"Unexpected {type(err).__name__} while getting content URL from {url}: "
+                f"{str(err)}"
             )
         if resp.status_code == 200:
+            try:
+                content_url = resp.json()["temporaryDownloadUrl"]
+            except (ValueError, KeyError, TypeError) as err:
+                raise SynopticDataError(
+                    f"Invalid content URL response from {url}: {type(err).__name__} "
+                    f"{str(err)} Content: {str(resp.content)}"
+                )
             self.logger.log(
                 message=f"Successfully got content url for {filename} from: {url}",
                 severity=logging.INFO,
             )
-            content_url = resp.json()["temporaryDownloadUrl"]
-            try:
-                file_resp = requests.get(content_url)
-            except HTTPError as err:
-                raise SynopticDataError(
-                    f"Unexpected HTTPError while getting content from url {content_url}:"
-                    f" {str(err)}"
-                )
-
-            if file_resp.status_code == 200:
-                return file_resp.content
-            else:
-                raise SynopticDataError(
-                    f"Unexpected status code {file_resp.status_code} for getting content from url "
-                    f"{content_url} Content: {str(file_resp.content)}"
-                )
+            return content_url
         else:
             raise SynopticDataError(
                 f"Unexpected status code {resp.status_code} for getting content URL from "
                 f"URI: {url} Content: {str(resp.content)}"
             )
 
-    def upload_file_content_to_adls(self, data: bytes, filename: str):
+    def upload_file_content_to_adls(
+        self,
+        data: Union[bytes, IO[bytes]],
+        filename: str,
+        md5: Optional[str] = None,
+        length: Optional[int] = None,
+    ):
+        """
+        Upload file content to ADLS, storing its MD5 as Content-MD5 and md5 metadata. upload_data
+        creates the file itself when overwriting, so no separate create_file request is made.
+        Chunk size and concurrency are tuned to the size of the file, see tune_upload. Streams
+        are uploaded with at most chunk_size bytes in memory at once.
+
+        :param data: File content, or a binary stream of it
+        :param md5: Hex MD5 of the content, required for streams
+        :param length: Size of the content in bytes, required for streams
+        """
         self.logger.log(message=f"Uploading file: {filename}", severity=logging.INFO)
-        current_hour = datetime.utcnow().strftime("%Y/%m/%d/%H")
-        upload_path = f"{splitext(filename)[1].lstrip('.')}/{current_hour}/{filename}"
+        upload_path = get_upload_path(filename)
+        if isinstance(data, bytes):
+            length = len(data)
+            md5 = md5 or hashlib.md5(data).hexdigest()
+        metadata = {"md5": md5}
+        content_settings = ContentSettings(content_md5=bytearray.fromhex(md5))  # type: ignore
         try:
-            f = self.adls_client.create_file(upload_path)
-            # TODO: Check if types match for data from KNMI and what Azure expects/allows for blob
-            f.upload_data(data=data, overwrite=True)  # type: ignore
+            if not length:
+                # upload_data does not create empty files
+                self.adls_client.create_file(
+                    upload_path, metadata=metadata, content_settings=content_settings
+                )
+            else:
+                settings = tune_upload(
+                    length,
+                    self.single_shot_threshold,
+                    self.upload_chunk_size,
+                    self.upload_max_concurrency,
+                    max_buffered=None if isinstance(data, bytes) else self.chunk_size,
+                )
+                self.adls_client.get_file_client(upload_path).upload_data(
+                    data=data,  # type: ignore
+                    length=length,
+                    overwrite=True,
+                    metadata=metadata,
+                    content_settings=content_settings,
+                    chunk_size=settings.chunk_size,
+                    max_concurrency=settings.max_concurrency,
+                )
         except HttpResponseError as e:
-            # TODO: We might not want to fail on one failed upload, consider retrying or uploading
-            #  other files before raising
             raise SynopticDataError(
                 f"Unexpected HttpResponseError when attempting to upload {filename} to "
                 f"{self.adls_client.account_name}. Full error: {str(e)}"
@@ -150,20 +708,109 @@ class Processor:
             severity=logging.INFO,
         )
 
+    def stream_file_to_adls(
+        self, filename: str, api_key: str, previous_md5: Optional[str] = None
+    ) -> StreamedFile:
+        """
+        Download a KNMI file in chunks of chunk_size bytes into a temporary file that only keeps
+        chunk_size bytes in memory, computing its MD5 on the way. If the MD5 equals previous_md5
+        nothing is written to ADLS, otherwise the temporary file is uploaded with
+        upload_file_content_to_adls.
+        """
+        content_url = self.get_content_url(filename, api_key)
+        try:
+            file_resp = self.knmi_client.get(content_url, stream=True)
+        except RequestException as err:
+            raise SynopticDataError(
+                f"Unexpected {type(err).__name__} while getting content from url "
+                f"{content_url}:"
+                f" {str(err)}"
+            )
+        with file_resp, SpooledTemporaryFile(max_size=self.chunk_size) as content:
+            if file_resp.status_code != 200:
+                raise SynopticDataError(
+                    f"Unexpected status code {file_resp.status_code} for getting content from "
+                    f"url {content_url} Content: {str(file_resp.content)}"
+                )
+            md5 = hashlib.md5()
+            try:
+                for chunk in file_resp.iter_content(chunk_size=self.chunk_size):
+                    md5.update(chunk)
+                    content.write(chunk)
+            except RequestException as err:
+                raise SynopticDataError(
+                    f"Unexpected {type(err).__name__} while streaming content from url "
+                    f"{content_url}: {str(err)}"
+                )
+            size = content.tell()
+            if md5.hexdigest() == previous_md5:
+                return StreamedFile(size, md5.hexdigest(), True)
+            content.seek(0)
+            self.upload_file_content_to_adls(
+                data=content,  # type: ignore
+                filename=filename,
+                md5=md5.hexdigest(),
+                length=size,
+            )
+        return StreamedFile(size, md5.hexdigest(), False)
+
+
+def get_upload_path(filename: str) -> str:
+    """Return the ADLS path for a KNMI file: {extension}/{current UTC hour}/{filename}"""
+    current_hour = datetime.utcnow().strftime("%Y/%m/%d/%H")
+    return f"{splitext(filename)[1].lstrip('.')}/{current_hour}/{filename}"
+
 
 # Azure typechecks this signature. So do not touch it
 def main(timer: TimerRequest):
+    deadline = monotonic() + float(environ.get("KNMITIMEBUDGET", DEFAULT_TIME_BUDGET))
     azure_logger = LogAnalyticsWorkspaceLogger(
         workspace_id=environ["LAWID"],
         shared_key=environ["LAWKEY"],
         custom_log_table_name="GetActualTenMinSynopticData",
+        batch=environ.get("LAWBATCH", "").lower() == "true",
+        background=environ.get("LAWBACKGROUND", "").lower() == "true",
+        spool_path=(
+            get_spool_path("GetActualTenMinSynopticData")
+            if environ.get("LAWSPOOL", "").lower() == "true"
+            else None
+        ),
     )
+    # Send the log records earlier invocations could not deliver
+    azure_logger.replay_spool()
     adls_client = get_adls_client(
         account_name=environ["ADLSACCOUNTNAME"],
         account_key=environ["ADLSACCOUNTKEY"],
         container="knmisynoptic",
     )
-    proc = Processor(logger=azure_logger, adls_client=adls_client)
+    max_workers = int(environ.get("KNMIMAXWORKERS", DEFAULT_MAX_WORKERS))
+    # KNMIRATELIMIT requests are allowed per KNMIRATEPERIOD seconds by the API key quota
+    rate_limit = int(environ.get("KNMIRATELIMIT", 0))
+    knmi_client = get_knmi_client(
+        pool_maxsize=max(1, max_workers),
+        rate_limit=(
+            rate_limit / int(environ.get("KNMIRATEPERIOD", 3600))
+            if rate_limit
+            else None
+        ),
+    )
+    proc = Processor(
+        logger=azure_logger,
+        adls_client=adls_client,
+        max_workers=max_workers,
+        knmi_client=knmi_client,
+        incremental=environ.get("KNMIINCREMENTAL", "").lower() == "true",
+        streaming=environ.get("KNMISTREAMING", "").lower() == "true",
+        chunk_size=int(environ.get("KNMISTREAMCHUNKSIZE", STREAM_CHUNK_SIZE)),
+        single_shot_threshold=int(
+            environ.get("ADLSSINGLESHOTSIZE", SINGLE_SHOT_THRESHOLD)
+        ),
+        upload_chunk_size=int(environ.get("ADLSCHUNKSIZE", UPLOAD_CHUNK_SIZE)),
+        upload_max_concurrency=int(
+            environ.get("ADLSMAXCONCURRENCY", UPLOAD_MAX_CONCURRENCY)
+        ),
+        deadline=deadline,
+    )
     try:
         proc.process(environ["KNMIAPIKEY"])
     except (SynopticDataError, SynopticDataValidationError) as e:
@@ -172,3 +819,6 @@ def main(timer: TimerRequest):
             severity=logging.ERROR,
         )
         raise
+    finally:
+        azure_logger.log_stats()
+        azure_logger.close(timeout=DEFAULT_CLOSE_TIMEOUT)
@@ -0,0 +1,265 @@
+from datetime import (
+    datetime,
+    timezone,
+)
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import (
+    monotonic,
+    sleep,
+)
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Optional,
+    Tuple,
+)
+
+import requests
+from requests.adapters import (
+    HTTPAdapter,
+    Retry,
+)
+
+from GetActualTenMinSynopticData.errors import SynopticDataDeadlineError
+
+# Connections kept open per host. Should be at least the number of concurrent transfers
+DEFAULT_POOL_MAXSIZE = 8
+
+# Hosts with a connection pool, the KNMI API and the host of the temporary download URLs
+DEFAULT_POOL_CONNECTIONS = 4
+
+# Seconds to wait for a connection and for data on that connection
+DEFAULT_TIMEOUT = (10.0, 60.0)
+
+RETRYABLE_ERROR_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Requests that may be made back to back before the rate limit spreads them out
+DEFAULT_BURST = 10
+
+# Seconds to wait after a 429 response without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 30.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens are added at rate per second up to capacity, every request
+    takes one and waits until it is available, so requests are spread evenly once a burst of
+    capacity requests is used up. pause stops all requests, for instance until a Retry-After.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: int = DEFAULT_BURST,
+        clock: Callable[[], float] = monotonic,
+        sleep: Callable[[float], None] = sleep,
+    ):
+        """
+        :param rate: Tokens added per second, the sustained requests per second
+        :param capacity: Maximum number of tokens, the largest burst of requests
+        :param clock: Monotonic clock in seconds
+        :param sleep: Function to wait for a number of seconds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = Lock()
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self.acquired = 0
+        self.throttled = 0
+        self.pauses = 0
+        self.deadline_exceeded = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+    @property
+    def remaining(self) -> int:
+        """Requests that can be made right now without waiting"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            # Tokens go negative while they are reserved by waiting callers
+            return max(0, int(self._tokens)) if self._updated <= now else 0
+
+    def acquire(self, deadline: Optional[float] = None) -> float:
+        """
+        Take a token, waiting until one is available. The token is reserved before waiting, so
+        concurrent callers queue up behind each other instead of racing for the same token.
+
+        :param deadline: Time on the clock the token must be available by. If it is not, no token
+          is taken and SynopticDataDeadlineError is raised instead of waiting
+        :return: Seconds waited
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            wait = (
+                max(0.0, self._updated - now) + max(0.0, 1.0 - self._tokens) / self.rate
+            )
+            if deadline is not None and now + wait > deadline:
+                self.deadline_exceeded += 1
+                raise SynopticDataDeadlineError(
+                    f"Waiting {wait:.1f}s for the KNMI rate limit would pass the deadline"
+                )
+            self._tokens -= 1
+            self.acquired += 1
+            if wait > 0:
+                self.throttled += 1
+                self.wait_seconds += wait
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def pause(self, seconds: float):
+        """Make all requests wait at least seconds from now, without adding tokens meanwhile"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._updated = max(self._updated, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+            self.pauses += 1
+
+    def summary(self) -> str:
+        return (
+            f"requests={self.acquired} throttled={self.throttled} pauses={self.pauses} "
+            f"deadline_exceeded={self.deadline_exceeded} "
+            f"wait_seconds={self.wait_seconds:.2f} remaining={self.remaining}"
+        )
+
+
+def get_retry_after(
+    response: requests.Response, default: float = DEFAULT_RETRY_AFTER
+) -> float:
+    """Return the seconds to wait from a Retry-After header in seconds or HTTP date format"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class KNMIClient:
+    """
+    HTTP client for the KNMI Open Data API and its temporary download URLs.
+
+    All requests go through one requests.Session, so connections to both hosts are kept alive and
+    reused instead of opening a new TCP and TLS connection per request. Responses with a retryable
+    status code are retried with exponential backoff, waiting for Retry-After when it is sent. When
+    the retries run out the last response is returned, so callers can handle its status code.
+
+    With a rate_limit, API requests are spread out by a TokenBucket shared by all threads using
+    the client. A 429 response then pauses the bucket until its Retry-After for every thread and
+    the request is retried, instead of each thread backing off on its own.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        retryable_error_codes: FrozenSet[int] = RETRYABLE_ERROR_CODES,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        rate_limit: Optional[float] = None,
+        burst: int = DEFAULT_BURST,
+    ):
+        """
+        :param pool_maxsize: Connections kept open per host
+        :param max_retries: Times a request is retried on connection errors and retryable codes
+        :param backoff_factor: Wait time between retries is
+          {backoff factor} * (2 ** ({number of total retries} - 1)). See Retry docs for more info
+        :param retryable_error_codes: Status codes to retry, 429 waits for Retry-After
+        :param timeout: Connect and read timeout in seconds
+        :param rate_limit: Sustained API requests per second allowed by the API key quota. None
+          to not limit requests
+        :param burst: API requests allowed back to back when rate limited
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        if self.rate_limiter is not None:
+            # 429 responses are handled by the rate limiter
+            retryable_error_codes = retryable_error_codes - {429}
+        self.session = requests.Session()
+        retry_config = Retry(
+            total=max_retries,
+            status_forcelist=retryable_error_codes,
+            backoff_factor=backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=DEFAULT_POOL_CONNECTIONS,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry_config,
+        )
+        self.session.mount("https://", adapter)
+
+    def get(
+        self,
+        url: str,
+        api_key: Optional[str] = None,
+        deadline: Optional[float] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """
+        GET a URL on the shared session.
+
+        :param url: URL to get
+        :param api_key: KNMI API key, sent as Authorization header. Leave out for temporary
+          download URLs, which are pre-signed, must not receive the key and are not rate limited
+        :param deadline: time.monotonic() time the request must be sent by. Raises
+          SynopticDataDeadlineError instead of waiting past it for the rate limit
+        :param kwargs: Other requests arguments, such as params or stream
+        """
+        headers = kwargs.pop("headers", {})
+        if api_key is not None:
+            headers["Authorization"] = api_key
+        kwargs.setdefault("timeout", self.timeout)
+        if api_key is None or self.rate_limiter is None:
+            return self.session.get(url, headers=headers, **kwargs)
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(deadline)
+            response = self.session.get(url, headers=headers, **kwargs)
+            if response.status_code != 429 or attempt == self.max_retries:
+                break
+            self.rate_limiter.pause(get_retry_after(response))
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+# Clients are cached per process, so warm Function hosts reuse open connections across
+# invocations
+_CLIENTS: Dict[Tuple, KNMIClient] = {}
+_CLIENTS_LOCK = Lock()
+
+
+def get_knmi_client(**options: Any) -> KNMIClient:
+    """Return the cached KNMIClient for the given KNMIClient options, creating it on first use"""
+    key = tuple(sorted(options.items()))
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = KNMIClient(**options)
+            _CLIENTS[key] = client
+    return client
@@ -0,0 +1,242 @@
+import json
+from datetime import (
+    datetime,
+    timedelta,
+)
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Union,
+)
+
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceNotFoundError,
+)
+from azure.storage.filedatalake import FileSystemClient
+
+from GetActualTenMinSynopticData.errors import SynopticDataError
+
+# Location of the manifest in the container the synoptic files are uploaded to
+MANIFEST_PATH = "manifest/uploaded_files.json"
+WATERMARK_PATH = "manifest/watermark.json"
+RETRY_QUEUE_PATH = "manifest/retry_queue.json"
+
+# Delay before the first retry of a failed file, doubled after every further failure
+RETRY_BASE_DELAY = timedelta(minutes=10)
+RETRY_MAX_DELAY = timedelta(hours=24)
+# Failed transfers after which a file is dropped from the retry queue
+MAX_ATTEMPTS = 10
+
+FileInfo = Dict[str, Union[str, int]]
+
+
+def read_json(
+    adls_client: FileSystemClient, path: str, description: str
+) -> Optional[Any]:
+    """Read and decode a JSON file from ADLS, returns None if it does not exist"""
+    try:
+        data = adls_client.get_file_client(path).download_file().readall()
+    except ResourceNotFoundError:
+        return None
+    except HttpResponseError as e:
+        raise SynopticDataError(
+            f"Unexpected HttpResponseError when attempting to read {description} {path} from "
+            f"{adls_client.account_name}. Full error: {str(e)}"
+        )
+    return json.loads(data)
+
+
+def write_json(adls_client: FileSystemClient, path: str, description: str, value: Any):
+    """Write a value as compact JSON to ADLS, replacing the file if it exists"""
+    data = json.dumps(value, separators=(",", ":"), sort_keys=True)
+    try:
+        adls_client.get_file_client(path).upload_data(data=data, overwrite=True)
+    except HttpResponseError as e:
+        raise SynopticDataError(
+            f"Unexpected HttpResponseError when attempting to write {description} {path} to "
+            f"{adls_client.account_name}. Full error: {str(e)}"
+        )
+
+
+class UploadManifest:
+    """
+    Index of uploaded KNMI files, stored as a single compact JSON file in ADLS mapping each
+    filename to the size and lastModified the KNMI listing reported when it was uploaded, and the
+    MD5 of its content.
+    """
+
+    def __init__(
+        self, entries: Optional[Dict[str, List[Union[str, int, None]]]] = None
+    ):
+        self.entries = entries or {}
+        self.changed = False
+
+    def is_uploaded(self, file_info: FileInfo) -> bool:
+        """Return True if the file was uploaded before with the same size and lastModified"""
+        entry = self.entries.get(str(file_info["filename"]))
+        return entry is not None and entry[:2] == [
+            file_info.get("size"),
+            file_info.get("lastModified"),
+        ]
+
+    def get_md5(self, filename: str) -> Optional[str]:
+        """Return the MD5 of the content of the file when it was last uploaded"""
+        entry = self.entries.get(filename)
+        return entry[2] if entry is not None and len(entry) > 2 else None  # type: ignore
+
+    def record(self, file_info: FileInfo, md5: Optional[str] = None):
+        self.entries[str(file_info["filename"])] = [
+            file_info.get("size"),  # type: ignore
+            file_info.get("lastModified"),  # type: ignore
+            md5,  # type: ignore
+        ]
+        self.changed = True
+
+    def prune(self, filenames: Set[str]) -> int:
+        """
+        Drop entries for files that are no longer listed by KNMI, so the manifest stays as small
+        as the listing. Only call this with a complete listing.
+
+        :return: Number of dropped entries
+        """
+        dropped = [filename for filename in self.entries if filename not in filenames]
+        for filename in dropped:
+            del self.entries[filename]
+        self.changed = self.changed or bool(dropped)
+        return len(dropped)
+
+    @classmethod
+    def load(
+        cls, adls_client: FileSystemClient, path: str = MANIFEST_PATH
+    ) -> "UploadManifest":
+        """Read the manifest from ADLS, returns an empty manifest if it does not exist yet"""
+        return cls(read_json(adls_client, path, "manifest"))
+
+    def save(self, adls_client: FileSystemClient, path: str = MANIFEST_PATH):
+        write_json(adls_client, path, "manifest", self.entries)
+        self.changed = False
+
+
+def load_watermark(
+    adls_client: FileSystemClient, path: str = WATERMARK_PATH
+) -> Optional[str]:
+    """Return the last filename processed by an earlier run, None if there is none yet"""
+    value = read_json(adls_client, path, "watermark")
+    return value["filename"] if value else None
+
+
+def save_watermark(
+    adls_client: FileSystemClient, filename: str, path: str = WATERMARK_PATH
+):
+    write_json(adls_client, path, "watermark", {"filename": filename})
+
+
+def advance_watermark(
+    watermark: Optional[str], listed: Iterable[str], processed: Set[str]
+) -> Optional[str]:
+    """
+    Return the last filename of the longest run of processed files at the start of the
+    listing. Files after a failed or unfinished file are listed again by the next run, even if
+    they were processed, so the watermark never skips a file.
+
+    :param watermark: Current watermark, returned if the first listed file was not processed
+    :param listed: Filenames in listing order
+    :param processed: Filenames that were uploaded or did not need an upload
+    """
+    for filename in listed:
+        if filename not in processed:
+            break
+        watermark = filename
+    return watermark
+
+
+class RetryQueue:
+    """
+    Files whose transfer failed, stored as a single JSON file in ADLS. Every entry keeps the
+    listing info of the file, the number of failed attempts, the last error and when it may be
+    retried. The delay doubles after every failure, from RETRY_BASE_DELAY up to RETRY_MAX_DELAY.
+
+    A file that failed MAX_ATTEMPTS times stays in the queue as a dead letter without a next
+    attempt, so later runs skip it instead of retrying it from the first attempt. Remove its
+    entry to retry it again.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.entries = entries or {}
+        self.changed = False
+
+    def due(self, now: datetime) -> List[FileInfo]:
+        """Return the listing info of the files that may be retried at now, oldest first"""
+        return [
+            entry["file"]
+            for _, entry in sorted(self.entries.items())
+            if entry["next_attempt"] is not None
+            and datetime.fromisoformat(entry["next_attempt"]) <= now
+        ]
+
+    def is_waiting(self, filename: str, now: datetime) -> bool:
+        """Return True if the file is queued and may not be retried yet, or is a dead letter"""
+        entry = self.entries.get(filename)
+        return entry is not None and (
+            entry["next_attempt"] is None
+            or datetime.fromisoformat(entry["next_attempt"]) > now
+        )
+
+    @property
+    def dead_letters(self) -> List[str]:
+        """Names of the files that failed MAX_ATTEMPTS times and are no longer retried"""
+        return sorted(
+            filename
+            for filename, entry in self.entries.items()
+            if entry["next_attempt"] is None
+        )
+
+    def record_failure(self, file_info: FileInfo, error: str, now: datetime) -> bool:
+        """
+        Queue a failed file, or update its entry if it was queued already.
+
+        :return: False if the file failed MAX_ATTEMPTS times and became a dead letter
+        """
+        filename = str(file_info["filename"])
+        attempts = self.entries.get(filename, {}).get("attempts", 0) + 1
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        self.entries[filename] = {
+            "file": file_info,
+            "attempts": attempts,
+            "error": error,
+            "next_attempt": (
+                None if attempts >= MAX_ATTEMPTS else (now + delay).isoformat()
+            ),
+        }
+        self.changed = True
+        return attempts < MAX_ATTEMPTS
+
+    def prune(self, listed: Set[str]):
+        """
+        Drop dead letters of files that are no longer listed by KNMI. Only call this with a
+        complete listing.
+        """
+        for filename in self.dead_letters:
+            if filename not in listed:
+                del self.entries[filename]
+                self.changed = True
+
+    def remove(self, filename: str):
+        if self.entries.pop(filename, None) is not None:
+            self.changed = True
+
+    @classmethod
+    def load(
+        cls, adls_client: FileSystemClient, path: str = RETRY_QUEUE_PATH
+    ) -> "RetryQueue":
+        """Read the retry queue from ADLS, returns an empty queue if it does not exist yet"""
+        return cls(read_json(adls_client, path, "retry queue"))
+
+    def save(self, adls_client: FileSystemClient, path: str = RETRY_QUEUE_PATH):
+        write_json(adls_client, path, "retry queue", self.entries)
+        self.changed = False
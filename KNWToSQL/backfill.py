@@ -0,0 +1,327 @@
+"""
+Backfill knw_data from a local directory or glob of KNW CSV files.
+
+Usage:
+    python -m KNWToSQL.backfill /data/knw/ "/archive/KNW-1.0_H37-ERA_NL-*.csv" --workers 4
+
+Connects with the PSQLUSERNAME, PSQLPASSWORD and PSQLHOST environment variables unless --url is
+given. Files listed in the manifest with an unchanged size and modification time are skipped.
+"""
+
+import argparse
+import json
+import logging
+import mmap
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+)
+from datetime import datetime
+from functools import partial
+from glob import glob
+from os import (
+    environ,
+    replace,
+    stat,
+)
+from os.path import (
+    abspath,
+    isdir,
+    join,
+)
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+)
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import (
+    Session,
+    sessionmaker,
+)
+
+from KNWToSQL.errors import KNWError
+from KNWToSQL.knw_to_sql import (
+    DEFAULT_WORKERS,
+    Processor,
+)
+from KNWToSQL.models import (
+    Base,
+    LoadStrategy,
+    OnConflict,
+    ParserType,
+)
+from loganalytics.logger import ConsoleLogger
+from storage.postgres import create_psql_session
+
+DEFAULT_MANIFEST = "knw_backfill_manifest.json"
+
+
+class MappedFile:
+    """
+    Read-only memory map of a local file with the read/name interface Processor expects. Pages
+    are read from the page cache without buffered file reads, each read call copies only the
+    chunk it returns.
+    """
+
+    def __init__(self, path: str):
+        self.name = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise KNWError(f"Could not memory map empty file: {path}")
+
+    def read(self, size: int = -1) -> bytes:
+        return self._map.read(size)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "MappedFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FileResult(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    row_count: int
+    seconds: float
+    error: Optional[str] = None
+
+
+class BackfillReport(NamedTuple):
+    results: List[FileResult]
+    skipped: List[str]
+    seconds: float
+
+    @property
+    def succeeded(self) -> bool:
+        return all(result.error is None for result in self.results)
+
+    @property
+    def row_count(self) -> int:
+        return sum(result.row_count for result in self.results)
+
+    def summary(self) -> str:
+        loaded = [result for result in self.results if result.error is None]
+        megabytes = sum(result.size for result in loaded) / 1e6
+        seconds = self.seconds or 1e-9
+        summary = (
+            f"Loaded {self.row_count} rows from {len(loaded)} files ({megabytes:.1f} MB) in "
+            f"{self.seconds:.2f}s: {self.row_count / seconds:.0f} rows/s, "
+            f"{megabytes / seconds:.2f} MB/s. Skipped {len(self.skipped)} already loaded files"
+        )
+        for result in self.results:
+            if result.error is not None:
+                summary += f"\n{result.path} failed: {result.error}"
+        return summary
+
+
+def find_files(patterns: List[str]) -> List[str]:
+    """Expand directories to the CSV files in them and globs to their matches, sorted by path"""
+    paths: Set[str] = set()
+    for pattern in patterns:
+        if isdir(pattern):
+            pattern = join(pattern, "*.csv")
+        paths.update(abspath(path) for path in glob(pattern))
+    return sorted(paths)
+
+
+def read_manifest(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(path: str, manifest: Dict[str, Dict[str, Any]]):
+    """Write the manifest to a temporary file first, so an interrupted write cannot corrupt it"""
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    replace(f"{path}.tmp", path)
+
+
+def is_loaded(manifest: Dict[str, Dict[str, Any]], path: str) -> bool:
+    entry = manifest.get(path)
+    if entry is None or "error" in entry:
+        return False
+    try:
+        file_stat = stat(path)
+    except OSError:
+        # Reported as a failure of the file when it is loaded
+        return False
+    return entry["size"] == file_stat.st_size and entry["mtime"] == file_stat.st_mtime
+
+
+def backfill_file(
+    path: str,
+    session_factory: Callable[[], Session],
+    options: Dict[str, Any],
+) -> FileResult:
+    """Load one local KNW file on its own session. Runs in a worker process"""
+    started = perf_counter()
+    try:
+        file_stat = stat(path)
+    except OSError as e:
+        return FileResult(path, 0, 0.0, 0, perf_counter() - started, str(e))
+    session = session_factory()
+    try:
+        with MappedFile(path) as file:
+            proc = Processor(
+                logger=ConsoleLogger(__name__), sql_session=session, **options
+            )
+            row_count = proc.process(file)  # type: ignore
+    except (SQLAlchemyError, KNWError, ValueError, OSError) as e:
+        return FileResult(
+            path,
+            file_stat.st_size,
+            file_stat.st_mtime,
+            0,
+            perf_counter() - started,
+            str(e),
+        )
+    finally:
+        session.close()
+    return FileResult(
+        path, file_stat.st_size, file_stat.st_mtime, row_count, perf_counter() - started
+    )
+
+
+def backfill(
+    paths: List[str],
+    session_factory: Callable[[], Session],
+    manifest_path: str = DEFAULT_MANIFEST,
+    workers: int = DEFAULT_WORKERS,
+    **options: Any,
+) -> BackfillReport:
+    """
+    Load KNW files concurrently with at most workers files in flight, skipping files that the
+    manifest records as loaded. The manifest is updated as soon as each file finishes, failed
+    files are recorded with their error and loaded again by the next run.
+
+    :param paths: Absolute paths of the files to load
+    :param session_factory: Picklable callable returning a new session, called once per file
+    :param manifest_path: JSON file recording the loaded files
+    :param workers: Maximum number of files loaded at the same time
+    :param options: Other Processor arguments, such as load_strategy or commit_every
+    :return: Report of the loaded, failed and skipped files
+    """
+    started = perf_counter()
+    manifest = read_manifest(manifest_path)
+    pending = [path for path in paths if not is_loaded(manifest, path)]
+    skipped = [path for path in paths if path not in pending]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            executor.submit(backfill_file, path, session_factory, options)
+            for path in pending
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result.error is None:
+                manifest[result.path] = {
+                    "size": result.size,
+                    "mtime": result.mtime,
+                    "rows": result.row_count,
+                    "loaded_at": datetime.utcnow().isoformat(),
+                }
+            else:
+                manifest[result.path] = {
+                    "error": result.error,
+                    "failed_at": datetime.utcnow().isoformat(),
+                }
+            write_manifest(manifest_path, manifest)
+
+    return BackfillReport(
+        sorted(results, key=lambda result: result.path),
+        skipped,
+        perf_counter() - started,
+    )
+
+
+def create_url_session(url: str, create_tables: bool = False) -> Session:
+    """
+    Return a session for a SQLAlchemy database URL, picklable through functools.partial
+
+    :param create_tables: Create the KNW tables first, for local stand-in databases
+    """
+    engine = create_engine(url)
+    if create_tables:
+        Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "paths", nargs="+", help="Directories or glob patterns of KNW files"
+    )
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    parser.add_argument(
+        "--url", help="SQLAlchemy database URL, overrides the PSQL* env vars"
+    )
+    parser.add_argument(
+        "--load-strategy",
+        type=LoadStrategy,
+        default=LoadStrategy.COPY,
+        choices=list(LoadStrategy),
+    )
+    parser.add_argument(
+        "--parser", type=ParserType, default=ParserType.CSV, choices=list(ParserType)
+    )
+    parser.add_argument(
+        "--on-conflict",
+        type=OnConflict,
+        default=OnConflict.NOTHING,
+        choices=list(OnConflict),
+    )
+    parser.add_argument("--commit-every", type=int, default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    if args.url:
+        session_factory = partial(create_url_session, args.url)
+    else:
+        session_factory = partial(
+            create_psql_session,
+            username=environ["PSQLUSERNAME"],
+            password=environ["PSQLPASSWORD"],
+            host=environ["PSQLHOST"],
+        )
+    report = backfill(
+        paths=find_files(args.paths),
+        session_factory=session_factory,
+        manifest_path=args.manifest,
+        workers=args.workers,
+        load_strategy=args.load_strategy,
+        parser=args.parser,
+        on_conflict=args.on_conflict,
+        commit_every=args.commit_every,
+    )
+    print(report.summary())
+    if not report.succeeded:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
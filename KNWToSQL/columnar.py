@@ -0,0 +1,65 @@
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+)
+
+from KNWToSQL.errors import KNWError
+from KNWToSQL.models import KNW_COLUMNS
+
+# numpy is optional, install the 'columnar' extra to use the numpy parser
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+# Rows are parsed to minute resolution, the resolution of the DTG column in KNW files
+DTG_DTYPE = "datetime64[m]"
+
+Columns = Dict[str, "np.ndarray"]
+
+
+def require_numpy():
+    if np is None:
+        raise KNWError("The numpy parser requires numpy, install the 'columnar' extra")
+
+
+def parse_lines(lines: List[str]) -> Columns:
+    """
+    Parse KNW body lines into one datetime64 array for dtg and one float64 array per value
+    column, keyed by the knw_data column names. Blank lines are ignored.
+
+    :param lines: Tab separated data lines, without the file header
+    :return: Dict of column name to array, all arrays have the same length
+    """
+    require_numpy()
+    lines = [line for line in lines if line.strip()]
+    try:
+        dtg = np.array([line.split("\t", 1)[0] for line in lines], dtype=DTG_DTYPE)
+        values = np.loadtxt(
+            lines,
+            delimiter="\t",
+            usecols=range(1, len(KNW_COLUMNS)),
+            dtype=np.float64,
+            comments=None,
+            ndmin=2,
+        )
+    except (ValueError, IndexError) as e:
+        # Older numpy raises IndexError for lines with fewer columns than usecols
+        raise KNWError(f"Could not parse KNW lines into columns: {str(e)}")
+
+    columns = {KNW_COLUMNS[0]: dtg}
+    for index, name in enumerate(KNW_COLUMNS[1:]):
+        columns[name] = values[:, index]
+    return columns
+
+
+def columns_to_entries(columns: Columns) -> Iterator[Tuple]:
+    """
+    Yield tuples of Python values ordered like KNW_COLUMNS, the same entries the CSV parser
+    produces. Every column is converted with a single tolist call.
+    """
+    dtg = columns[KNW_COLUMNS[0]].astype("datetime64[us]").tolist()
+    values = [columns[name].tolist() for name in KNW_COLUMNS[1:]]
+    return zip(dtg, *values)
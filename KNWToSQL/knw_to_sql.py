@@ -1,80 +1,168 @@
+import codecs
 import csv
 import logging
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
 from datetime import datetime
-from io import StringIO
-from os import environ
+from functools import partial
+from io import BytesIO
+from itertools import islice
+from os import (
+    cpu_count,
+    environ,
+)
+from time import perf_counter
 from typing import (
+    IO,
+    Any,
+    Callable,
     Dict,
+    Iterable,
+    Iterator,
     List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
 )
 
 from azure.functions import InputStream
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
+from KNWToSQL.columnar import (
+    Columns,
+    columns_to_entries,
+    parse_lines,
+    require_numpy,
+)
 from KNWToSQL.errors import KNWError
-from KNWToSQL.models import KNWData
-from loganalytics.law import LogAnalyticsWorkspaceLogger
-from storage.postgres import create_psql_session
+from KNWToSQL.models import (
+    KNW_COLUMNS,
+    KNWCheckpoint,
+    KNWData,
+    LoadStrategy,
+    OnConflict,
+    ParserType,
+)
+from loganalytics.law import (
+    DEFAULT_CLOSE_TIMEOUT,
+    LogAnalyticsWorkspaceLogger,
+)
+from loganalytics.logger import SupportsLog
+from loganalytics.spool import get_spool_path
+from storage.postgres import (
+    copy_rows,
+    create_psql_session,
+    get_pool_stats,
+    upsert_rows,
+)
+
+DTG_FORMAT = "%Y-%m-%d %H:%M"
+HEADER_LINE_COUNT = 8
+
+# Bytes read from the input stream at a time and rows handled per batch while loading
+READ_CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 10_000
+
+# Worker processes used by process_parallel unless configured otherwise
+DEFAULT_WORKERS = cpu_count() or 1
+# Bytes of a KNW file read into one range for a parallel worker. At most two ranges per worker are
+# held in memory at once, regardless of the size of the file
+DEFAULT_RANGE_BYTES = 16 * 1024 * 1024
+
+T = TypeVar("T")
+
+# Binary streams the KNW readers accept, a Functions blob or any file opened in binary mode
+BinaryStream = Union[IO[bytes], InputStream]
 
 
 class Processor:
     def __init__(
         self,
-        logger: LogAnalyticsWorkspaceLogger,
+        logger: SupportsLog,
         sql_session: Session,
+        load_strategy: LoadStrategy = LoadStrategy.ORM,
+        batch_size: int = BATCH_SIZE,
+        chunk_size: int = READ_CHUNK_SIZE,
+        parser: ParserType = ParserType.CSV,
+        on_conflict: OnConflict = OnConflict.NOTHING,
+        commit_every: Optional[int] = None,
+        incremental: bool = False,
     ):
         self.logger = logger
         self.sql_session = sql_session
+        self.load_strategy = load_strategy
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.parser = parser
+        self.on_conflict = on_conflict
+        self.commit_every = commit_every
+        self.incremental = incremental
+
+    def process(self, file: InputStream, after: Optional[datetime] = None) -> int:
+        """
+        Load all entries of a KNW file into knw_data. By default the whole file is loaded in one
+        transaction. If commit_every is set the file is committed in chunks of that many rows,
+        each together with a checkpoint, and a retried invocation resumes after the last
+        committed dtg instead of starting from the first row.
 
-    def process(self, file: InputStream):
-        rows = self.read_file_into_dicts(file)
-        for row in rows:
-            entry = KNWData(
-                dtg=datetime.strptime(row["DTG"], "%Y-%m-%d %H:%M"),
-                f010=float(row["F010"]),
-                d010=float(row["D010"]),
-                t010=float(row["T010"]),
-                q010=float(row["Q010"]),
-                p010=float(row["P010"]),
-                f020=float(row["F020"]),
-                d020=float(row["D020"]),
-                t020=float(row["T020"]),
-                q020=float(row["Q020"]),
-                p020=float(row["P020"]),
-                f040=float(row["F040"]),
-                d040=float(row["D040"]),
-                t040=float(row["T040"]),
-                q040=float(row["Q040"]),
-                p040=float(row["P040"]),
-                f060=float(row["F060"]),
-                d060=float(row["D060"]),
-                t060=float(row["T060"]),
-                q060=float(row["Q060"]),
-                p060=float(row["P060"]),
-                f080=float(row["F080"]),
-                d080=float(row["D080"]),
-                t080=float(row["T080"]),
-                q080=float(row["Q080"]),
-                p080=float(row["P080"]),
-                f100=float(row["F100"]),
-                d100=float(row["D100"]),
-                t100=float(row["T100"]),
-                q100=float(row["Q100"]),
-                p100=float(row["P100"]),
-                f150=float(row["F150"]),
-                d150=float(row["D150"]),
-                t150=float(row["T150"]),
-                q150=float(row["Q150"]),
-                p150=float(row["P150"]),
-                f200=float(row["F200"]),
-                d200=float(row["D200"]),
-                t200=float(row["T200"]),
-                q200=float(row["Q200"]),
-                p200=float(row["P200"]),
+        If incremental is set only rows newer than the latest dtg in knw_data are parsed and
+        loaded, so the cost of a cumulative file scales with the new data only.
+
+        :param file: KNW file to load
+        :param after: Optional dtg at or before which rows are skipped, on top of the watermark
+          and checkpoint
+        :return: Number of rows loaded
+        """
+        if self.incremental:
+            after = latest(after, self.get_watermark())
+        if not self.commit_every:
+            return self.load_entries(self.iter_entries(file, after=after))
+
+        if file.name is None:
+            raise KNWError(
+                "Checkpoints are keyed by file name, cannot commit a nameless file"
+            )
+        checkpoint = self.get_checkpoint(file.name)
+        if checkpoint.last_dtg is not None:
+            self.logger.log(
+                message=f"Resuming {file.name} after {checkpoint.last_dtg}, "
+                f"{checkpoint.row_count} rows already loaded",
+                severity=logging.INFO,
             )
-            self.sql_session.add(entry)
+        entries = self.iter_entries(file, after=latest(after, checkpoint.last_dtg))
+        row_count = 0
+        for chunk in batched(entries, self.commit_every):
+            checkpoint.last_dtg = chunk[-1][0]
+            checkpoint.row_count += len(chunk)
+            row_count += self.load_entries(chunk, checkpoint=checkpoint)
+        return row_count
+
+    def load_entries(
+        self, entries: Iterable[Tuple], checkpoint: Optional[KNWCheckpoint] = None
+    ) -> int:
+        """
+        Load entries with the configured load strategy and commit them in one transaction.
+        Returns the number of rows loaded.
+        """
         try:
+            if self.load_strategy is LoadStrategy.COPY:
+                row_count = self.copy_entries(entries)
+            elif self.load_strategy is LoadStrategy.UPSERT:
+                row_count = self.upsert_entries(entries)
+            else:
+                row_count = self.add_entries(entries)
+            if checkpoint is not None:
+                checkpoint.updated_at = datetime.utcnow()
+                self.sql_session.merge(checkpoint)
             self.sql_session.commit()
         except SQLAlchemyError as e:
             self.logger.log(
@@ -83,25 +171,423 @@ class Processor:
             )
             self.sql_session.rollback()
             raise
+        return row_count
 
-    def read_file_into_dicts(self, file: InputStream) -> List[Dict]:
+    def get_watermark(self) -> Optional[datetime]:
+        """
+        Return the latest dtg in knw_data, or None if it is empty. knw_data holds a single time
+        series keyed by dtg, so this is the point up to which every source has been loaded.
+        """
+        watermark = self.sql_session.query(func.max(KNWData.dtg)).scalar()
+        self.logger.log(
+            message=f"Skipping rows at or before watermark {watermark}",
+            severity=logging.INFO,
+        )
+        return watermark
+
+    def get_checkpoint(self, blob_name: str) -> KNWCheckpoint:
+        """Return the stored checkpoint for a blob, or a new empty one if there is none"""
+        checkpoint = self.sql_session.get(KNWCheckpoint, blob_name)
+        if checkpoint is None:
+            return KNWCheckpoint(blob_name=blob_name, last_dtg=None, row_count=0)
+        # Detach so changes are only written when a chunk is committed
+        self.sql_session.expunge(checkpoint)
+        return checkpoint
+
+    def iter_entries(
+        self, file: InputStream, after: Optional[datetime] = None
+    ) -> Iterator[Tuple]:
+        """
+        Yield typed entries ordered like KNW_COLUMNS using the configured parser. If after is
+        given, rows with a dtg at or before it are skipped before any of their values are parsed.
+        """
+        after_dtg = after.strftime(DTG_FORMAT) if after is not None else None
+        if self.parser is ParserType.NUMPY:
+            for columns in self.iter_file_columns(file, after=after_dtg):
+                yield from columns_to_entries(columns)
+        else:
+            for row in self.iter_file_rows(file):
+                # DTG is zero padded, so comparing the strings orders them chronologically
+                if after_dtg is None or row["DTG"] > after_dtg:
+                    yield self.parse_row(row)
+
+    @staticmethod
+    def parse_row(row: Dict[str, str]) -> Tuple:
+        """
+        Convert a CSV row dict to a tuple of typed values ordered like KNW_COLUMNS. Raises
+        KNWError for rows with missing or invalid fields, e.g. a truncated last row, whose
+        missing fields DictReader fills with None.
+        """
+        try:
+            return (
+                datetime.strptime(row["DTG"], DTG_FORMAT),
+                *(float(row[column.upper()]) for column in KNW_COLUMNS[1:]),
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise KNWError(f"Could not parse KNW row {row.get('DTG')}: {str(e)}")
+
+    def add_entries(self, entries: Iterable[Tuple]) -> int:
+        """
+        Add one KNWData object per entry to the session. Fallback for non-Postgres sessions.
+        Entries are flushed per batch so the session does not hold every pending object at once.
+        """
+        row_count = 0
+        for batch in batched(entries, self.batch_size):
+            for values in batch:
+                self.sql_session.add(KNWData(**dict(zip(KNW_COLUMNS, values))))
+            self.sql_session.flush()
+            row_count += len(batch)
+        return row_count
+
+    def copy_entries(self, entries: Iterable[Tuple]) -> int:
+        """Stream entries into knw_data with COPY FROM STDIN in the session's transaction"""
+        row_count = copy_rows(
+            session=self.sql_session,
+            table=KNWData.__tablename__,
+            columns=KNW_COLUMNS,
+            rows=entries,
+        )
         self.logger.log(
-            message=f"Converting {file.name} to dicts",
+            message=f"Copied {row_count} rows into {KNWData.__tablename__}",
             severity=logging.INFO,
         )
-        csv_data = StringIO(file.read().decode())
+        return row_count
+
+    def upsert_entries(self, entries: Iterable[Tuple]) -> int:
+        """
+        Upsert entries into knw_data per batch with INSERT ... ON CONFLICT (dtg). Repeated dtgs
+        within a batch are dropped first, see deduplicate_entries.
+        """
+        update = self.on_conflict is OnConflict.UPDATE
+        row_count, duplicate_count = 0, 0
+        for batch in batched(entries, self.batch_size):
+            unique = deduplicate_entries(batch, keep_last=update)
+            duplicate_count += len(batch) - len(unique)
+            row_count += upsert_rows(
+                session=self.sql_session,
+                table=KNWData.__table__,
+                rows=[dict(zip(KNW_COLUMNS, values)) for values in unique],
+                index_elements=[KNW_COLUMNS[0]],
+                update=update,
+            )
+        self.logger.log(
+            message=f"Upserted {row_count} rows into {KNWData.__tablename__} with ON CONFLICT "
+            f"DO {self.on_conflict.name}, dropped {duplicate_count} duplicate rows",
+            severity=logging.INFO,
+        )
+        return row_count
+
+    def iter_file_rows(self, file: InputStream) -> Iterator[Dict[str, str]]:
+        """
+        Lazily yield the rows of a KNW file as dicts keyed by column name. The file is read and
+        decoded in chunks, so memory use does not grow with the size of the file.
+        """
+        self.logger.log(
+            message=f"Streaming rows from {file.name}",
+            severity=logging.INFO,
+        )
+        lines = iter_lines(file, self.chunk_size)
         # Skip first 8 rows of header info
-        for i in range(8):
-            csv_data.__next__()
+        for _ in range(HEADER_LINE_COUNT):
+            next(lines, None)
 
-        dicts = csv.DictReader(csv_data, delimiter="\t")
+        dicts = csv.DictReader(lines, delimiter="\t")
         if not dicts.fieldnames:
             raise KNWError(f"Could not get fieldnames for file: {file.name}")
 
         # remove silly characters from column names
         dicts.fieldnames = [x.replace("#", "").strip() for x in dicts.fieldnames]
 
-        return list(dicts)
+        yield from dicts
+
+    def iter_file_columns(
+        self, file: InputStream, after: Optional[str] = None
+    ) -> Iterator[Columns]:
+        """
+        Lazily yield batches of at most batch_size rows of a KNW file as typed column arrays.
+        See KNWToSQL.columnar.parse_lines for the layout of each batch. If after is given, lines
+        with a DTG string at or before it are dropped before parsing.
+        """
+        require_numpy()
+        self.logger.log(
+            message=f"Streaming column batches from {file.name}",
+            severity=logging.INFO,
+        )
+        lines = iter_lines(file, self.chunk_size)
+        for _ in range(HEADER_LINE_COUNT):
+            next(lines, None)
+
+        header = next(lines, "")
+        fieldnames = [x.replace("#", "").strip().lower() for x in header.split("\t")]
+        if fieldnames[: len(KNW_COLUMNS)] != KNW_COLUMNS:
+            raise KNWError(f"Could not get fieldnames for file: {file.name}")
+
+        if after is not None:
+            lines = (line for line in lines if line.split("\t", 1)[0] > after)
+        for batch in batched(lines, self.batch_size):
+            yield parse_lines(batch)
+
+    def read_file_into_dicts(self, file: InputStream) -> List[Dict]:
+        """Read a whole KNW file into a list of dicts. Prefer iter_file_rows for large files"""
+        return list(self.iter_file_rows(file))
+
+
+def iter_lines(file: BinaryStream, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield the lines of a binary stream, reading and decoding at most chunk_size bytes at a time.
+    Multibyte characters split across chunk boundaries are handled by the incremental decoder.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + decoder.decode(chunk)).splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def latest(*dtgs: Optional[datetime]) -> Optional[datetime]:
+    """Return the latest of the given dtgs that is not None, or None if all are None"""
+    return max((dtg for dtg in dtgs if dtg is not None), default=None)
+
+
+def deduplicate_entries(entries: List[Tuple], keep_last: bool) -> List[Tuple]:
+    """
+    Drop entries whose dtg (first value) already occurred in the list, keeping either the first or
+    the last occurrence. Keeping the last matches DO UPDATE applied row by row, keeping the first
+    matches DO NOTHING. Order of the remaining entries is preserved.
+    """
+    unique: Dict = {}
+    for values in entries:
+        if keep_last or values[0] not in unique:
+            unique[values[0]] = values
+    return list(unique.values())
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yield lists of at most size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class RangeTask(NamedTuple):
+    """A line-aligned byte range of a KNW file, prefixed with the file header, for one worker"""
+
+    name: str
+    data: bytes
+    start: int
+    end: int
+    session_factory: Callable[[], Session]
+    logger: SupportsLog
+    options: Dict[str, Any]
+    after: Optional[datetime]
+
+
+class RangeResult(NamedTuple):
+    start: int
+    end: int
+    row_count: int
+    seconds: float
+    error: Optional[str] = None
+
+
+class ParallelIngestReport(NamedTuple):
+    name: str
+    results: List[RangeResult]
+    seconds: float
+
+    @property
+    def succeeded(self) -> bool:
+        return all(result.error is None for result in self.results)
+
+    @property
+    def row_count(self) -> int:
+        return sum(result.row_count for result in self.results)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.row_count / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        failed = [result for result in self.results if result.error is not None]
+        summary = (
+            f"Loaded {self.row_count} rows from {self.name} in {len(self.results)} ranges in "
+            f"{self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s)"
+        )
+        for result in failed:
+            summary += f"\nRange {result.start}-{result.end} failed: {result.error}"
+        return summary
+
+
+def find_body_start(data: bytes) -> int:
+    """Return the offset of the first data line, after the header info and column name lines"""
+    offset = 0
+    for _ in range(HEADER_LINE_COUNT + 1):
+        offset = data.find(b"\n", offset) + 1
+        if offset == 0:
+            raise KNWError("Could not find the end of the KNW file header")
+    return offset
+
+
+def read_ranges(
+    file: BinaryStream, range_bytes: int = DEFAULT_RANGE_BYTES
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Read a stream in line-aligned ranges of about range_bytes, each ending right after a newline
+    (or at the end of the stream), and yield them with their offset in the stream.
+    """
+    offset = 0
+    pending = b""
+    while True:
+        chunk = file.read(range_bytes)
+        if not chunk:
+            break
+        data = pending + chunk
+        newline = data.rfind(b"\n")
+        if newline == -1:
+            pending = data
+            continue
+        pending = data[newline + 1 :]
+        yield offset, data[: newline + 1]
+        offset += newline + 1
+    if pending:
+        yield offset, pending
+
+
+def load_range(task: RangeTask) -> RangeResult:
+    """
+    Parse and load one byte range on its own database session. Runs in a worker process, errors
+    are returned in the result so one failed range does not hide the outcome of the others.
+    """
+    started = perf_counter()
+    stream = BytesIO(task.data)
+    # Ranges of the same file get their own name, so chunked commits checkpoint per range
+    stream.name = f"{task.name}@{task.start}-{task.end}"  # type: ignore
+    session = task.session_factory()
+    try:
+        proc = Processor(logger=task.logger, sql_session=session, **task.options)
+        row_count = proc.process(stream, after=task.after)  # type: ignore
+    except (SQLAlchemyError, KNWError, ValueError) as e:
+        return RangeResult(task.start, task.end, 0, perf_counter() - started, str(e))
+    finally:
+        session.close()
+    return RangeResult(task.start, task.end, row_count, perf_counter() - started)
+
+
+def process_parallel(
+    file: BinaryStream,
+    name: str,
+    session_factory: Callable[[], Session],
+    logger: SupportsLog,
+    workers: int = DEFAULT_WORKERS,
+    incremental: bool = False,
+    range_bytes: int = DEFAULT_RANGE_BYTES,
+    **options: Any,
+) -> ParallelIngestReport:
+    """
+    Load a KNW file by reading it in line-aligned byte ranges that are parsed and loaded
+    concurrently by a pool of worker processes, each on its own database connection.
+
+    Ranges are read from the stream while earlier ranges are loaded, with at most two ranges per
+    worker submitted at a time, so memory use is bounded by range_bytes and not the file size.
+
+    :param file: Binary stream of the KNW file
+    :param name: Name of the file, used in logs and checkpoints
+    :param session_factory: Picklable callable returning a new session, called once per range.
+      E.g. functools.partial(create_psql_session, username=..., password=..., host=...)
+    :param logger: Picklable logger passed to the workers
+    :param workers: Number of worker processes
+    :param incremental: Look up the watermark once before loading, so ranges loaded first by
+      one worker do not move the watermark past ranges still being loaded by others
+    :param range_bytes: Bytes read into one range, must be larger than the file header
+    :param options: Other Processor arguments, such as load_strategy or commit_every
+    :return: Combined report of all ranges
+    """
+    started = perf_counter()
+    after = None
+    if incremental:
+        session = session_factory()
+        try:
+            after = Processor(logger=logger, sql_session=session).get_watermark()
+        finally:
+            session.close()
+
+    logger.log(
+        message=f"Loading {name} in ranges of {range_bytes} bytes with {workers} workers",
+        severity=logging.INFO,
+    )
+    workers = max(1, workers)
+    results: List[RangeResult] = []
+    header = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight: Set[Future] = set()
+        for start, data in read_ranges(file, range_bytes):
+            if header is None:
+                body_start = find_body_start(data)
+                header, data, start = data[:body_start], data[body_start:], body_start
+            if not data:
+                continue
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            task = RangeTask(
+                name=name,
+                data=header + data,
+                start=start,
+                end=start + len(data),
+                session_factory=session_factory,
+                logger=logger,
+                options=options,
+                after=after,
+            )
+            in_flight.add(executor.submit(load_range, task))
+        results.extend(future.result() for future in wait(in_flight).done)
+    if header is None:
+        raise KNWError("Could not find the end of the KNW file header")
+
+    report = ParallelIngestReport(
+        name, sorted(results, key=lambda result: result.start), perf_counter() - started
+    )
+    logger.log(
+        message=report.summary(),
+        severity=logging.INFO if report.succeeded else logging.ERROR,
+    )
+    return report
+
+
+def process_file(
+    file: InputStream,
+    session: Session,
+    logger: SupportsLog,
+    incremental: bool = False,
+    **options: Any,
+) -> int:
+    """
+    Process a file on a session and close it afterwards, returning its connection to the pool of
+    the cached engine for the next invocation. Logs the pool statistics of that engine.
+    """
+    try:
+        proc = Processor(
+            logger=logger, sql_session=session, incremental=incremental, **options
+        )
+        return proc.process(file)
+    finally:
+        session.close()
+        stats = get_pool_stats(session)
+        if stats is not None:
+            logger.log(
+                message=f"Postgres connection pool: {stats.summary()}",
+                severity=logging.INFO,
+            )
 
 
 # Azure typechecks this signature. So do not touch it
@@ -110,20 +596,55 @@ def main(blob: InputStream):
         workspace_id=environ["LAWID"],
         shared_key=environ["LAWKEY"],
         custom_log_table_name="GetActualTenMinSynopticData",
+        batch=environ.get("LAWBATCH", "").lower() == "true",
+        background=environ.get("LAWBACKGROUND", "").lower() == "true",
+        spool_path=(
+            get_spool_path("KNWToSQL")
+            if environ.get("LAWSPOOL", "").lower() == "true"
+            else None
+        ),
     )
-    psql_session = create_psql_session(
+    # Send the log records earlier invocations could not deliver
+    azure_logger.replay_spool()
+    session_factory = partial(
+        create_psql_session,
         username=environ["PSQLUSERNAME"],
         password=environ["PSQLPASSWORD"],
         host=environ["PSQLHOST"],
+        pool_size=int(environ.get("PSQLPOOLSIZE", 5)),
+        pool_recycle=int(environ.get("PSQLPOOLRECYCLE", 1800)),
     )
-    proc = Processor(
-        logger=azure_logger,
-        sql_session=psql_session,
+    options = dict(
+        load_strategy=LoadStrategy(
+            environ.get("KNWLOADSTRATEGY", LoadStrategy.COPY.value)
+        ),
+        parser=ParserType(environ.get("KNWPARSER", ParserType.CSV.value)),
+        on_conflict=OnConflict(environ.get("KNWONCONFLICT", OnConflict.NOTHING.value)),
+        commit_every=int(environ.get("KNWCOMMITEVERY", 0)) or None,
     )
+    incremental = environ.get("KNWINCREMENTAL", "").lower() == "true"
+    workers = int(environ.get("KNWPARALLELWORKERS", 1))
     try:
-        proc.process(blob)
+        if workers > 1:
+            process_parallel(
+                file=blob,
+                name=str(blob.name),
+                session_factory=session_factory,
+                logger=azure_logger,
+                workers=workers,
+                incremental=incremental,
+                range_bytes=int(
+                    environ.get("KNWPARALLELRANGEBYTES", DEFAULT_RANGE_BYTES)
+                ),
+                **options,
+            )
+        else:
+            process_file(blob, session_factory(), azure_logger, incremental, **options)
     except (SQLAlchemyError, KNWError) as e:
-        proc.logger.log(
+        azure_logger.log(
             message=f"Unexpected Error while processing KNW data Full error: {str(e)}",
             severity=logging.ERROR,
         )
+    finally:
+        azure_logger.log_stats()
+        azure_logger.close(timeout=DEFAULT_CLOSE_TIMEOUT)
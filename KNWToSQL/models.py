@@ -1,7 +1,11 @@
+from enum import Enum
+
 from sqlalchemy import (
     Column,
     DateTime,
     Float,
+    Integer,
+    String,
 )
 from sqlalchemy.orm import declarative_base
 
@@ -58,3 +62,53 @@ class KNWData(Base):  # type: ignore
     t200 = Column(Float, nullable=False)
     q200 = Column(Float, nullable=False)
     p200 = Column(Float, nullable=False)
+
+
+class KNWCheckpoint(Base):  # type: ignore
+    """
+    Progress of a KNW file loaded with chunked commits. last_dtg is the dtg of the last committed
+    row, KNW files are ordered by dtg so a retry resumes with the rows after it.
+    """
+
+    __tablename__ = "knw_checkpoint"
+
+    blob_name = Column(String, primary_key=True, nullable=False)
+    last_dtg = Column(DateTime, nullable=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+
+# Column names of knw_data in table order, the CSV header uses the same names in upper case
+KNW_COLUMNS = [column.name for column in KNWData.__table__.columns]
+
+
+class LoadStrategy(Enum):
+    """
+    How parsed KNW rows are written to Postgres. ORM adds one KNWData object per row to the
+    session, COPY streams all rows through a single COPY FROM STDIN and UPSERT inserts batches
+    with INSERT ... ON CONFLICT (dtg) so rows already in the table do not fail the load.
+    """
+
+    ORM = "orm"
+    COPY = "copy"
+    UPSERT = "upsert"
+
+
+class OnConflict(Enum):
+    """
+    What the UPSERT load strategy does with rows whose dtg is already in knw_data. UPDATE
+    overwrites the stored values, NOTHING keeps them, making a re-delivered file a no-op.
+    """
+
+    UPDATE = "update"
+    NOTHING = "nothing"
+
+
+class ParserType(Enum):
+    """
+    How KNW files are parsed. CSV builds a dict per row with the csv module, NUMPY parses
+    batches of rows into typed column arrays in one vectorized pass (requires numpy).
+    """
+
+    CSV = "csv"
+    NUMPY = "numpy"
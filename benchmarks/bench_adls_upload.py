@@ -0,0 +1,124 @@
+"""
+Measure ADLS upload latency and throughput per file size for different upload settings.
+
+Usage:
+    python -m benchmarks.bench_adls_upload --account-url https://<account>.dfs.core.windows.net \
+        --account-key <key> --container bench --sizes-mb 0.2 4 32 128
+
+Every size is uploaded with the settings tune_upload picks and with each combination of
+--chunk-sizes-mb and --max-concurrency, the way upload_file_content_to_adls uploads. The target
+must serve the Data Lake (dfs) endpoint, which Azurite does not implement, so use a development
+storage account with hierarchical namespace. Pass --dry-run to only print the tuned settings.
+Results are written as JSON so settings and runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime
+from itertools import product
+from time import perf_counter
+from typing import (
+    Any,
+    Dict,
+    List,
+)
+
+from azure.storage.filedatalake import DataLakeServiceClient
+
+from storage.adls import (
+    UploadSettings,
+    tune_upload,
+)
+
+MB = 1024 * 1024
+
+
+def upload(
+    file_system_client, data: bytes, settings: UploadSettings, repeat: int
+) -> float:
+    """Upload data repeat times to new paths and return the mean seconds per upload"""
+    seconds = 0.0
+    for _ in range(repeat):
+        file_client = file_system_client.get_file_client(f"bench/{uuid.uuid4()}")
+        started = perf_counter()
+        file_client.upload_data(
+            data=data,
+            overwrite=True,
+            chunk_size=settings.chunk_size,
+            max_concurrency=settings.max_concurrency,
+        )
+        seconds += perf_counter() - started
+        file_client.delete_file()
+    return seconds / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--account-url", default=os.environ.get("ADLSACCOUNTURL"))
+    parser.add_argument("--account-key", default=os.environ.get("ADLSACCOUNTKEY"))
+    parser.add_argument("--container", default="bench")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[0.2, 4, 32])
+    parser.add_argument("--chunk-sizes-mb", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--max-concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_adls_upload.json")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        for size_mb in args.sizes_mb:
+            print(f"{size_mb:>8} MB: {tune_upload(int(size_mb * MB))}")
+        return
+
+    file_system_client = DataLakeServiceClient(
+        account_url=args.account_url, credential=args.account_key
+    ).get_file_system_client(args.container)
+
+    results: List[Dict[str, Any]] = []
+    print(f"{'MB':>8} {'case':>6} {'chunk MB':>8} {'threads':>7} {'ms':>9} {'MB/s':>8}")
+    for size_mb in args.sizes_mb:
+        data = os.urandom(int(size_mb * MB))
+        cases = [("tuned", tune_upload(len(data)))] + [
+            ("fixed", UploadSettings(chunk_mb * MB, concurrency))
+            for chunk_mb, concurrency in product(
+                args.chunk_sizes_mb, args.max_concurrency
+            )
+        ]
+        for case, settings in cases:
+            seconds = upload(file_system_client, data, settings, args.repeat)
+            results.append(
+                {
+                    "size_bytes": len(data),
+                    "case": case,
+                    "chunk_size": settings.chunk_size,
+                    "max_concurrency": settings.max_concurrency,
+                    "seconds": seconds,
+                    "megabytes_per_second": len(data) / MB / seconds,
+                }
+            )
+            print(
+                f"{size_mb:>8} {case:>6} {settings.chunk_size / MB:>8.1f} "
+                f"{settings.max_concurrency:>7} {seconds * 1000:>9.1f} "
+                f"{len(data) / MB / seconds:>8.2f}"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "metadata": {
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "account_url": args.account_url,
+                    "repeat": args.repeat,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Measure KNW ingest throughput per parser and load strategy on synthetic files.
+
+Usage:
+    python -m benchmarks.bench_ingest --rows 10000 100000 1000000 --output bench_results.json
+
+Every case runs in a fresh process so its peak RSS is not inflated by earlier cases. Parse cases
+only parse the file. Load cases stream the parsed rows into the database like Processor.process,
+but the time spent parsing each batch is measured and left out of db_seconds, so db_seconds is
+the cost of the load strategy alone. The "bulk" case is LoadStrategy.UPSERT. Without --url a
+SQLite file is used as a local stand-in and the COPY strategy, which needs PostgreSQL, is skipped.
+Results are written as JSON so runs can be compared to track regressions.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from os.path import (
+    getsize,
+    join,
+)
+from time import perf_counter
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from benchmarks.utils import write_knw_file
+from KNWToSQL.backfill import (
+    MappedFile,
+    create_url_session,
+)
+from KNWToSQL.knw_to_sql import (
+    Processor,
+    batched,
+)
+from KNWToSQL.models import (
+    KNWCheckpoint,
+    KNWData,
+    LoadStrategy,
+    ParserType,
+)
+from loganalytics.logger import ConsoleLogger
+
+# Names used in the results for the load strategies, bulk is INSERT ... ON CONFLICT
+STRATEGY_NAMES = {
+    LoadStrategy.ORM: "orm",
+    LoadStrategy.UPSERT: "bulk",
+    LoadStrategy.COPY: "copy",
+}
+
+
+def timed_batches(
+    entries: Iterable[Tuple], batch_size: int, timer: List[float]
+) -> Iterator[Tuple]:
+    """
+    Yield entries, parsing them in batches of batch_size and adding the seconds spent parsing
+    to timer[0]. Only one batch is held in memory, like when Processor.process loads a file.
+    """
+    batches = batched(entries, batch_size)
+    while True:
+        started = perf_counter()
+        batch = next(batches, None)
+        timer[0] += perf_counter() - started
+        if batch is None:
+            return
+        yield from batch
+
+
+def run_case(
+    path: str,
+    parser: ParserType,
+    load_strategy: Optional[LoadStrategy],
+    url: Optional[str],
+) -> Dict[str, Any]:
+    """
+    Parse one file, and for load cases load it, and return timings. Runs in a fresh process.
+    seconds covers parsing and loading, db_seconds only the load.
+    """
+    db_seconds: Optional[float] = None
+    if load_strategy is None:
+        proc = Processor(logger=ConsoleLogger(), sql_session=None, parser=parser)  # type: ignore
+        started = perf_counter()
+        with MappedFile(path) as file:
+            row_count = sum(1 for _ in proc.iter_entries(file))  # type: ignore
+        seconds = parse_seconds = perf_counter() - started
+    else:
+        session = create_url_session(url, create_tables=True)  # type: ignore
+        session.query(KNWData).delete()
+        session.query(KNWCheckpoint).delete()
+        session.commit()
+        proc = Processor(
+            logger=ConsoleLogger(),
+            sql_session=session,
+            parser=parser,
+            load_strategy=load_strategy,
+        )
+        parse_timer = [0.0]
+        started = perf_counter()
+        with MappedFile(path) as file:
+            row_count = proc.load_entries(
+                timed_batches(
+                    proc.iter_entries(file), proc.batch_size, parse_timer  # type: ignore
+                )
+            )
+        seconds = perf_counter() - started
+        session.close()
+        parse_seconds = parse_timer[0]
+        db_seconds = seconds - parse_seconds
+    return {
+        "rows": row_count,
+        "seconds": seconds,
+        "rows_per_second": row_count / seconds,
+        "parse_seconds": parse_seconds,
+        "db_seconds": db_seconds,
+        "db_rows_per_second": row_count / db_seconds if db_seconds else None,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument(
+        "--parsers",
+        type=ParserType,
+        nargs="+",
+        default=list(ParserType),
+        choices=list(ParserType),
+    )
+    parser.add_argument(
+        "--strategies",
+        type=LoadStrategy,
+        nargs="+",
+        default=list(LoadStrategy),
+        choices=list(LoadStrategy),
+    )
+    parser.add_argument(
+        "--url", help="SQLAlchemy database URL, defaults to a SQLite file"
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    spawn = get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        url = args.url or f"sqlite:///{join(workdir, 'knw.db')}"
+        dialect = url.split(":", 1)[0].split("+", 1)[0]
+        print(
+            "Load cases: orm = LoadStrategy.ORM, bulk = LoadStrategy.UPSERT, copy = COPY"
+        )
+        print(
+            f"{'rows':>9} {'parser':>6} {'case':>6} {'seconds':>9} {'parse s':>9} "
+            f"{'db s':>9} {'db rows/s':>10} {'peak MB':>8}"
+        )
+        for rows in args.rows:
+            path = join(workdir, f"knw_{rows}.csv")
+            with open(path, "w") as f:
+                write_knw_file(f, rows)
+            cases: List[Tuple[ParserType, Optional[LoadStrategy]]] = [
+                (parser_type, None) for parser_type in args.parsers
+            ]
+            cases += [
+                (parser_type, strategy)
+                for parser_type in args.parsers
+                for strategy in args.strategies
+            ]
+            for parser_type, strategy in cases:
+                case = "parse" if strategy is None else STRATEGY_NAMES[strategy]
+                result: Dict[str, Any] = {
+                    "rows": rows,
+                    "file_bytes": getsize(path),
+                    "parser": parser_type.value,
+                    "case": case,
+                    "strategy": strategy.name if strategy is not None else None,
+                }
+                if strategy is LoadStrategy.COPY and dialect != "postgresql":
+                    results.append({**result, "skipped": "COPY requires PostgreSQL"})
+                    continue
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    result.update(
+                        executor.submit(
+                            run_case, path, parser_type, strategy, url
+                        ).result()
+                    )
+                results.append(result)
+                db_seconds = result["db_seconds"]
+                db_columns = (
+                    f"{db_seconds:>9.2f} {result['db_rows_per_second']:>10.0f}"
+                    if db_seconds is not None
+                    else f"{'-':>9} {'-':>10}"
+                )
+                print(
+                    f"{rows:>9} {parser_type.value:>6} {case:>6} {result['seconds']:>9.2f} "
+                    f"{result['parse_seconds']:>9.2f} {db_columns} "
+                    f"{result['peak_rss_bytes'] / 1e6:>8.1f}"
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "metadata": {
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "git_revision": git_revision(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "database": dialect,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
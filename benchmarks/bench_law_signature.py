@@ -0,0 +1,77 @@
+"""
+Measure how many Log Analytics Workspace request signatures can be built per second.
+
+Usage:
+    python -m benchmarks.bench_law_signature --seconds 2 --payload-bytes 200 100000
+
+Compares LogAnalyticsWorkspaceLogger._build_signature, which copies an HMAC keyed once when the
+logger is created, with signing the way it was done before: decoding the shared key and keying a
+new HMAC for every signature. No requests are sent.
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+from time import perf_counter
+from typing import Callable
+
+from loganalytics.law import LogAnalyticsWorkspaceLogger
+
+DATE = "Sat, 01 Jan 2022 00:00:00 GMT"
+
+
+def sign_per_call(shared_key: str, data: str) -> str:
+    """Signature as built before the keyed HMAC was kept on the logger"""
+    string_to_sign = f"POST\n{len(data)}\napplication/json\nx-ms-date:{DATE}\n/api/logs"
+    decoded_key = base64.b64decode(shared_key)
+    return base64.b64encode(
+        hmac.new(
+            key=decoded_key,
+            msg=bytes(string_to_sign, encoding="utf-8"),
+            digestmod=hashlib.sha256,
+        ).digest()
+    ).decode()
+
+
+def signatures_per_second(sign: Callable[[], str], seconds: float) -> float:
+    count = 0
+    started = perf_counter()
+    while perf_counter() - started < seconds:
+        for _ in range(1000):
+            sign()
+        count += 1000
+    return count / (perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--payload-bytes", type=int, nargs="+", default=[200, 100_000])
+    args = parser.parse_args()
+
+    shared_key = base64.b64encode(b"k" * 64).decode()
+    logger = LogAnalyticsWorkspaceLogger(
+        workspace_id="benchmark",
+        shared_key=shared_key,
+        custom_log_table_name="Benchmark",
+        background=False,
+    )
+    print(f"{'payload':>9} {'per call/s':>12} {'keyed/s':>12} {'speedup':>8}")
+    for payload_bytes in args.payload_bytes:
+        data = json.dumps({"message": "x" * payload_bytes, "severity": 20})
+        body = data.encode("utf-8")
+        per_call = signatures_per_second(
+            lambda: sign_per_call(shared_key, data), args.seconds
+        )
+        keyed = signatures_per_second(
+            lambda: logger._build_signature(body, DATE), args.seconds
+        )
+        print(
+            f"{payload_bytes:>9} {per_call:>12.0f} {keyed:>12.0f} {keyed / per_call:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Measure how KNW ingest throughput scales with the number of worker processes.
+
+Usage:
+    python -m benchmarks.bench_parallel_ingest --rows 200000 --workers 1 2 4 8
+
+Without --url every worker loads into its own in-memory SQLite database, which measures the
+parse and load CPU cost that process_parallel spreads over cores. Pass a PostgreSQL URL to
+include the database, e.g. --url postgresql://user:pw@localhost:5432 --load-strategy copy
+"""
+
+import argparse
+from functools import partial
+from io import (
+    BytesIO,
+    StringIO,
+)
+from os import cpu_count
+
+from benchmarks.utils import write_knw_file
+from KNWToSQL.backfill import create_url_session
+from KNWToSQL.knw_to_sql import process_parallel
+from KNWToSQL.models import (
+    KNWData,
+    LoadStrategy,
+    ParserType,
+)
+from loganalytics.logger import ConsoleLogger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, 4, cpu_count() or 1}),
+    )
+    parser.add_argument("--url", default="sqlite://")
+    parser.add_argument(
+        "--range-bytes",
+        type=int,
+        default=None,
+        help="Bytes per range, defaults to the file size split evenly over the workers",
+    )
+    parser.add_argument(
+        "--load-strategy",
+        type=LoadStrategy,
+        default=LoadStrategy.ORM,
+        choices=list(LoadStrategy),
+    )
+    parser.add_argument(
+        "--parser", type=ParserType, default=ParserType.CSV, choices=list(ParserType)
+    )
+    args = parser.parse_args()
+
+    text = StringIO()
+    write_knw_file(text, args.rows)
+    data = text.getvalue().encode()
+    print(f"Synthetic KNW file: {args.rows} rows, {len(data) / 1e6:.1f} MB")
+    print(f"{'workers':>8} {'seconds':>9} {'rows/s':>10} {'speedup':>8}")
+
+    baseline = None
+    for workers in args.workers:
+        if args.url != "sqlite://":
+            session = create_url_session(args.url, create_tables=True)
+            session.query(KNWData).delete()
+            session.commit()
+            session.close()
+        report = process_parallel(
+            file=BytesIO(data),
+            name="benchmark.csv",
+            session_factory=partial(create_url_session, args.url, create_tables=True),
+            logger=ConsoleLogger(),
+            workers=workers,
+            range_bytes=args.range_bytes or len(data) // workers + 1,
+            load_strategy=args.load_strategy,
+            parser=args.parser,
+        )
+        if not report.succeeded:
+            raise SystemExit(report.summary())
+        baseline = baseline or report.rows_per_second
+        print(
+            f"{workers:>8} {report.seconds:>9.2f} {report.rows_per_second:>10.0f} "
+            f"{report.rows_per_second / baseline:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
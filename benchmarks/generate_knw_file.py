@@ -0,0 +1,32 @@
+"""
+Write a synthetic KNW file with the real header and tab separated layout.
+
+Usage:
+    python -m benchmarks.generate_knw_file knw_1m.csv --rows 1000000
+"""
+
+import argparse
+from datetime import datetime
+
+from benchmarks.utils import write_knw_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--start",
+        type=datetime.fromisoformat,
+        default=datetime(1979, 1, 1, 1),
+        help="DTG of the first row in ISO format",
+    )
+    args = parser.parse_args()
+
+    with open(args.path, "w") as f:
+        write_knw_file(f, args.rows, start=args.start, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
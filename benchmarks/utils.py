@@ -0,0 +1,57 @@
+import random
+from datetime import (
+    datetime,
+    timedelta,
+)
+from typing import IO
+
+KNW_HEADER_INFO = [
+    "#kdc:filename=KNW-1.0_H37-ERA_NL-001-001.zip",
+    "#kdc:temporal_extent={start}Z - {end}Z",
+    "#kdc:westbound_longitude=1.48935",
+    "#kdc:eastbound_longitude=1.52482",
+    "#kdc:northbound_latitude=50.43816",
+    "#kdc:southbound_latitude=50.41556",
+    "#kdc:file_version=1.0",
+    "# F (wind speed) in m/s, D (wind from direction) in degree and clockwise from North, "
+    "T (temperature) in Kelvin, Q (specific humidity) in kg/kg, P (pressure) in Pascal",
+]
+HEIGHTS = ["010", "020", "040", "060", "080", "100", "150", "200"]
+
+# Value range and number of decimals per quantity, roughly matching real KNW data
+QUANTITIES = {
+    "F": (0.0, 25.0, 2),
+    "D": (0.0, 360.0, 2),
+    "T": (255.0, 305.0, 2),
+    "Q": (0.0005, 0.02, 6),
+    "P": (95000.0, 104000.0, 1),
+}
+
+
+def write_knw_file(
+    file: IO[str],
+    row_count: int,
+    start: datetime = datetime(1979, 1, 1, 1),
+    seed: int = 42,
+):
+    """
+    Write a synthetic KNW file with the real 8 line header, column header and tab separated
+    hourly rows of plausible values to a text stream.
+    """
+    rng = random.Random(seed)
+    end = start + timedelta(hours=row_count - 1)
+    for line in KNW_HEADER_INFO:
+        file.write(
+            line.format(start=start.isoformat(), end=end.isoformat()) + "\t" * 40 + "\n"
+        )
+    columns = [f"{quantity}{height}" for height in HEIGHTS for quantity in QUANTITIES]
+    file.write("# DTG\t" + "\t".join(columns) + "\n")
+
+    ranges = [QUANTITIES[column[0]] for column in columns]
+    dtg = start
+    for _ in range(row_count):
+        values = (
+            f"{rng.uniform(low, high):.{decimals}f}" for low, high, decimals in ranges
+        )
+        file.write(dtg.strftime("%Y-%m-%d %H:%M") + "\t" + "\t".join(values) + "\n")
+        dtg += timedelta(hours=1)
@@ -0,0 +1,120 @@
+import logging
+import random
+from collections import Counter
+from threading import Lock
+from time import monotonic
+from typing import (
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+)
+
+from loganalytics.law import (
+    DEFAULT_CLOSE_TIMEOUT,
+    LogAnalyticsWorkspaceLogger,
+)
+
+
+class LogAnalyticsWorkspaceHandler(logging.Handler):
+    """
+    logging.Handler that sends records through a LogAnalyticsWorkspaceLogger, so modules can log
+    with the stdlib logging API.
+
+    Records below level are rejected by logging before they reach the handler, so they are never
+    formatted, JSON encoded or signed. High-volume messages can be rate limited or sampled per
+    key. The key of a record is its law_key extra, e.g. logger.info(..., extra={"law_key":
+    "upload"}), or else its unformatted message, so every call site has its own key. Limited
+    records are dropped before formatting and counted in suppressed.
+    """
+
+    def __init__(
+        self,
+        law_logger: LogAnalyticsWorkspaceLogger,
+        level: int = logging.INFO,
+        rate_limits: Optional[Dict[str, int]] = None,
+        rate_window: float = 60.0,
+        sample_rates: Optional[Dict[str, float]] = None,
+        random_fn: Callable[[], float] = random.random,
+    ):
+        """
+        :param law_logger: Logger the records are sent with
+        :param level: Minimum level of records to send
+        :param rate_limits: Maximum records sent per key per rate_window seconds
+        :param rate_window: Length of a rate limit window in seconds
+        :param sample_rates: Fraction of records sent per key, between 0 and 1
+        :param random_fn: Source of random numbers in [0, 1) for sampling
+        """
+        super().__init__(level=level)
+        self.law_logger = law_logger
+        self.rate_limits = rate_limits or {}
+        self.rate_window = rate_window
+        self.sample_rates = sample_rates or {}
+        self._random = random_fn
+        self._windows: Dict[str, Tuple[float, int]] = {}
+        # Guards _windows and suppressed, logging.Handler only locks around emit in handle
+        self._limits_lock = Lock()
+        self.suppressed: Counter = Counter()
+
+    @staticmethod
+    def get_key(record: logging.LogRecord) -> str:
+        return getattr(record, "law_key", None) or str(record.msg)
+
+    def allow(self, record: logging.LogRecord) -> bool:
+        """Apply the sample rate and rate limit of the key of a record"""
+        key = self.get_key(record)
+        sample_rate = self.sample_rates.get(key)
+        if sample_rate is not None and self._random() >= sample_rate:
+            with self._limits_lock:
+                self.suppressed[key] += 1
+            return False
+        limit = self.rate_limits.get(key)
+        if limit is None:
+            return True
+        with self._limits_lock:
+            now = monotonic()
+            started, count = self._windows.get(key, (now, 0))
+            if now - started >= self.rate_window:
+                started, count = now, 0
+            if count >= limit:
+                self.suppressed[key] += 1
+                return False
+            self._windows[key] = (started, count + 1)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        if not self.allow(record):
+            return
+        try:
+            self.law_logger.log(message=self.format(record), severity=record.levelno)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        # logging.shutdown flushes every handler, a stuck background sender must not block it
+        self.law_logger.flush(timeout=DEFAULT_CLOSE_TIMEOUT)
+
+
+def get_law_logger(
+    name: str,
+    law_logger: LogAnalyticsWorkspaceLogger,
+    level: int = logging.INFO,
+    **handler_options,
+) -> logging.Logger:
+    """
+    Return the stdlib logger name with a LogAnalyticsWorkspaceHandler attached, replacing any
+    handler attached by an earlier call. The logger does not propagate to the root logger, whose
+    handlers the Functions host already forwards elsewhere.
+
+    :param handler_options: Other LogAnalyticsWorkspaceHandler arguments
+    """
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        if isinstance(handler, LogAnalyticsWorkspaceHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(
+        LogAnalyticsWorkspaceHandler(law_logger, level=level, **handler_options)
+    )
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
@@ -1,13 +1,41 @@
 import base64
+import binascii
 import datetime
 import hashlib
 import hmac
 import json
-from typing import Set
+import logging
+from queue import (
+    Empty,
+    Full,
+    Queue,
+)
+from threading import (
+    Lock,
+    Thread,
+)
+from time import (
+    monotonic,
+    perf_counter,
+)
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Union,
+)
 
 import requests
 from requests.adapters import Retry
-from requests.exceptions import RetryError
+from requests.exceptions import (
+    ConnectionError,
+    RequestException,
+    RetryError,
+    Timeout,
+)
 from requests.sessions import HTTPAdapter
 
 from loganalytics.errors import (
@@ -15,11 +43,146 @@ from loganalytics.errors import (
     LogAnalyticsWorkspaceRetryError,
     ValidationError,
 )
+from loganalytics.spool import (
+    DEFAULT_MAX_SPOOL_BYTES,
+    RecordSpool,
+)
+
+# Maximum body size of a single post to the HTTP Data Collector API
+MAX_POST_BYTES = 30 * 1024 * 1024
+
+# Default thresholds at which buffered records are sent in batch mode
+DEFAULT_BATCH_RECORDS = 500
+DEFAULT_BATCH_BYTES = 1024 * 1024
+DEFAULT_BATCH_AGE = 10.0
+
+# Records the background sender queue holds before new records are dropped
+DEFAULT_QUEUE_SIZE = 10_000
+
+# Seconds the Function entry points wait for the background sender on exit
+DEFAULT_CLOSE_TIMEOUT = 30.0
+
+# Times a post rejected with an invalid signature is signed again and resent. Azure sometimes
+# rejects valid signatures, a wrong key is rejected every time
+MAX_SIGNATURE_RETRIES = 2
+
+INVALID_SIGNATURE_MESSAGE = (
+    "An invalid signature was specified in the Authorization header"
+)
+
+# Queue markers telling the background sender to send its batch, or to send it and stop
+_FLUSH = object()
+_STOP = object()
+# Queue marker telling the background sender to send the records spooled by earlier invocations
+_REPLAY = object()
+
+
+class SenderStats:
+    """Counters of the background sender. Enqueue latency is the time log() blocks the caller"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.failed = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.enqueue_seconds = 0.0
+        self.max_enqueue_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def mean_enqueue_seconds(self) -> float:
+        return self.enqueue_seconds / self.enqueued if self.enqueued else 0.0
+
+    def record_enqueue(self, seconds: float, dropped: bool):
+        with self._lock:
+            if dropped:
+                self.dropped += 1
+            else:
+                self.enqueued += 1
+                self.enqueue_seconds += seconds
+                self.max_enqueue_seconds = max(self.max_enqueue_seconds, seconds)
+
+    def record_delivery(self, count: int, error: Optional[str] = None):
+        with self._lock:
+            if error is None:
+                self.delivered += count
+            else:
+                self.failed += count
+                self.last_error = error
+
+    def record_spool(self, count: int, dropped: int, error: str):
+        with self._lock:
+            self.spooled += count
+            self.dropped += dropped
+            self.last_error = error
+
+    def record_replay(self, count: int):
+        with self._lock:
+            self.replayed += count
+
+    def summary(self) -> str:
+        return (
+            f"enqueued={self.enqueued} delivered={self.delivered} failed={self.failed} "
+            f"spooled={self.spooled} replayed={self.replayed} dropped={self.dropped} "
+            f"mean_enqueue_us={self.mean_enqueue_seconds * 1e6:.1f} "
+            f"max_enqueue_us={self.max_enqueue_seconds * 1e6:.1f}"
+        )
+
+
+def split_batches(records: List[str], max_bytes: int = MAX_POST_BYTES) -> Iterator[str]:
+    """
+    Join JSON encoded records into JSON array payloads of at most max_bytes bytes each. A record
+    that is larger than max_bytes on its own is sent in a payload by itself.
+
+    :param records: JSON encoded records
+    :param max_bytes: Maximum size of a payload in bytes
+    """
+    for batch in group_batches(records, max_bytes):
+        yield f"[{','.join(batch)}]"
+
+
+def group_batches(
+    records: List[str], max_bytes: int = MAX_POST_BYTES
+) -> Iterator[List[str]]:
+    """Group records into the batches that split_batches joins into payloads"""
+    batch: List[str] = []
+    # Two bytes for the brackets of the array
+    size = 2
+    for record in records:
+        record_size = len(record.encode("utf-8")) + (1 if batch else 0)
+        if batch and size + record_size > max_bytes:
+            yield batch
+            batch, size, record_size = [], 2, record_size - 1
+        batch.append(record)
+        size += record_size
+    if batch:
+        yield batch
 
 
 class LogAnalyticsWorkspaceLogger:
     """
     Logger class to send logs to LAW through HTTP API
+
+    In batch mode records are buffered and sent together as a JSON array, with one signed post
+    per batch, once max_batch_records, max_batch_bytes or max_batch_age is reached. Call flush
+    before the process exits to send the remainder.
+
+    In background mode log() only puts the record on a bounded queue and returns, a daemon thread
+    batches the records with the same thresholds and posts them. Records are dropped and counted
+    when the queue is full, and failed posts are counted instead of raised, see stats. Call close
+    before the process exits to send the remainder and stop the thread.
+
+    With a spool_path, records that cannot be delivered because of a transient failure are
+    appended to a RecordSpool in local storage instead of raising or being lost. Records that are
+    rejected for good are dropped and counted as failed. After the first transient failure later
+    records go straight to the spool, so an outage does not cost every log call the retries. Call
+    replay_spool at the start of the next invocation to send them.
+
+    The logger is thread-safe. Copies sent to other processes log unbatched in the foreground, as
+    nothing would flush their buffer.
     """
 
     def __init__(
@@ -30,6 +193,14 @@ class LogAnalyticsWorkspaceLogger:
         max_retries: int = 3,
         backoff_factor: float = 1.0,
         retryable_error_codes: Set[int] = {503},
+        batch: bool = False,
+        max_batch_records: int = DEFAULT_BATCH_RECORDS,
+        max_batch_bytes: int = DEFAULT_BATCH_BYTES,
+        max_batch_age: float = DEFAULT_BATCH_AGE,
+        background: bool = False,
+        max_queue_size: int = DEFAULT_QUEUE_SIZE,
+        spool_path: Optional[str] = None,
+        max_spool_bytes: int = DEFAULT_MAX_SPOOL_BYTES,
     ):
         """
         :param workspace_id: workspace ID of Log Analytics Workspace in Azure
@@ -41,9 +212,19 @@ class LogAnalyticsWorkspaceLogger:
         :param backoff_factor: Factor to increase waiting time by between successive retries
           wait time is: {backoff factor} * (2 ** ({number of total retries} - 1)). See Retry docs
           for more info
+        :param batch: Buffer records and send them in batches instead of one post per record
+        :param max_batch_records: Send the buffer when it holds this many records
+        :param max_batch_bytes: Send the buffer when its records take this many bytes
+        :param max_batch_age: Send the buffer when its oldest record is this many seconds old.
+          Checked when a record is logged, or continuously in background mode
+        :param background: Send records from a background thread, log() does not block
+        :param max_queue_size: Records queued for the background thread before dropping records
+        :param spool_path: File to spool undeliverable records to, None to raise or count them
+        :param max_spool_bytes: Records are dropped once the spool file is this large
         """
         self._workspace_id = workspace_id
         self._shared_key = shared_key
+        self._init_signing()
         self._custom_log_table_name = custom_log_table_name
         self.max_retries = max_retries
         self.backoff_factor = backoff_factor
@@ -53,6 +234,70 @@ class LogAnalyticsWorkspaceLogger:
             retryable_error_codes=self.retryable_error_codes,
             backoff_factor=self.backoff_factor,
         )
+        self.batch = batch
+        self.max_batch_records = max_batch_records
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_age = max_batch_age
+        self.background = background
+        self.max_queue_size = max_queue_size
+        self.spool_path = spool_path
+        self.max_spool_bytes = max_spool_bytes
+        self._init_buffer()
+
+    def _init_signing(self):
+        """Decode the shared key once and key an HMAC that signatures are copied from"""
+        try:
+            decoded_key = base64.b64decode(self._shared_key)
+        except binascii.Error as e:
+            raise ValidationError(f"shared_key is not valid base64: {str(e)}")
+        self._hmac = hmac.new(key=decoded_key, digestmod=hashlib.sha256)
+        self._url = (
+            f"https://{self._workspace_id}.ods.opinsights.azure.com/"
+            f"api/logs?api-version=2016-04-01"
+        )
+
+    def _init_buffer(self):
+        self._lock = Lock()
+        self._buffer: List[str] = []
+        self._buffered_bytes = 0
+        self._oldest: Optional[float] = None
+        self.stats = SenderStats()
+        self._spool: Optional[RecordSpool] = None
+        self._spool_only = False
+        if self.spool_path is not None:
+            self._spool = RecordSpool(self.spool_path, self.max_spool_bytes)
+        self._queue: Optional[Queue] = None
+        self._thread: Optional[Thread] = None
+        if self.background:
+            self._queue = Queue(maxsize=self.max_queue_size)
+            self._thread = Thread(
+                target=self._run_sender, name="law-sender", daemon=True
+            )
+            self._thread.start()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        for name in (
+            "_lock",
+            "_buffer",
+            "_buffered_bytes",
+            "_oldest",
+            "stats",
+            "_spool",
+            "_spool_only",
+            "_queue",
+            "_thread",
+            "_hmac",
+        ):
+            del state[name]
+        state["batch"] = False
+        state["background"] = False
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._init_signing()
+        self._init_buffer()
 
     def log(self, message: str, severity: int):
         """
@@ -70,7 +315,220 @@ class LogAnalyticsWorkspaceLogger:
                 f"severity: {type(severity)}"
             )
 
-        self._log(message, severity)
+        if self._queue is not None:
+            started = perf_counter()
+            record = json.dumps({"message": message, "severity": severity})
+            try:
+                self._queue.put_nowait(record)
+            except Full:
+                self.stats.record_enqueue(perf_counter() - started, dropped=True)
+            else:
+                self.stats.record_enqueue(perf_counter() - started, dropped=False)
+            return
+
+        if not self.batch:
+            if self._spool is None:
+                self._log(message, severity)
+            else:
+                self._send_batches(
+                    [json.dumps({"message": message, "severity": severity})]
+                )
+            return
+
+        record = json.dumps({"message": message, "severity": severity})
+        with self._lock:
+            self._buffer.append(record)
+            self._buffered_bytes += len(record.encode("utf-8"))
+            if self._oldest is None:
+                self._oldest = monotonic()
+            full = (
+                len(self._buffer) >= self.max_batch_records
+                or self._buffered_bytes >= self.max_batch_bytes
+                or monotonic() - self._oldest >= self.max_batch_age
+            )
+            records = self._take_buffer() if full else []
+        self._send_batches(records)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Send all buffered records. In background mode wait until the background thread sent all
+        records logged before the call.
+
+        :param timeout: Seconds to wait for the background thread, None to wait indefinitely
+        :return: False if the background thread did not finish in time
+        """
+        if self._queue is None:
+            with self._lock:
+                records = self._take_buffer()
+            self._send_batches(records)
+            return True
+        return self._put_marker(_FLUSH, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """
+        Send all buffered records and stop the background thread. Logging after close raises
+        nothing but records are no longer sent in background mode.
+
+        :param timeout: Seconds to wait for the background thread, None to wait indefinitely
+        :return: False if the background thread did not finish in time
+        """
+        if self._queue is None:
+            return self.flush()
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        deadline = None if timeout is None else monotonic() + timeout
+        if not self._put_marker(_STOP, timeout):
+            return False
+        self._thread.join(
+            None if deadline is None else max(0.0, deadline - monotonic())
+        )
+        return not self._thread.is_alive()
+
+    def replay_spool(self):
+        """
+        Send the records spooled by earlier invocations, in batches. Records that fail again go
+        back to the spool. In background mode the background thread sends them and this returns
+        immediately.
+        """
+        if self._spool is None:
+            return
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait(_REPLAY)
+            except Full:
+                pass
+            return
+        self._replay()
+
+    def log_stats(self):
+        """Log the background sender counters, to be called just before close"""
+        if self.background or self._spool is not None:
+            self.log(
+                message=f"LAW sender: {self.stats.summary()}", severity=logging.INFO
+            )
+
+    def _put_marker(self, marker: object, timeout: Optional[float]) -> bool:
+        """Queue a marker and wait until the background thread processed everything before it"""
+        queue = self._queue
+        deadline = None if timeout is None else monotonic() + timeout
+        try:
+            queue.put(marker, timeout=timeout)  # type: ignore
+        except Full:
+            return False
+        with queue.all_tasks_done:  # type: ignore
+            while queue.unfinished_tasks:  # type: ignore
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                queue.all_tasks_done.wait(remaining)  # type: ignore
+        return True
+
+    def _run_sender(self):
+        """Background thread: take records from the queue and send them in batches"""
+        queue = self._queue
+        records: List[str] = []
+        size = 0
+        oldest = 0.0
+        while True:
+            timeout = (
+                None
+                if not records
+                else max(0.0, oldest + self.max_batch_age - monotonic())
+            )
+            try:
+                item = queue.get(timeout=timeout)  # type: ignore
+            except Empty:
+                item = None
+            if isinstance(item, str):
+                if not records:
+                    oldest = monotonic()
+                records.append(item)
+                size += len(item.encode("utf-8"))
+                if (
+                    len(records) < self.max_batch_records
+                    and size < self.max_batch_bytes
+                ):
+                    continue
+            self._deliver(records)
+            if item is _REPLAY:
+                self._replay()
+            markers = 1 if item is _FLUSH or item is _STOP or item is _REPLAY else 0
+            for _ in range(len(records) + markers):
+                queue.task_done()  # type: ignore
+            records, size = [], 0
+            if item is _STOP:
+                return
+
+    def _deliver(self, records: List[str]):
+        """Send records from the background thread, counting failures instead of raising them"""
+        if not records:
+            return
+        try:
+            spooled = self._send_batches(records)
+        except (RequestException, ValidationError) as e:
+            self.stats.record_delivery(len(records), str(e))
+        else:
+            self.stats.record_delivery(len(records) - spooled)
+
+    def _replay(self):
+        records = self._spool.take()  # type: ignore
+        spooled = 0
+        for start in range(0, len(records), self.max_batch_records):
+            spooled += self._send_batches(
+                records[start : start + self.max_batch_records]
+            )
+        self._spool.commit()  # type: ignore
+        self.stats.record_replay(len(records) - spooled)
+
+    def _take_buffer(self) -> List[str]:
+        """Empty the buffer and return its records. Call while holding the lock"""
+        records = self._buffer
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._oldest = None
+        return records
+
+    def _send_batches(self, records: List[str]) -> int:
+        """
+        Post records in batches. Without a spool failures are raised. With a spool a transient
+        failure spools the records of the failed batch and of all batches after it, a batch that
+        is rejected for good is dropped and counted as failed, so it cannot block the spool.
+
+        :return: Number of records spooled or dropped instead of sent
+        """
+        if self._spool_only:
+            return self._spool_records(records, "Spooling after an earlier failed post")
+        batches = list(group_batches(records))
+        dropped = 0
+        for index, batch in enumerate(batches):
+            try:
+                self._post(f"[{','.join(batch)}]")
+            except RequestException as e:
+                if self._spool is None:
+                    raise
+                if not self._is_transient(e):
+                    self.stats.record_delivery(len(batch), str(e))
+                    dropped += len(batch)
+                    continue
+                self._spool_only = True
+                unsent = [record for failed in batches[index:] for record in failed]
+                return dropped + self._spool_records(unsent, str(e))
+        return dropped
+
+    @staticmethod
+    def _is_transient(error: RequestException) -> bool:
+        """Whether a failed post may succeed later: retries ran out, no connection or a 5xx"""
+        if isinstance(
+            error,
+            (LogAnalyticsWorkspaceRetryError, RetryError, ConnectionError, Timeout),
+        ):
+            return True
+        return error.response is not None and error.response.status_code >= 500
+
+    def _spool_records(self, records: List[str], error: str) -> int:
+        spooled = self._spool.append(records)  # type: ignore
+        self.stats.record_spool(spooled, len(records) - spooled, error)
+        return len(records)
 
     def _log(self, message: str, severity: int):
         """
@@ -86,90 +544,92 @@ class LogAnalyticsWorkspaceLogger:
         }
 
         data = json.dumps(json_data)
+        self._post(data)
 
-        try:
-            # Making signature at the last possible moment before post, in case of tstamp mismatch
-            signature = self._build_signature(data)
-            response = self.session.post(
-                url=(
-                    f"https://{self._workspace_id}.ods.opinsights.azure.com/"
-                    f"api/logs?api-version=2016-04-01"
-                ),
-                data=data,
-                headers={
-                    "Authorization": f"SharedKey {self._workspace_id}:{signature}",
-                    "Content-Type": "application/json",
-                    "Log-Type": self._custom_log_table_name,
-                    "x-ms-date": datetime.datetime.utcnow().strftime(
-                        "%a, %d %b %Y %H:%M:%S GMT",
-                    ),
-                },
-            )
-        except RetryError as e:
-            raise LogAnalyticsWorkspaceRetryError(
-                f"Still no successful request after {self.max_retries} requests.\n"
-                f"URL: {e.request.url}\n"
-                f"MSG: {e.strerror}\n"
-                f"HEADERS: {e.request.headers}"
-            )
+    def _post(self, data: str):
+        """
+        Sign and post a JSON payload, a single record or an array of records.
 
-        if response.status_code != 200:
-            if (
+        NOTE: Raises HTTPError when status code of the response of the API call is not 200.
+        :param data: json_data serialized to string format
+        """
+        body = data.encode("utf-8")
+        for _ in range(MAX_SIGNATURE_RETRIES + 1):
+            # Signing at the last possible moment before post, in case of tstamp mismatch. The
+            # signed date is the x-ms-date header, so both are formatted from one timestamp
+            date = self._format_date()
+            signature = self._build_signature(body, date)
+            try:
+                response = self.session.post(
+                    url=self._url,
+                    data=body,
+                    headers={
+                        "Authorization": f"SharedKey {self._workspace_id}:{signature}",
+                        "Content-Type": "application/json",
+                        "Log-Type": self._custom_log_table_name,
+                        "x-ms-date": date,
+                    },
+                )
+            except RetryError as e:
+                raise LogAnalyticsWorkspaceRetryError(
+                    f"Still no successful request after {self.max_retries} requests.\n"
+                    f"URL: {e.request.url}\n"
+                    f"MSG: {e.strerror}\n"
+                    f"HEADERS: {e.request.headers}"
+                )
+
+            # Azure sometimes temporarily bugs out and throws a 403 due to a bad signature. The
+            # session's Retry cannot resend these because they need a new signature, so sign and
+            # post again, a limited number of times in case the key itself is wrong
+            if not (
                 response.status_code == 403
-                and "An invalid signature was specified in the Authorization header"
-                in response.text
+                and INVALID_SIGNATURE_MESSAGE in response.text
             ):
-                # Because Azure sometimes temporarily bugs out and throws a 403 due to a bad
-                # signature we want to retry the call. We cannot do this in the Retry of the
-                # session because we need a new signature for this, so we recursively call the
-                # function again to rebuild it. This could cause an infinite loop if the signature
-                # is actually being built wrong. So keep an eye on this.
-                # TODO: Replace with something more robust
-                return self._log(message, severity)
+                break
 
+        if response.status_code != 200:
             raise LogAnalyticsWorkspaceResponseError(
                 f"Unexpected response with code {response.status_code}\n"
                 f"URL: {response.url}\n"
                 f"BODY: {response.text}\n"
-                f"HEADERS: {response.headers}"
+                f"HEADERS: {response.headers}",
+                response=response,
             )
 
-    def _build_signature(self, data: str) -> str:
+    @staticmethod
+    def _format_date() -> str:
+        # Date must be in this format, according to Microsoft:
+        # Mon, 04 Apr 2016 08:00:00 GMT
+        return datetime.datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+    def _build_signature(
+        self, data: Union[str, bytes], date: Optional[str] = None
+    ) -> str:
         """
         Builds a signature to authenticate an HTTP request to the HTTP Data Collector API from
         Azure.
 
         To authenticate a request the requests must be signed with a primary or secondary key
         found in Azure, and they have to be built in a specific way.
-        :param data: json_data serialized to string format
+        :param data: json_data serialized to string format, or its UTF-8 encoded bytes
+        :param date: x-ms-date header value of the request. Defaults to now
         :return: HTTP Authentication signature string
         """
-        # Date must be in this format, according to Microsoft:
-        # Mon, 04 Apr 2016 08:00:00 GMT
-        date_string_in_microsoft_format = datetime.datetime.utcnow().strftime(
-            "%a, %d %b %Y %H:%M:%S GMT"
-        )
-
+        if isinstance(data, str):
+            data = data.encode("utf-8")
         string_to_sign = (
             f"POST\n"
             f"{len(data)}\n"
             f"application/json\n"
-            f"x-ms-date:{date_string_in_microsoft_format}\n"
+            f"x-ms-date:{date or self._format_date()}\n"
             f"/api/logs"
         )
-        message_in_bytes = bytes(string_to_sign, encoding="utf-8")
 
+        # Copying the keyed HMAC skips hashing the key again for every signature
+        signature_hmac = self._hmac.copy()
+        signature_hmac.update(string_to_sign.encode("utf-8"))
         # Base64 encode then decode is necessary to get hmac output to human readable string
-        decoded_key = base64.b64decode(self._shared_key)
-        signature = base64.b64encode(
-            hmac.new(
-                key=decoded_key,
-                msg=message_in_bytes,
-                digestmod=hashlib.sha256,
-            ).digest()
-        ).decode()
-
-        return signature
+        return base64.b64encode(signature_hmac.digest()).decode()
 
     @staticmethod
     def _configure_requests_session(
@@ -0,0 +1,24 @@
+import logging
+from typing import (
+    Any,
+    Protocol,
+)
+
+
+class SupportsLog(Protocol):
+    """Logger interface of the processors, implemented by LogAnalyticsWorkspaceLogger"""
+
+    def log(self, message: str, severity: int) -> Any: ...
+
+
+class ConsoleLogger:
+    """
+    Picklable SupportsLog that logs through stdlib logging, for command line tools and worker
+    processes, which cannot share a LogAnalyticsWorkspaceLogger
+    """
+
+    def __init__(self, name: str = __name__):
+        self.name = name
+
+    def log(self, message: str, severity: int):
+        logging.getLogger(self.name).log(severity, message)
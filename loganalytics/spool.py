@@ -0,0 +1,152 @@
+import os
+import struct
+import tempfile
+from glob import (
+    escape as glob_escape,
+    glob,
+)
+from threading import Lock
+from time import time
+from typing import (
+    List,
+    Optional,
+)
+from uuid import uuid4
+
+# Each record is stored as its UTF-8 encoded length in 4 bytes, big-endian, then the record
+_LENGTH = struct.Struct(">I")
+
+DEFAULT_SPOOL_DIR = os.path.join(tempfile.gettempdir(), "law_spool")
+
+# Age at which a spool file claimed for replay is taken to belong to an interrupted invocation.
+# Well over the maximum Function timeout, so running replays are never claimed twice
+DEFAULT_STALE_SECONDS = 3 * 3600
+
+_CLAIM_SUFFIX = ".replay"
+
+# Size at which the spool stops accepting records, local temp storage of a Function host is small
+DEFAULT_MAX_SPOOL_BYTES = 100 * 1024 * 1024
+
+
+def get_spool_path(name: str) -> str:
+    return os.path.join(DEFAULT_SPOOL_DIR, f"{name}.spool")
+
+
+class RecordSpool:
+    """
+    Append-only file of length-prefixed JSON encoded records that could not be delivered.
+
+    Every append is a single write to a file opened in append mode, so threads and worker
+    processes can spool to the same file. take() moves the file aside before reading it, records
+    appended while it is replayed go to a new file. A record cut off by a crash mid-write is
+    skipped.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = DEFAULT_MAX_SPOOL_BYTES,
+        stale_seconds: float = DEFAULT_STALE_SECONDS,
+    ):
+        """
+        :param path: Spool file, its directory is created when needed
+        :param max_bytes: Records are dropped instead of spooled once the file is this large
+        :param stale_seconds: Age at which a claimed spool file is considered abandoned
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self._lock = Lock()
+        self._claimed: List[str] = []
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, records: List[str]) -> int:
+        """
+        Append records to the spool.
+
+        :param records: JSON encoded records
+        :return: Number of records spooled, the others were dropped because the spool is full
+        """
+        data = bytearray()
+        count = 0
+        with self._lock:
+            available = self.max_bytes - self.size()
+            for record in records:
+                encoded = record.encode("utf-8")
+                if len(data) + _LENGTH.size + len(encoded) > available:
+                    break
+                data += _LENGTH.pack(len(encoded)) + encoded
+                count += 1
+            if data:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(data)
+        return count
+
+    def take(self) -> List[str]:
+        """
+        Remove and return all spooled records, oldest first, and call commit once they are sent
+        or spooled again.
+
+        The spool file is claimed by renaming it to a name unique to this call, so concurrent
+        invocations never return the same records. Claims older than stale_seconds belong to a
+        replay that was interrupted, those are claimed again and returned first.
+        """
+        with self._lock:
+            claims = []
+            for stale in self._stale_claims():
+                claims.append(self._claim(stale))
+            claims.append(self._claim(self.path))
+            records = []
+            for claim in claims:
+                if claim is not None:
+                    self._claimed.append(claim)
+                    records.extend(self._read(claim))
+            return records
+
+    def commit(self):
+        """Delete the files of the records returned by take"""
+        with self._lock:
+            for claim in self._claimed:
+                try:
+                    os.remove(claim)
+                except FileNotFoundError:
+                    pass
+            self._claimed = []
+
+    def _claim(self, path: str) -> Optional[str]:
+        """Atomically rename path to a new claim, None if another invocation got it first"""
+        claim = f"{self.path}.{int(time())}.{uuid4().hex}{_CLAIM_SUFFIX}"
+        try:
+            os.replace(path, claim)
+        except FileNotFoundError:
+            return None
+        return claim
+
+    def _stale_claims(self) -> List[str]:
+        stale = []
+        for claim in sorted(glob(f"{glob_escape(self.path)}.*{_CLAIM_SUFFIX}")):
+            claimed_at = claim[len(self.path) + 1 :].split(".", 1)[0]
+            if claimed_at.isdigit() and time() - int(claimed_at) >= self.stale_seconds:
+                stale.append(claim)
+        return stale
+
+    @staticmethod
+    def _read(path: str) -> List[str]:
+        with open(path, "rb") as f:
+            data = f.read()
+        records = []
+        offset = 0
+        while offset + _LENGTH.size <= len(data):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            if offset + length > len(data):
+                break
+            records.append(data[offset : offset + length].decode("utf-8"))
+            offset += length
+        return records
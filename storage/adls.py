@@ -1,4 +1,8 @@
-from typing import Union
+from typing import (
+    NamedTuple,
+    Optional,
+    Union,
+)
 
 from azure.identity import ManagedIdentityCredential
 from azure.storage.filedatalake import (
@@ -8,6 +12,47 @@ from azure.storage.filedatalake import (
 
 AccountKey = str
 
+# Files up to this size are uploaded with a single append and flush request
+SINGLE_SHOT_THRESHOLD = 8 * 1024 * 1024
+# Size of the chunks larger files are appended in, and how many are appended in parallel
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_MAX_CONCURRENCY = 4
+
+
+class UploadSettings(NamedTuple):
+    chunk_size: int
+    max_concurrency: int
+
+
+def tune_upload(
+    size: int,
+    single_shot_threshold: int = SINGLE_SHOT_THRESHOLD,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    max_concurrency: int = UPLOAD_MAX_CONCURRENCY,
+    max_buffered: Optional[int] = None,
+) -> UploadSettings:
+    """
+    Return the chunk_size and max_concurrency to pass to DataLakeFileClient.upload_data for a
+    file of size bytes. Small files go in one request, larger files in chunks appended by at most
+    max_concurrency threads, but never more threads than there are chunks.
+
+    :param size: Size of the file in bytes
+    :param single_shot_threshold: Largest file uploaded in a single request
+    :param chunk_size: Bytes per append request for larger files
+    :param max_concurrency: Maximum parallel append requests for larger files
+    :param max_buffered: Maximum of chunk_size * max_concurrency, the bytes upload_data reads
+      into memory at once. None to not limit it
+    """
+    if max_buffered is not None:
+        max_buffered = max(max_buffered, 1)
+        single_shot_threshold = min(single_shot_threshold, max_buffered)
+        chunk_size = min(chunk_size, max_buffered)
+        max_concurrency = min(max_concurrency, max_buffered // chunk_size)
+    if size <= single_shot_threshold:
+        return UploadSettings(max(size, 1), 1)
+    chunk_count = -(-size // chunk_size)
+    return UploadSettings(chunk_size, max(1, min(max_concurrency, chunk_count)))
+
 
 def get_adls_client(
     account_name: str,
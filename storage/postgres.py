@@ -1,6 +1,141 @@
-from requests import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from datetime import datetime
+from os import getpid
+from threading import Lock
+from time import perf_counter
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import psycopg2
+from sqlalchemy import (
+    Table,
+    create_engine,
+    event,
+)
+from sqlalchemy.dialects import (
+    postgresql,
+    sqlite,
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import (
+    Session,
+    sessionmaker,
+)
+from sqlalchemy.pool import QueuePool
+
+# Number of characters psycopg2 requests from a file object per read during COPY FROM STDIN
+COPY_READ_SIZE = 8192
+
+
+class PoolStats:
+    """
+    Connection pool counters. A checkout that reuses a pooled connection is a hit, one that has
+    to open a new connection (TCP, TLS and auth handshake) is a miss.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.misses = 0
+        self.acquire_seconds = 0.0
+        self.max_acquire_seconds = 0.0
+
+    @property
+    def hits(self) -> int:
+        return self.checkouts - self.misses
+
+    @property
+    def mean_acquire_seconds(self) -> float:
+        return self.acquire_seconds / self.checkouts if self.checkouts else 0.0
+
+    def record_checkout(self, seconds: float):
+        self.checkouts += 1
+        self.acquire_seconds += seconds
+        self.max_acquire_seconds = max(self.max_acquire_seconds, seconds)
+
+    def summary(self) -> str:
+        return (
+            f"checkouts={self.checkouts} hits={self.hits} misses={self.misses} "
+            f"mean_acquire_ms={self.mean_acquire_seconds * 1000:.2f} "
+            f"max_acquire_ms={self.max_acquire_seconds * 1000:.2f}"
+        )
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records acquire latency and hits and misses in a PoolStats"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        event.listen(self, "connect", self._on_connect)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.stats.misses += 1
+
+    def connect(self):
+        started = perf_counter()
+        connection = super().connect()
+        self.stats.record_checkout(perf_counter() - started)
+        return connection
+
+
+# Engines are cached per process, so warm Function hosts reuse pooled connections across
+# invocations. The pid is part of the key because forked workers must not share the parent's
+# connections.
+_ENGINES: Dict[Tuple, Engine] = {}
+_ENGINES_LOCK = Lock()
+
+
+def get_psql_engine(
+    username: str,
+    password: str,
+    host: str,
+    port: int = 5432,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = True,
+    pool_recycle: int = 1800,
+) -> Engine:
+    """
+    Return the cached engine for the given connection parameters, creating it on first use.
+
+    :param pool_size: Connections kept open in the pool
+    :param max_overflow: Connections opened on top of pool_size under load, closed on check in
+    :param pool_pre_ping: Test connections on checkout, so connections dropped by the server
+      between invocations are replaced instead of failing the first statement
+    :param pool_recycle: Replace connections older than this many seconds
+    """
+    key = (
+        getpid(),
+        username,
+        password,
+        host,
+        port,
+        pool_size,
+        max_overflow,
+        pool_pre_ping,
+        pool_recycle,
+    )
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            engine = create_engine(
+                f"postgresql://{username}:{password}@{host}:{port}",
+                poolclass=InstrumentedQueuePool,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_pre_ping=pool_pre_ping,
+                pool_recycle=pool_recycle,
+            )
+            _ENGINES[key] = engine
+    return engine
 
 
 def create_psql_session(
@@ -8,11 +143,158 @@ def create_psql_session(
     password: str,
     host: str,
     port: int = 5432,
+    **pool_options: Any,
 ) -> Session:
     """
-    Return Postgres session for given connection credentials.
+    Return Postgres session for given connection credentials, bound to the cached engine for
+    these credentials. See get_psql_engine for the pool_options. Close the session when done to
+    return its connection to the pool.
     """
-    connect_str = f"postgresql://{username}:{password}@{host}:{port}"
-    engine = create_engine(connect_str)
+    engine = get_psql_engine(username, password, host, port, **pool_options)
     db_session = sessionmaker(bind=engine)
     return db_session()
+
+
+def get_pool_stats(session: Session) -> Optional[PoolStats]:
+    """Return the PoolStats of the engine a session is bound to, if its pool is instrumented"""
+    return getattr(session.get_bind().pool, "stats", None)
+
+
+def format_copy_value(value: Any) -> str:
+    """
+    Format a single value for the PostgreSQL COPY text format. Floats use repr so they round-trip
+    exactly, None becomes the NULL marker and special characters in strings are escaped.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyStream:
+    """
+    Read-only file-like object that lazily renders rows in PostgreSQL COPY text format.
+
+    Rows are only pulled from the underlying iterable when psycopg2 asks for more data, so at most
+    one read worth of rows is held in memory regardless of how many rows are copied.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._rows: Iterator[Sequence[Any]] = iter(rows)
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self.row_count = 0
+
+    def _fill(self, size: int):
+        while size < 0 or self._buffered < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            line = "\t".join(format_copy_value(value) for value in row) + "\n"
+            self._buffer.append(line)
+            self._buffered += len(line)
+            self.row_count += 1
+
+    def read(self, size: int = -1) -> str:
+        self._fill(size)
+        data = "".join(self._buffer)
+        if 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+            self._buffer = [rest]
+            self._buffered = len(rest)
+        else:
+            self._buffer = []
+            self._buffered = 0
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+
+def copy_rows(
+    session: Session,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+) -> int:
+    """
+    Stream rows into a table with COPY FROM STDIN on the psycopg2 connection behind a session.
+
+    The COPY runs inside the session's current transaction, so it is committed or rolled back
+    together with anything else done on the session. psycopg2 errors are re-raised as the
+    matching SQLAlchemy DBAPIError so callers can handle them like any other SQLAlchemyError.
+
+    :param session: Session bound to a PostgreSQL engine
+    :param table: Name of the table to copy into
+    :param columns: Column names in the same order as the values in each row
+    :param rows: Iterable of row sequences. Consumed lazily
+    :return: Number of rows copied
+    """
+    # Text format with its default tab delimiter, which is what CopyStream renders
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    stream = CopyStream(rows)
+    dbapi_connection = session.connection().connection
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(statement, stream, size=COPY_READ_SIZE)
+    except psycopg2.Error as e:
+        raise DBAPIError.instance(statement, None, e, psycopg2.Error)
+    finally:
+        cursor.close()
+    return stream.row_count
+
+
+# Dialect specific insert constructs supporting ON CONFLICT. SQLite is used as a local stand-in
+INSERT_CONSTRUCTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def upsert_rows(
+    session: Session,
+    table: Table,
+    rows: List[Dict[str, Any]],
+    index_elements: Sequence[str],
+    update: bool = True,
+) -> int:
+    """
+    Insert rows with a single executemany INSERT ... ON CONFLICT statement in the session's
+    transaction. Conflicting rows are updated with the new values, or skipped if update is False.
+
+    Rows must not contain the same index_elements more than once, Postgres refuses to affect a row
+    twice in one statement.
+
+    :param session: Session bound to a PostgreSQL (or SQLite) engine
+    :param table: Table to upsert into
+    :param rows: Dicts of column name to value
+    :param index_elements: Columns of the unique constraint to detect conflicts on
+    :param update: DO UPDATE all other columns on conflict if True, DO NOTHING otherwise
+    :return: Number of rows sent
+    """
+    if not rows:
+        return 0
+    statement = INSERT_CONSTRUCTS[session.get_bind().dialect.name](table)
+    if update:
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={
+                column.name: statement.excluded[column.name]
+                for column in table.columns
+                if column.name not in index_elements
+            },
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+    session.execute(statement, rows)
+    return len(rows)
@@ -8,6 +8,8 @@ def mock_processor(mocker):
     proc = Processor(
         mocker.MagicMock(),
         mocker.MagicMock(),
+        manifest_path=None,
+        retry_queue_path=None,
     )
     proc.adls_client.account_name = "TestAccount"
     return proc
@@ -1,8 +1,33 @@
+import hashlib
+import threading
+import time
+from datetime import (
+    datetime,
+    timedelta,
+)
+
 import pytest
+from freezegun import freeze_time
 from azure.core.exceptions import HttpResponseError
 from requests import HTTPError
-
-from GetActualTenMinSynopticData.errors import SynopticDataError
+from requests.exceptions import (
+    ConnectTimeout,
+    ConnectionError,
+)
+
+from GetActualTenMinSynopticData.errors import (
+    SynopticDataDeadlineError,
+    SynopticDataError,
+)
+from GetActualTenMinSynopticData.get_synoptic_data import (
+    StreamedFile,
+    TransferResult,
+)
+from GetActualTenMinSynopticData.manifest import (
+    MAX_ATTEMPTS,
+    RetryQueue,
+    UploadManifest,
+)
 
 
 def test_get_file_list_returns_file_list_on_200(mock_processor, requests_mock):
@@ -24,6 +49,113 @@ def test_get_file_list_returns_file_list_on_200(mock_processor, requests_mock):
     )
 
 
+def test_get_file_list_follows_pages_until_not_truncated(mock_processor, requests_mock):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations"
+        "/versions/2/files",
+        response_list=[
+            {
+                "status_code": 200,
+                "json": {
+                    "isTruncated": True,
+                    "files": [{"filename": "file1"}, {"filename": "file2"}],
+                    "nextPageToken": "token2",
+                },
+            },
+            {
+                "status_code": 200,
+                "json": {"isTruncated": True, "files": [{"filename": "file3"}]},
+            },
+            {
+                "status_code": 200,
+                "json": {"isTruncated": False, "files": [{"filename": "file4"}]},
+            },
+        ],
+    )
+    mock_processor.max_results = 2
+
+    result = mock_processor.get_file_list("testKey")
+
+    assert [f["filename"] for f in result] == ["file1", "file2", "file3", "file4"]
+    queries = [request.qs for request in requests_mock.request_history]
+    order = {"orderby": ["filename"], "sorting": ["asc"]}
+    assert queries == [
+        {"maxresults": ["2"], **order},
+        {"maxresults": ["2"], "nextpagetoken": ["token2"], **order},
+        {"maxresults": ["2"], "startafterfilename": ["file3"], **order},
+    ]
+
+
+def test_iter_file_list_fetches_next_page_lazily(mock_processor, requests_mock):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations"
+        "/versions/2/files",
+        response_list=[
+            {
+                "status_code": 200,
+                "json": {"isTruncated": True, "files": [{"filename": "file1"}]},
+            },
+            {
+                "status_code": 200,
+                "json": {"isTruncated": False, "files": [{"filename": "file2"}]},
+            },
+        ],
+    )
+
+    files = mock_processor.iter_file_list("testKey", start_after_filename="file0")
+
+    assert next(files) == {"filename": "file1"}
+    assert requests_mock.call_count == 1
+    assert requests_mock.last_request.qs["startafterfilename"] == ["file0"]
+    assert list(files) == [{"filename": "file2"}]
+    assert requests_mock.call_count == 2
+
+
+def test_iter_file_list_prefetches_next_page(mock_processor, requests_mock):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations"
+        "/versions/2/files",
+        response_list=[
+            {
+                "status_code": 200,
+                "json": {
+                    "isTruncated": True,
+                    "files": [{"filename": "file1"}, {"filename": "file2"}],
+                    "nextPageToken": "token",
+                },
+            },
+            {
+                "status_code": 200,
+                "json": {"isTruncated": False, "files": [{"filename": "file3"}]},
+            },
+        ],
+    )
+
+    files = mock_processor.iter_file_list("testKey", prefetch=True)
+
+    assert next(files) == {"filename": "file1"}
+    # The second page is requested before the files of the first page are consumed
+    deadline = time.monotonic() + 5
+    while requests_mock.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert requests_mock.call_count == 2
+    assert requests_mock.last_request.qs["nextpagetoken"] == ["token"]
+    assert list(files) == [{"filename": "file2"}, {"filename": "file3"}]
+    assert requests_mock.call_count == 2
+
+
+def test_iter_file_list_stops_on_truncated_empty_page(mock_processor, requests_mock):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations"
+        "/versions/2/files",
+        status_code=200,
+        json={"isTruncated": True, "files": []},
+    )
+
+    assert list(mock_processor.iter_file_list("testKey")) == []
+    assert requests_mock.call_count == 1
+
+
 def test_get_file_list_raises_error_on_invalid_status_code(
     mock_processor, requests_mock
 ):
@@ -164,11 +296,80 @@ def test_get_file_content_raises_error_on_http_error(mock_processor, requests_mo
     )
 
 
+def test_get_file_list_raises_error_on_timeout(mock_processor, requests_mock):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations"
+        "/versions/2/files",
+        exc=ConnectTimeout("Too slow"),
+    )
+
+    with pytest.raises(SynopticDataError) as excinfo:
+        mock_processor.get_file_list("testKey")
+
+    assert str(excinfo.value).startswith(
+        "Unexpected ConnectTimeout while getting file list from "
+    )
+
+
+def test_get_file_list_raises_error_on_invalid_json(mock_processor, requests_mock):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations"
+        "/versions/2/files",
+        status_code=200,
+        text="not json",
+    )
+
+    with pytest.raises(SynopticDataError) as excinfo:
+        mock_processor.get_file_list("testKey")
+
+    assert str(excinfo.value).startswith("Invalid file list from ")
+
+
+def test_get_file_content_raises_error_on_connection_error_for_get_content(
+    mock_processor, requests_mock
+):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations/"
+        "versions/2/files/file.nc/url",
+        status_code=200,
+        json={"temporaryDownloadUrl": "https://download.me"},
+    )
+    requests_mock.get(url="https://download.me", exc=ConnectionError("Reset"))
+
+    with pytest.raises(SynopticDataError) as excinfo:
+        mock_processor.get_file_content("file.nc", "testKey")
+
+    assert (
+        str(excinfo.value)
+        == "Unexpected ConnectionError while getting content from url https://download.me: Reset"
+    )
+
+
+def test_get_file_content_raises_error_on_missing_download_url(
+    mock_processor, requests_mock
+):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations/"
+        "versions/2/files/file.nc/url",
+        status_code=200,
+        json={"error": "nope"},
+    )
+
+    with pytest.raises(SynopticDataError) as excinfo:
+        mock_processor.get_file_content("file.nc", "testKey")
+
+    assert str(excinfo.value).startswith(
+        "Invalid content URL response from https://api.dataplatform.knmi.nl/"
+    )
+
+
 @pytest.mark.freeze_time("2022-01-01 12:00:00")
 def test_upload_file_content_to_adls_raises_error_on_http_response_error_for_get_url(
     mock_processor,
 ):
-    mock_processor.adls_client.create_file.side_effect = HttpResponseError("Oops")
+    mock_processor.adls_client.get_file_client().upload_data.side_effect = (
+        HttpResponseError("Oops")
+    )
 
     with pytest.raises(SynopticDataError) as excinfo:
         mock_processor.upload_file_content_to_adls(data=b"somedata", filename="file.nc")
@@ -182,18 +383,549 @@ def test_upload_file_content_to_adls_raises_error_on_http_response_error_for_get
 
 @pytest.mark.freeze_time("2022-01-01 12:00:00")
 def test_upload_file_formats_correct_path_and_logs_result(mock_processor, mocker):
-    mock_create_file = mocker.MagicMock()
-    mock_processor.adls_client.create_file.return_value = mock_create_file
+    mock_file_client = mocker.MagicMock()
+    mock_processor.adls_client.get_file_client.return_value = mock_file_client
     mock_processor.upload_file_content_to_adls(data=b"somedata", filename="file.nc")
 
-    mock_processor.adls_client.create_file.assert_called_once_with(
+    mock_processor.adls_client.get_file_client.assert_called_once_with(
         "nc/2022/01/01/12/file.nc"
     )
-    mock_create_file.upload_data.assert_called_once_with(
-        data=b"somedata", overwrite=True
+    mock_processor.adls_client.create_file.assert_not_called()
+    mock_file_client.upload_data.assert_called_once_with(
+        data=b"somedata",
+        length=8,
+        overwrite=True,
+        metadata={"md5": hashlib.md5(b"somedata").hexdigest()},
+        content_settings=mocker.ANY,
+        chunk_size=8,
+        max_concurrency=1,
     )
+    content_settings = mock_file_client.upload_data.call_args.kwargs["content_settings"]
+    assert content_settings.content_md5 == hashlib.md5(b"somedata").digest()
 
     mock_processor.logger.log.assert_called_with(
         message="Successfully uploaded file file.nc to TestAccount",
         severity=20,
     )
+
+
+@pytest.mark.freeze_time("2022-01-01 12:00:00")
+def test_upload_file_creates_empty_files_explicitly(mock_processor):
+    mock_processor.upload_file_content_to_adls(data=b"", filename="file.nc")
+
+    mock_processor.adls_client.create_file.assert_called_once()
+    assert mock_processor.adls_client.create_file.call_args.args == (
+        "nc/2022/01/01/12/file.nc",
+    )
+    mock_processor.adls_client.get_file_client().upload_data.assert_not_called()
+
+
+def test_process_transfers_all_files_with_bounded_concurrency(mock_processor, mocker):
+    filenames = [f"file{i}.nc" for i in range(10)]
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter([{"filename": fname} for fname in filenames]),
+    )
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def get_file_content(filename, api_key):
+        with lock:
+            active.append(filename)
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(filename)
+        return filename.encode()
+
+    mocker.patch.object(
+        mock_processor, "get_file_content", side_effect=get_file_content
+    )
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.max_workers = 3
+
+    report = mock_processor.process("testKey")
+
+    assert sorted(result.filename for result in report.results) == filenames
+    assert report.byte_count == sum(len(fname) for fname in filenames)
+    assert 1 < max(peak) <= 3
+    assert mock_processor.upload_file_content_to_adls.call_count == 10
+
+
+def test_process_isolates_failed_files(mock_processor, mocker):
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter(
+            [
+                {"filename": "file1.nc"},
+                {"filename": "file.txt"},
+                {"filename": "file2.nc"},
+            ]
+        ),
+    )
+
+    def get_file_content(filename, api_key):
+        if filename == "file1.nc":
+            raise SynopticDataError("Oops")
+        return b"data"
+
+    mocker.patch.object(
+        mock_processor, "get_file_content", side_effect=get_file_content
+    )
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+
+    report = mock_processor.process("testKey")
+
+    assert not report.succeeded
+    assert sorted((result.filename, result.error) for result in report.failed) == [
+        ("file.txt", "Invalid file extension for file: file.txt"),
+        ("file1.nc", "Oops"),
+    ]
+    mock_processor.upload_file_content_to_adls.assert_called_once_with(
+        data=b"data", filename="file2.nc", md5=hashlib.md5(b"data").hexdigest()
+    )
+    mock_processor.logger.log.assert_called_with(message=report.summary(), severity=40)
+
+
+def test_process_queues_failed_files_and_retries_due_files_first(
+    mock_processor, mocker
+):
+    now = datetime(2022, 1, 1, 12)
+    retry_queue = RetryQueue()
+    retry_queue.record_failure({"filename": "due.nc"}, "Oops", now - timedelta(hours=1))
+    retry_queue.record_failure({"filename": "waiting.nc"}, "Oops", now)
+    mocker.patch.object(RetryQueue, "load", return_value=retry_queue)
+    save_retry_queue = mocker.patch.object(RetryQueue, "save")
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter(
+            [{"filename": "due.nc"}, {"filename": "waiting.nc"}, {"filename": "bad.nc"}]
+        ),
+    )
+
+    def get_file_content(filename, api_key):
+        if filename == "bad.nc":
+            raise SynopticDataError("Oops")
+        return b"data"
+
+    mocker.patch.object(
+        mock_processor, "get_file_content", side_effect=get_file_content
+    )
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.retry_queue_path = "retry_queue.json"
+    mock_processor.max_workers = 1
+
+    with freeze_time(now):
+        report = mock_processor.process("testKey")
+
+    assert [
+        call.kwargs["filename"]
+        for call in mock_processor.upload_file_content_to_adls.call_args_list
+    ] == ["due.nc"]
+    assert sorted(retry_queue.entries) == ["bad.nc", "waiting.nc"]
+    assert retry_queue.entries["bad.nc"]["attempts"] == 1
+    assert report.queued == 2
+    save_retry_queue.assert_called_once_with(
+        mock_processor.adls_client, "retry_queue.json"
+    )
+
+
+def test_process_defers_remaining_files_once_deadline_is_reached(
+    mock_processor, mocker
+):
+    retry_queue = RetryQueue()
+    mocker.patch.object(RetryQueue, "load", return_value=retry_queue)
+    mocker.patch.object(RetryQueue, "save")
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter([{"filename": f"file{i}.nc"} for i in range(4)]),
+    )
+
+    def get_file_content(filename, api_key):
+        if filename == "file1.nc":
+            raise SynopticDataDeadlineError("Rate limit wait passes the deadline")
+        return b"data"
+
+    mocker.patch.object(
+        mock_processor, "get_file_content", side_effect=get_file_content
+    )
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.retry_queue_path = "retry_queue.json"
+    mock_processor.deadline = time.monotonic() + 60
+    mock_processor.max_workers = 1
+
+    report = mock_processor.process("testKey")
+
+    assert [result.filename for result in report.results] == ["file0.nc", "file1.nc"]
+    assert [result.filename for result in report.deferred] == ["file1.nc"]
+    assert report.succeeded
+    assert retry_queue.entries == {}
+
+
+def test_process_starts_no_files_after_deadline(mock_processor, mocker):
+    mocker.patch.object(
+        mock_processor, "iter_file_list", return_value=iter([{"filename": "file.nc"}])
+    )
+    mocker.patch.object(mock_processor, "transfer_file")
+    mock_processor.deadline = time.monotonic() - 1
+
+    report = mock_processor.process("testKey")
+
+    assert report.results == []
+    mock_processor.transfer_file.assert_not_called()
+
+
+def test_process_marks_invalid_file_extension_as_failed(mock_processor, mocker):
+    mocker.patch.object(
+        mock_processor, "iter_file_list", return_value=iter([{"filename": "file.txt"}])
+    )
+
+    report = mock_processor.process("testKey")
+
+    assert report.failed == [
+        TransferResult("file.txt", 0, 0.0, "Invalid file extension for file: file.txt")
+    ]
+
+
+def test_process_skips_files_in_manifest_and_records_new_files(mock_processor, mocker):
+    listing = [
+        {"filename": "old.nc", "size": 1, "lastModified": "2022-01-01T00:00:00+00:00"},
+        {
+            "filename": "changed.nc",
+            "size": 2,
+            "lastModified": "2022-01-01T00:10:00+00:00",
+        },
+        {"filename": "new.nc", "size": 3, "lastModified": "2022-01-01T00:20:00+00:00"},
+    ]
+    manifest = UploadManifest(
+        {
+            "old.nc": [1, "2022-01-01T00:00:00+00:00"],
+            "changed.nc": [2, "2022-01-01T00:00:00+00:00"],
+            "gone.nc": [4, "2021-12-01T00:00:00+00:00"],
+        }
+    )
+    mocker.patch.object(UploadManifest, "load", return_value=manifest)
+    save_manifest = mocker.patch.object(UploadManifest, "save")
+    mocker.patch.object(mock_processor, "iter_file_list", return_value=iter(listing))
+    mocker.patch.object(mock_processor, "get_file_content", return_value=b"data")
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.manifest_path = "manifest.json"
+
+    report = mock_processor.process("testKey")
+
+    assert sorted(result.filename for result in report.results) == [
+        "changed.nc",
+        "new.nc",
+    ]
+    assert report.skipped == 1
+    md5 = hashlib.md5(b"data").hexdigest()
+    assert manifest.entries == {
+        "old.nc": [1, "2022-01-01T00:00:00+00:00"],
+        "changed.nc": [2, "2022-01-01T00:10:00+00:00", md5],
+        "new.nc": [3, "2022-01-01T00:20:00+00:00", md5],
+    }
+    save_manifest.assert_called_once_with(mock_processor.adls_client, "manifest.json")
+
+
+def test_process_records_in_flight_transfers_when_listing_fails(mock_processor, mocker):
+    manifest = UploadManifest({})
+    retry_queue = RetryQueue()
+    mocker.patch.object(UploadManifest, "load", return_value=manifest)
+    save_manifest = mocker.patch.object(UploadManifest, "save")
+    mocker.patch.object(RetryQueue, "load", return_value=retry_queue)
+    save_retry_queue = mocker.patch.object(RetryQueue, "save")
+    transfers_started = threading.Barrier(3)
+
+    def iter_file_list(api_key, start_after_filename=None, prefetch=False):
+        yield {"filename": "good.nc", "size": 1, "lastModified": "2022-01-01"}
+        yield {"filename": "bad.nc", "size": 1, "lastModified": "2022-01-01"}
+        transfers_started.wait(timeout=5)
+        raise SynopticDataError("Page 2 failed")
+
+    def get_file_content(filename, api_key):
+        transfers_started.wait(timeout=5)
+        if filename == "bad.nc":
+            raise SynopticDataError("Oops")
+        return b"data"
+
+    mocker.patch.object(mock_processor, "iter_file_list", side_effect=iter_file_list)
+    mocker.patch.object(
+        mock_processor, "get_file_content", side_effect=get_file_content
+    )
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.manifest_path = "manifest.json"
+    mock_processor.retry_queue_path = "retry_queue.json"
+    mock_processor.max_workers = 2
+
+    with pytest.raises(SynopticDataError):
+        mock_processor.process("testKey")
+
+    assert list(manifest.entries) == ["good.nc"]
+    assert list(retry_queue.entries) == ["bad.nc"]
+    save_manifest.assert_called_once()
+    save_retry_queue.assert_called_once()
+
+
+def test_process_incremental_lists_after_watermark_and_advances_it(
+    mock_processor, mocker
+):
+    mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.load_watermark",
+        return_value="file0.nc",
+    )
+    mock_save = mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.save_watermark"
+    )
+    mock_list = mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter([{"filename": "file1.nc"}, {"filename": "file2.nc"}]),
+    )
+    mocker.patch.object(mock_processor, "get_file_content", return_value=b"data")
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.incremental = True
+
+    mock_processor.process("testKey")
+
+    mock_list.assert_called_once_with(
+        "testKey", start_after_filename="file0.nc", prefetch=True
+    )
+    mock_save.assert_called_once_with(
+        mock_processor.adls_client, "file2.nc", mock_processor.watermark_path
+    )
+
+
+def test_process_incremental_keeps_manifest_entries_before_watermark(
+    mock_processor, mocker
+):
+    mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.load_watermark",
+        return_value="old.nc",
+    )
+    mocker.patch("GetActualTenMinSynopticData.get_synoptic_data.save_watermark")
+    manifest = UploadManifest({"old.nc": [1, "2022-01-01T00:00:00+00:00", "abc"]})
+    mocker.patch.object(UploadManifest, "load", return_value=manifest)
+    mocker.patch.object(UploadManifest, "save")
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter(
+            [
+                {
+                    "filename": "new.nc",
+                    "size": 3,
+                    "lastModified": "2022-01-01T00:20:00+00:00",
+                }
+            ]
+        ),
+    )
+    mocker.patch.object(mock_processor, "get_file_content", return_value=b"data")
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.manifest_path = "manifest.json"
+    mock_processor.incremental = True
+
+    mock_processor.process("testKey")
+
+    assert manifest.entries == {
+        "old.nc": [1, "2022-01-01T00:00:00+00:00", "abc"],
+        "new.nc": [
+            3,
+            "2022-01-01T00:20:00+00:00",
+            hashlib.md5(b"data").hexdigest(),
+        ],
+    }
+
+
+def test_process_incremental_skips_dead_letters_and_advances_past_them(
+    mock_processor, mocker
+):
+    mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.load_watermark",
+        return_value=None,
+    )
+    mock_save = mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.save_watermark"
+    )
+    queue = RetryQueue(
+        {
+            "file1.nc": {
+                "file": {"filename": "file1.nc"},
+                "attempts": MAX_ATTEMPTS,
+                "error": "Oops",
+                "next_attempt": None,
+            }
+        }
+    )
+    mocker.patch.object(RetryQueue, "load", return_value=queue)
+    mocker.patch.object(RetryQueue, "save")
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter([{"filename": "file1.nc"}, {"filename": "file2.nc"}]),
+    )
+    mocker.patch.object(mock_processor, "get_file_content", return_value=b"data")
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.retry_queue_path = "retry_queue.json"
+    mock_processor.incremental = True
+
+    report = mock_processor.process("testKey")
+
+    assert [result.filename for result in report.results] == ["file2.nc"]
+    assert report.dead_letters == 1
+    assert report.queued == 0
+    mock_save.assert_called_once_with(
+        mock_processor.adls_client, "file2.nc", mock_processor.watermark_path
+    )
+
+
+def test_process_incremental_does_not_advance_watermark_past_failed_file(
+    mock_processor, mocker
+):
+    mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.load_watermark",
+        return_value=None,
+    )
+    mock_save = mocker.patch(
+        "GetActualTenMinSynopticData.get_synoptic_data.save_watermark"
+    )
+    mocker.patch.object(
+        mock_processor,
+        "iter_file_list",
+        return_value=iter([{"filename": "file1.nc"}, {"filename": "file2.nc"}]),
+    )
+
+    def get_file_content(filename, api_key):
+        if filename == "file2.nc":
+            raise SynopticDataError("Oops")
+        return b"data"
+
+    mocker.patch.object(
+        mock_processor, "get_file_content", side_effect=get_file_content
+    )
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+    mock_processor.incremental = True
+    mock_processor.max_workers = 1
+
+    mock_processor.process("testKey")
+
+    mock_save.assert_called_once_with(
+        mock_processor.adls_client, "file1.nc", mock_processor.watermark_path
+    )
+
+
+@pytest.mark.freeze_time("2022-01-01 12:00:00")
+def test_stream_file_to_adls_uploads_downloaded_chunks_with_md5(
+    mock_processor, requests_mock, mocker
+):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations/"
+        "versions/2/files/file.nc/url",
+        status_code=200,
+        json={"temporaryDownloadUrl": "https://download.me"},
+    )
+    requests_mock.get(url="https://download.me", status_code=200, content=b"0123456789")
+    mock_processor.chunk_size = 4
+    uploaded = {}
+
+    def upload_data(data, **kwargs):
+        uploaded["data"] = data.read()
+        uploaded.update(kwargs)
+
+    mock_file_client = mock_processor.adls_client.get_file_client.return_value
+    mock_file_client.upload_data.side_effect = upload_data
+
+    result = mock_processor.stream_file_to_adls("file.nc", "testKey")
+
+    md5 = hashlib.md5(b"0123456789")
+    assert result == StreamedFile(10, md5.hexdigest(), False)
+    assert requests_mock.last_request.stream
+    mock_processor.adls_client.get_file_client.assert_called_once_with(
+        "nc/2022/01/01/12/file.nc"
+    )
+    assert uploaded["data"] == b"0123456789"
+    assert uploaded["length"] == 10
+    assert uploaded["metadata"] == {"md5": md5.hexdigest()}
+    assert uploaded["content_settings"].content_md5 == md5.digest()
+    # Appends of at most chunk_size bytes in total, not the whole file in one request
+    assert uploaded["chunk_size"] * uploaded["max_concurrency"] <= 4
+
+
+def test_stream_file_to_adls_raises_error_on_http_response_error(
+    mock_processor, requests_mock
+):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations/"
+        "versions/2/files/file.nc/url",
+        status_code=200,
+        json={"temporaryDownloadUrl": "https://download.me"},
+    )
+    requests_mock.get(url="https://download.me", status_code=200, content=b"data")
+    mock_processor.adls_client.get_file_client().upload_data.side_effect = (
+        HttpResponseError("Oops")
+    )
+
+    with pytest.raises(SynopticDataError) as excinfo:
+        mock_processor.stream_file_to_adls("file.nc", "testKey")
+
+    assert (
+        str(excinfo.value)
+        == "Unexpected HttpResponseError when attempting to upload file.nc to TestAccount. "
+        "Full error: Oops"
+    )
+
+
+def test_transfer_file_streams_when_streaming(mock_processor, mocker):
+    mocker.patch.object(
+        mock_processor,
+        "stream_file_to_adls",
+        return_value=StreamedFile(42, "md5", False),
+    )
+    mocker.patch.object(mock_processor, "get_file_content")
+    mock_processor.streaming = True
+
+    result = mock_processor.transfer_file("file.nc", "testKey")
+
+    assert result.size == 42
+    mock_processor.stream_file_to_adls.assert_called_once_with(
+        "file.nc", "testKey", None
+    )
+    mock_processor.get_file_content.assert_not_called()
+
+
+def test_transfer_file_skips_upload_of_unchanged_content(mock_processor, mocker):
+    mocker.patch.object(mock_processor, "get_file_content", return_value=b"data")
+    mocker.patch.object(mock_processor, "upload_file_content_to_adls")
+
+    result = mock_processor.transfer_file(
+        "file.nc", "testKey", previous_md5=hashlib.md5(b"data").hexdigest()
+    )
+
+    assert result.unchanged
+    mock_processor.upload_file_content_to_adls.assert_not_called()
+    mock_processor.logger.log.assert_called_with(
+        message="Skipped upload of file.nc, content is unchanged", severity=20
+    )
+
+
+def test_stream_file_to_adls_writes_nothing_for_unchanged_content(
+    mock_processor, requests_mock
+):
+    requests_mock.get(
+        url="https://api.dataplatform.knmi.nl/open-data/v1/datasets/Actuele10mindataKNMIstations/"
+        "versions/2/files/file.nc/url",
+        status_code=200,
+        json={"temporaryDownloadUrl": "https://download.me"},
+    )
+    requests_mock.get(url="https://download.me", status_code=200, content=b"data")
+
+    result = mock_processor.stream_file_to_adls(
+        "file.nc", "testKey", previous_md5=hashlib.md5(b"data").hexdigest()
+    )
+
+    assert result.unchanged
+    assert mock_processor.adls_client.method_calls == []
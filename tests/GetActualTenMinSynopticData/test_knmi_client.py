@@ -0,0 +1,158 @@
+import pytest
+from requests.adapters import HTTPAdapter
+
+from GetActualTenMinSynopticData.errors import SynopticDataDeadlineError
+from GetActualTenMinSynopticData.knmi_client import (
+    KNMIClient,
+    TokenBucket,
+    get_knmi_client,
+    get_retry_after,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def test_get_sends_api_key_only_when_given(requests_mock):
+    requests_mock.get("https://api.example/files", status_code=200)
+    requests_mock.get("https://download.me", status_code=200)
+    client = KNMIClient()
+
+    client.get("https://api.example/files", api_key="testKey")
+    client.get("https://download.me")
+
+    api_request, download_request = requests_mock.request_history
+    assert api_request.headers["Authorization"] == "testKey"
+    assert "Authorization" not in download_request.headers
+    assert download_request.timeout == client.timeout
+
+
+def test_client_retries_retryable_codes_with_pooled_adapter():
+    client = KNMIClient(pool_maxsize=16, max_retries=5)
+
+    adapter = client.session.get_adapter("https://api.dataplatform.knmi.nl")
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_maxsize == 16  # type: ignore
+    assert adapter.max_retries.total == 5
+    assert {429, 500, 503} <= set(adapter.max_retries.status_forcelist)
+    assert adapter.max_retries.respect_retry_after_header
+    assert not adapter.max_retries.raise_on_status
+
+
+def test_get_knmi_client_returns_cached_client_per_options():
+    client = get_knmi_client(pool_maxsize=3)
+
+    assert get_knmi_client(pool_maxsize=3) is client
+    assert get_knmi_client(pool_maxsize=4) is not client
+
+
+def test_token_bucket_allows_burst_then_spreads_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=3, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(5)]
+
+    assert waits == [0.0, 0.0, 0.0, 0.5, 0.5]
+    assert clock.now == 1.0
+    assert bucket.acquired == 5
+    assert bucket.throttled == 2
+    assert bucket.wait_seconds == 1.0
+    assert bucket.remaining == 0
+
+
+def test_token_bucket_raises_instead_of_waiting_past_deadline():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.5, capacity=1, clock=clock, sleep=clock.sleep)
+    bucket.acquire(deadline=1.0)
+
+    with pytest.raises(SynopticDataDeadlineError):
+        bucket.acquire(deadline=1.0)
+
+    assert clock.now == 0.0
+    assert bucket.deadline_exceeded == 1
+    # No token was taken, so a request with a later deadline waits as long as before
+    assert bucket.acquire(deadline=2.0) == 2.0
+
+
+def test_token_bucket_remaining_is_zero_while_tokens_are_reserved():
+    clock = FakeClock()
+    # Waiting callers that have not woken up yet hold reserved tokens
+    bucket = TokenBucket(rate=1.0, capacity=1, clock=clock, sleep=lambda seconds: None)
+
+    for _ in range(4):
+        bucket.acquire()
+
+    assert bucket.remaining == 0
+    assert "remaining=0" in bucket.summary()
+
+
+def test_token_bucket_pause_delays_all_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=clock, sleep=clock.sleep)
+
+    bucket.pause(10.0)
+
+    assert bucket.remaining == 0
+    assert bucket.acquire() == 11.0
+    assert bucket.pauses == 1
+
+
+@pytest.mark.parametrize(
+    "headers,result",
+    [
+        ({"Retry-After": "12"}, 12.0),
+        ({"Retry-After": "-1"}, 0.0),
+        ({"Retry-After": "Thu, 01 Jan 1970 00:00:00 GMT"}, 0.0),
+        ({"Retry-After": "soon"}, 30.0),
+        ({}, 30.0),
+    ],
+)
+def test_get_retry_after(mocker, headers, result):
+    response = mocker.MagicMock(headers=headers)
+
+    assert get_retry_after(response) == result
+
+
+def test_rate_limited_get_pauses_on_429_and_retries(requests_mock, mocker):
+    requests_mock.get(
+        "https://api.example/files",
+        response_list=[
+            {"status_code": 429, "headers": {"Retry-After": "5"}},
+            {"status_code": 200},
+        ],
+    )
+    requests_mock.get("https://download.me", status_code=200)
+    client = KNMIClient(rate_limit=1.0)
+    acquire = mocker.patch.object(client.rate_limiter, "acquire")
+    pause = mocker.patch.object(client.rate_limiter, "pause")
+
+    response = client.get("https://api.example/files", api_key="testKey")
+    client.get("https://download.me")
+
+    assert response.status_code == 200
+    assert acquire.call_count == 2
+    pause.assert_called_once_with(5.0)
+    adapter = client.session.get_adapter("https://api.example")
+    assert isinstance(adapter, HTTPAdapter)
+    assert 429 not in adapter.max_retries.status_forcelist
+
+
+def test_rate_limited_get_returns_429_when_retries_run_out(requests_mock, mocker):
+    requests_mock.get("https://api.example/files", status_code=429)
+    client = KNMIClient(rate_limit=1.0, max_retries=2)
+    mocker.patch.object(client.rate_limiter, "acquire")
+    pause = mocker.patch.object(client.rate_limiter, "pause")
+
+    response = client.get("https://api.example/files", api_key="testKey")
+
+    assert response.status_code == 429
+    assert requests_mock.call_count == 3
+    assert pause.call_count == 2
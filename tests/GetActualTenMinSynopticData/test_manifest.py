@@ -0,0 +1,152 @@
+from datetime import (
+    datetime,
+    timedelta,
+)
+
+import pytest
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceNotFoundError,
+)
+
+from GetActualTenMinSynopticData.errors import SynopticDataError
+from GetActualTenMinSynopticData.manifest import (
+    MAX_ATTEMPTS,
+    RetryQueue,
+    UploadManifest,
+    advance_watermark,
+    load_watermark,
+)
+
+
+def test_load_returns_empty_manifest_when_missing(mocker):
+    adls_client = mocker.MagicMock()
+    adls_client.get_file_client().download_file.side_effect = ResourceNotFoundError(
+        "Gone"
+    )
+
+    manifest = UploadManifest.load(adls_client, "manifest.json")
+
+    assert manifest.entries == {}
+    assert not manifest.changed
+
+
+def test_load_raises_synoptic_data_error_on_http_response_error(mocker):
+    adls_client = mocker.MagicMock()
+    adls_client.account_name = "TestAccount"
+    adls_client.get_file_client().download_file.side_effect = HttpResponseError("Oops")
+
+    with pytest.raises(SynopticDataError) as excinfo:
+        UploadManifest.load(adls_client, "manifest.json")
+
+    assert (
+        str(excinfo.value)
+        == "Unexpected HttpResponseError when attempting to read manifest "
+        "manifest.json from TestAccount. Full error: Oops"
+    )
+
+
+def test_save_and_load_round_trip_compact_json(mocker):
+    adls_client = mocker.MagicMock()
+    manifest = UploadManifest()
+    manifest.record({"filename": "file.nc", "size": 10, "lastModified": "2022"}, "abc")
+
+    manifest.save(adls_client, "manifest.json")
+
+    adls_client.get_file_client.assert_called_with("manifest.json")
+    data = adls_client.get_file_client().upload_data.call_args.kwargs["data"]
+    assert data == '{"file.nc":[10,"2022","abc"]}'
+    assert not manifest.changed
+
+    adls_client.get_file_client().download_file().readall.return_value = data.encode()
+    loaded = UploadManifest.load(adls_client, "manifest.json")
+    assert loaded.is_uploaded(
+        {"filename": "file.nc", "size": 10, "lastModified": "2022"}
+    )
+    assert not loaded.is_uploaded(
+        {"filename": "file.nc", "size": 11, "lastModified": "2022"}
+    )
+
+
+def test_prune_drops_files_no_longer_listed():
+    manifest = UploadManifest({"a.nc": [1, "x"], "b.nc": [2, "y"]})
+
+    assert manifest.prune({"a.nc"}) == 1
+    assert manifest.entries == {"a.nc": [1, "x"]}
+    assert manifest.changed
+
+
+def test_load_watermark_returns_none_when_missing(mocker):
+    adls_client = mocker.MagicMock()
+    adls_client.get_file_client().download_file.side_effect = ResourceNotFoundError(
+        "Gone"
+    )
+
+    assert load_watermark(adls_client) is None
+
+
+@pytest.mark.parametrize(
+    "watermark,processed,result",
+    [
+        (None, {"a", "b", "c"}, "c"),
+        ("0", {"a", "c"}, "a"),
+        ("0", {"b", "c"}, "0"),
+        (None, set(), None),
+    ],
+)
+def test_advance_watermark_stops_at_first_unprocessed_file(
+    watermark, processed, result
+):
+    assert advance_watermark(watermark, ["a", "b", "c"], processed) == result
+
+
+def test_retry_queue_backs_off_exponentially_and_gives_up():
+    now = datetime(2022, 1, 1)
+    queue = RetryQueue()
+
+    assert queue.record_failure({"filename": "file.nc"}, "Oops", now)
+    assert queue.is_waiting("file.nc", now + timedelta(minutes=9))
+    assert queue.due(now + timedelta(minutes=10)) == [{"filename": "file.nc"}]
+
+    queue.record_failure({"filename": "file.nc"}, "Oops again", now)
+    assert queue.entries["file.nc"]["attempts"] == 2
+    assert queue.entries["file.nc"]["error"] == "Oops again"
+    assert queue.due(now + timedelta(minutes=19)) == []
+    assert queue.due(now + timedelta(minutes=20)) == [{"filename": "file.nc"}]
+
+    for _ in range(MAX_ATTEMPTS - 3):
+        assert queue.record_failure({"filename": "file.nc"}, "Oops", now)
+    assert (
+        queue.entries["file.nc"]["next_attempt"]
+        == (now + timedelta(hours=24)).isoformat()
+    )
+    assert not queue.record_failure({"filename": "file.nc"}, "Oops", now)
+    assert queue.entries["file.nc"]["next_attempt"] is None
+    assert queue.dead_letters == ["file.nc"]
+    assert queue.is_waiting("file.nc", now + timedelta(days=365))
+    assert queue.due(now + timedelta(days=365)) == []
+
+
+def test_retry_queue_prune_drops_only_unlisted_dead_letters():
+    queue = RetryQueue(
+        {
+            "dead.nc": {"next_attempt": None},
+            "listed.nc": {"next_attempt": None},
+            "waiting.nc": {"next_attempt": "2022-01-01T00:00:00"},
+        }
+    )
+
+    queue.prune({"listed.nc"})
+
+    assert sorted(queue.entries) == ["listed.nc", "waiting.nc"]
+    assert queue.changed
+
+
+def test_retry_queue_remove_marks_changed_only_for_queued_files():
+    queue = RetryQueue({"file.nc": {"attempts": 1}})
+
+    queue.remove("other.nc")
+    assert not queue.changed
+    queue.remove("file.nc")
+    assert queue.changed
+    assert queue.entries == {}
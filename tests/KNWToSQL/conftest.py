@@ -1,7 +1,14 @@
+from datetime import (
+    datetime,
+    timedelta,
+)
+from functools import partial
+from io import BytesIO
 from os import path
 
 import pytest
 
+from KNWToSQL.backfill import create_url_session
 from KNWToSQL.knw_to_sql import Processor
 
 
@@ -18,12 +25,31 @@ def mock_processor(mocker):
     )
 
 
+# Session on a SQLite database with knw_data, picklable for worker processes
+create_sqlite_session = partial(create_url_session, create_tables=True)
+
+
+@pytest.fixture
+def sqlite_session_factory():
+    """Return a factory for sessions on separate in-memory SQLite databases with knw_data"""
+    sessions = []
+
+    def factory():
+        session = create_sqlite_session("sqlite://")
+        sessions.append(session)
+        return session
+
+    yield factory
+    for session in sessions:
+        session.close()
+
+
 @pytest.fixture
 def mock_input_stream(mocker):
     mock = mocker.MagicMock()
     mock.name = "knw.csv"
     with open(get_file(filepath="files/mockknwfile.csv"), "rb") as fdata:
-        mock.read.return_value = fdata.read()
+        mock.read.side_effect = BytesIO(fdata.read()).read
     return mock
 
 
@@ -32,10 +58,46 @@ def mock_empty_input_stream(mocker):
     mock = mocker.MagicMock()
     mock.name = "knw.csv"
     with open(get_file(filepath="files/emptymockknwfile.csv"), "rb") as fdata:
-        mock.read.return_value = fdata.read()
+        mock.read.side_effect = BytesIO(fdata.read()).read
     return mock
 
 
+class SyntheticKNWStream:
+    """
+    Binary stream producing a KNW file with the real header and row_count generated rows on
+    demand, so arbitrarily large files can be read without ever being held in memory.
+    """
+
+    name = "synthetic_knw.csv"
+
+    def __init__(self, row_count: int):
+        with open(get_file(filepath="files/mockknwfile.csv"), "rb") as fdata:
+            lines = fdata.read().splitlines(keepends=True)
+        self._buffer = b"".join(lines[:9])
+        self._values = lines[9].split(b"\t", 1)[1]
+        self._row_count = row_count
+        self._next_row = 0
+        self.size = len(self._buffer) + row_count * (17 + len(self._values))
+
+    def _row(self, index: int) -> bytes:
+        days, hours = divmod(index, 24)
+        dtg = datetime(1979, 1, 1) + timedelta(days=days, hours=hours)
+        return dtg.strftime("%Y-%m-%d %H:%M").encode() + b"\t" + self._values
+
+    def read(self, size: int = -1) -> bytes:
+        rows = [self._buffer]
+        buffered = len(self._buffer)
+        while (size < 0 or buffered < size) and self._next_row < self._row_count:
+            rows.append(self._row(self._next_row))
+            buffered += len(rows[-1])
+            self._next_row += 1
+        self._buffer = b"".join(rows)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
 @pytest.fixture
 def mock_row():
     return {
@@ -0,0 +1,200 @@
+import json
+from functools import partial
+
+import pytest
+
+from KNWToSQL.backfill import (
+    BackfillReport,
+    FileResult,
+    MappedFile,
+    backfill,
+    find_files,
+    main,
+)
+from KNWToSQL.errors import KNWError
+from KNWToSQL.models import (
+    KNWData,
+    LoadStrategy,
+)
+from tests.KNWToSQL.conftest import (
+    create_sqlite_session,
+    get_file,
+)
+
+
+@pytest.fixture
+def knw_dir(tmp_path):
+    """Directory with two KNW files covering different years and one unrelated file"""
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        data = fdata.read()
+    (tmp_path / "knw_1979.csv").write_bytes(data)
+    (tmp_path / "knw_1980.csv").write_bytes(data.replace(b"\n1979-", b"\n1980-"))
+    (tmp_path / "notes.txt").write_text("not a KNW file")
+    return tmp_path
+
+
+def test_find_files_expands_directories_and_globs(knw_dir):
+    assert find_files([str(knw_dir)]) == [
+        str(knw_dir / "knw_1979.csv"),
+        str(knw_dir / "knw_1980.csv"),
+    ]
+    assert find_files([str(knw_dir / "*1980*"), str(knw_dir / "*.csv")]) == [
+        str(knw_dir / "knw_1979.csv"),
+        str(knw_dir / "knw_1980.csv"),
+    ]
+
+
+def test_mapped_file_reads_file_in_chunks(knw_dir):
+    with MappedFile(str(knw_dir / "notes.txt")) as file:
+        assert file.name == str(knw_dir / "notes.txt")
+        assert file.read(4) == b"not "
+        assert file.read() == b"a KNW file"
+        assert file.read(4) == b""
+
+
+def test_mapped_file_raises_error_for_empty_file(tmp_path):
+    (tmp_path / "empty.csv").write_bytes(b"")
+
+    with pytest.raises(KNWError) as excinfo:
+        MappedFile(str(tmp_path / "empty.csv"))
+
+    assert (
+        str(excinfo.value)
+        == f"Could not memory map empty file: {tmp_path / 'empty.csv'}"
+    )
+
+
+def test_backfill_loads_files_and_skips_them_on_next_run(knw_dir, tmp_path):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    session = create_sqlite_session(url)
+    manifest_path = str(tmp_path / "manifest.json")
+    paths = find_files([str(knw_dir)])
+
+    report = backfill(
+        paths, partial(create_sqlite_session, url), manifest_path, workers=2
+    )
+
+    assert report.succeeded
+    assert report.row_count == 188
+    assert report.skipped == []
+    assert session.query(KNWData).count() == 188
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == paths
+    assert manifest[paths[0]]["rows"] == 94
+
+    report = backfill(
+        paths, partial(create_sqlite_session, url), manifest_path, workers=2
+    )
+
+    assert report.results == []
+    assert report.skipped == paths
+
+
+def test_backfill_reloads_changed_files_and_reports_failures(knw_dir, tmp_path):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    create_sqlite_session(url)
+    manifest_path = str(tmp_path / "manifest.json")
+    paths = find_files([str(knw_dir)])
+    backfill(paths, partial(create_sqlite_session, url), manifest_path, workers=1)
+    (knw_dir / "knw_1980.csv").write_bytes(b"")
+
+    report = backfill(
+        paths,
+        partial(create_sqlite_session, url),
+        manifest_path,
+        workers=1,
+        load_strategy=LoadStrategy.UPSERT,
+    )
+
+    assert not report.succeeded
+    assert report.skipped == [paths[0]]
+    assert report.results[0].error == f"Could not memory map empty file: {paths[1]}"
+    with open(manifest_path) as f:
+        assert json.load(f)[paths[1]]["error"] == report.results[0].error
+
+
+def test_backfill_records_missing_file_as_failure(knw_dir, tmp_path):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    create_sqlite_session(url)
+    manifest_path = str(tmp_path / "manifest.json")
+    paths = find_files([str(knw_dir)])
+    missing = str(knw_dir / "missing.csv")
+
+    report = backfill(
+        [*paths, missing], partial(create_sqlite_session, url), manifest_path, workers=2
+    )
+
+    assert not report.succeeded
+    assert [result.error is None for result in report.results] == [True, True, False]
+    assert "No such file or directory" in str(report.results[2].error)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    assert "No such file or directory" in manifest[missing]["error"]
+    assert all(manifest[path]["rows"] == 94 for path in paths)
+
+
+def test_backfill_records_truncated_file_as_failure(knw_dir, tmp_path):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    create_sqlite_session(url)
+    data = (knw_dir / "knw_1980.csv").read_bytes()
+    # Cut the last row off halfway through its values
+    (knw_dir / "knw_1980.csv").write_bytes(
+        data.rstrip()[: data.rstrip().rfind(b"\t") - 40]
+    )
+    paths = find_files([str(knw_dir)])
+
+    report = backfill(
+        paths,
+        partial(create_sqlite_session, url),
+        str(tmp_path / "manifest.json"),
+        workers=2,
+    )
+
+    assert [result.error is None for result in report.results] == [True, False]
+    assert str(report.results[1].error).startswith("Could not parse KNW row 1980-")
+
+
+def test_backfill_report_summary():
+    report = BackfillReport(
+        results=[
+            FileResult("/a.csv", 2_000_000, 1.0, 100, 1.0),
+            FileResult("/b.csv", 1_000_000, 1.0, 0, 1.0, "oops"),
+        ],
+        skipped=["/c.csv"],
+        seconds=2.0,
+    )
+
+    assert report.summary() == (
+        "Loaded 100 rows from 1 files (2.0 MB) in 2.00s: 50 rows/s, 1.00 MB/s. "
+        "Skipped 1 already loaded files\n/b.csv failed: oops"
+    )
+
+
+def test_main_loads_files_from_url_and_exits_with_error_on_failure(
+    knw_dir, tmp_path, capsys
+):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    session = create_sqlite_session(url)
+    argv = [
+        str(knw_dir),
+        "--url",
+        url,
+        "--manifest",
+        str(tmp_path / "manifest.json"),
+        "--workers",
+        "1",
+        "--load-strategy",
+        "upsert",
+    ]
+
+    main(argv)
+
+    assert session.query(KNWData).count() == 188
+    assert capsys.readouterr().out.startswith("Loaded 188 rows from 2 files")
+
+    (knw_dir / "knw_1981.csv").write_text("garbage")
+    with pytest.raises(SystemExit) as excinfo:
+        main(argv)
+
+    assert excinfo.value.code == 1
@@ -0,0 +1,104 @@
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+
+from KNWToSQL.errors import KNWError
+from KNWToSQL.models import (
+    KNW_COLUMNS,
+    ParserType,
+)
+from tests.KNWToSQL.conftest import get_file
+
+np = pytest.importorskip("numpy")
+
+from KNWToSQL.columnar import (  # noqa: E402
+    columns_to_entries,
+    parse_lines,
+)
+
+
+def test_parse_lines_returns_typed_column_arrays():
+    lines = [
+        "2022-01-01 13:00\t" + "\t".join(str(i + 0.5) for i in range(40)) + "\n",
+        "\n",
+        "2022-01-01 14:00\t" + "\t".join(str(i + 1.5) for i in range(40)) + "\n",
+    ]
+
+    result = parse_lines(lines)
+
+    assert list(result) == KNW_COLUMNS
+    assert result["dtg"].dtype == np.dtype("datetime64[m]")
+    assert result["dtg"].tolist() == [
+        datetime(2022, 1, 1, 13),
+        datetime(2022, 1, 1, 14),
+    ]
+    assert result["f010"].dtype == np.float64
+    assert result["f010"].tolist() == [0.5, 1.5]
+    assert result["p200"].tolist() == [39.5, 40.5]
+
+
+def test_parse_lines_raises_knw_error_on_malformed_line():
+    with pytest.raises(KNWError) as excinfo:
+        parse_lines(["2022-01-01 13:00\tnot_a_number\n"])
+
+    assert "Could not parse KNW lines into columns" in str(excinfo.value)
+
+
+def test_parse_lines_raises_knw_error_on_truncated_line():
+    with pytest.raises(KNWError) as excinfo:
+        parse_lines(["2022-01-01 13:00\t1.0\t2.0\n"])
+
+    assert "Could not parse KNW lines into columns" in str(excinfo.value)
+
+
+def test_columns_to_entries_returns_python_values(mock_row, mock_processor):
+    line = "\t".join(mock_row[column.upper()] for column in KNW_COLUMNS) + "\n"
+
+    result = list(columns_to_entries(parse_lines([line])))
+
+    assert result == [mock_processor.parse_row(mock_row)]
+    assert type(result[0][0]) is datetime
+    assert type(result[0][1]) is float
+
+
+@pytest.mark.parametrize("batch_size", [1, 10, 10_000])
+def test_numpy_parser_produces_bit_identical_entries_to_csv_parser(
+    mock_processor, mock_input_stream, batch_size
+):
+    mock_processor.batch_size = batch_size
+    csv_entries = list(mock_processor.iter_entries(mock_input_stream))
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        mock_input_stream.read.side_effect = BytesIO(fdata.read()).read
+    mock_processor.parser = ParserType.NUMPY
+
+    numpy_entries = list(mock_processor.iter_entries(mock_input_stream))
+
+    assert len(numpy_entries) == 94
+    assert [value.hex() for entry in numpy_entries for value in entry[1:]] == [
+        value.hex() for entry in csv_entries for value in entry[1:]
+    ]
+    assert [entry[0] for entry in numpy_entries] == [entry[0] for entry in csv_entries]
+
+
+def test_iter_file_columns_raises_error_if_no_fieldnames(
+    mock_processor, mock_empty_input_stream
+):
+    with pytest.raises(KNWError) as excinfo:
+        list(mock_processor.iter_file_columns(mock_empty_input_stream))
+
+    assert str(excinfo.value) == "Could not get fieldnames for file: knw.csv"
+
+
+def test_iter_file_columns_drops_lines_at_or_before_after(
+    mock_processor, mock_input_stream
+):
+    result = list(
+        mock_processor.iter_file_columns(mock_input_stream, after="1979-01-04 20:00")
+    )
+
+    assert len(result) == 1
+    assert result[0]["dtg"].tolist() == [
+        datetime(1979, 1, 4, 21),
+        datetime(1979, 1, 4, 22),
+    ]
@@ -1,16 +1,52 @@
+import logging
+import tracemalloc
 from datetime import datetime
+from functools import partial
+from io import BytesIO
+from typing import (
+    List,
+    Tuple,
+)
 
 import pytest
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
 from KNWToSQL.errors import KNWError
+from KNWToSQL.knw_to_sql import (
+    KNW_COLUMNS,
+    Processor,
+    ParallelIngestReport,
+    RangeResult,
+    batched,
+    deduplicate_entries,
+    find_body_start,
+    iter_lines,
+    process_file,
+    process_parallel,
+    read_ranges,
+)
+from KNWToSQL.models import (
+    KNWCheckpoint,
+    KNWData,
+    LoadStrategy,
+    OnConflict,
+    ParserType,
+)
+from loganalytics.logger import ConsoleLogger
+from storage.postgres import CopyStream
+from tests.KNWToSQL.conftest import (
+    SyntheticKNWStream,
+    create_sqlite_session,
+    get_file,
+)
 
 
 def test_process_raises_error_and_calls_rollback_on_sqlalchemy_error(
     mock_row, mock_processor, mock_input_stream, mocker
 ):
     mocker.patch(
-        "KNWToSQL.knw_to_sql.Processor.read_file_into_dicts",
+        "KNWToSQL.knw_to_sql.Processor.iter_file_rows",
         return_value=[mock_row, mock_row],
     )
     mock_processor.sql_session.commit.side_effect = SQLAlchemyError("oops")
@@ -29,7 +65,7 @@ def test_process_adds_rows_to_sql_session_and_commits(
     mock_processor, mock_row, mock_input_stream, mocker
 ):
     mocker.patch(
-        "KNWToSQL.knw_to_sql.Processor.read_file_into_dicts",
+        "KNWToSQL.knw_to_sql.Processor.iter_file_rows",
         return_value=[mock_row, mock_row],
     )
 
@@ -66,3 +102,498 @@ def test_read_files_into_dicts_returns_list_of_dicts(mock_processor, mock_input_
     assert result[0]["T010"] == "270.16"
     assert result[0]["Q010"] == "0.002261"
     assert result[0]["P010"] == "100552.5"
+
+
+def test_parse_row_returns_typed_values_in_column_order(mock_row):
+    result = Processor.parse_row(mock_row)
+
+    assert len(result) == len(KNW_COLUMNS) == 41
+    assert result[0] == datetime(2022, 1, 1, 13)
+    assert result[1:6] == (1.2, 2.2, 3.2, 4.2, 3.2)
+
+
+def test_parse_row_raises_knw_error_on_missing_or_invalid_field(mock_row):
+    with pytest.raises(KNWError) as excinfo:
+        Processor.parse_row({**mock_row, "P010": None})  # type: ignore
+
+    assert str(excinfo.value).startswith("Could not parse KNW row 2022-01-01 13:00: ")
+
+    with pytest.raises(KNWError):
+        Processor.parse_row({**mock_row, "T010": "warm"})
+
+
+def test_process_copies_rows_and_commits_for_copy_strategy(
+    mock_processor, mock_row, mock_input_stream, mocker
+):
+    mocker.patch(
+        "KNWToSQL.knw_to_sql.Processor.iter_file_rows",
+        return_value=[mock_row, mock_row],
+    )
+    copied: List[Tuple] = []
+
+    def copy_rows(session, table, columns, rows):
+        copied.extend(rows)
+        return len(copied)
+
+    mock_copy_rows = mocker.patch(
+        "KNWToSQL.knw_to_sql.copy_rows", side_effect=copy_rows
+    )
+    mock_processor.load_strategy = LoadStrategy.COPY
+
+    mock_processor.process(mock_input_stream)
+
+    assert mock_copy_rows.call_args[1]["table"] == "knw_data"
+    assert mock_copy_rows.call_args[1]["columns"] == KNW_COLUMNS
+    assert copied == [Processor.parse_row(mock_row)] * 2
+    mock_processor.sql_session.add.assert_not_called()
+    mock_processor.sql_session.commit.assert_called_once()
+    mock_processor.logger.log.assert_called_with(
+        message="Copied 2 rows into knw_data", severity=20
+    )
+
+
+def test_copy_and_orm_strategies_produce_identical_table_contents(
+    mock_input_stream, sqlite_session_factory, mocker
+):
+    def copy_into_sqlite(session, table, columns, rows):
+        # Stand-in for Postgres: parse the COPY text stream back the way COPY FROM STDIN would
+        lines = CopyStream(rows).read().splitlines()
+        for line in lines:
+            values = line.split("\t")
+            session.execute(
+                KNWData.__table__.insert(),
+                {
+                    "dtg": datetime.fromisoformat(values[0]),
+                    **{c: float(v) for c, v in zip(columns[1:], values[1:])},
+                },
+            )
+        return len(lines)
+
+    mocker.patch("KNWToSQL.knw_to_sql.copy_rows", side_effect=copy_into_sqlite)
+    orm_session, copy_session = sqlite_session_factory(), sqlite_session_factory()
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        file_content = fdata.read()
+
+    mock_input_stream.read.side_effect = BytesIO(file_content).read
+    Processor(mocker.MagicMock(), orm_session, LoadStrategy.ORM).process(
+        mock_input_stream
+    )
+    mock_input_stream.read.side_effect = BytesIO(file_content).read
+    Processor(mocker.MagicMock(), copy_session, LoadStrategy.COPY).process(
+        mock_input_stream
+    )
+
+    query = select(KNWData.__table__).order_by(KNWData.dtg)
+    orm_rows = orm_session.execute(query).fetchall()
+    copy_rows = copy_session.execute(query).fetchall()
+    assert len(orm_rows) == 94
+    assert orm_rows == copy_rows
+
+
+def test_iter_file_rows_yields_rows_lazily(mock_processor, mock_input_stream):
+    mock_processor.chunk_size = 256
+    rows = mock_processor.iter_file_rows(mock_input_stream)
+
+    first = next(rows)
+
+    assert first["DTG"] == "1979-01-01 01:00"
+    assert first["P200"] == "98158.5"
+    assert mock_input_stream.read.call_count < 10
+    assert len(list(rows)) == 93
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_iter_lines_handles_lines_and_characters_split_across_chunks(chunk_size):
+    data = "één\ttwee\r\ndrie\nvier".encode()
+
+    result = list(iter_lines(BytesIO(data), chunk_size))
+
+    assert "".join(result) == "één\ttwee\r\ndrie\nvier"
+    assert [line.rstrip("\r\n") for line in result if line.strip()] == [
+        "één\ttwee",
+        "drie",
+        "vier",
+    ]
+
+
+def test_batched_yields_fixed_size_batches():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
+
+
+def test_process_flushes_orm_entries_per_batch(
+    mock_processor, mock_row, mock_input_stream, mocker
+):
+    mocker.patch(
+        "KNWToSQL.knw_to_sql.Processor.iter_file_rows",
+        return_value=iter([mock_row] * 5),
+    )
+    mock_processor.batch_size = 2
+
+    mock_processor.process(mock_input_stream)
+
+    assert mock_processor.sql_session.add.call_count == 5
+    assert mock_processor.sql_session.flush.call_count == 3
+    mock_processor.sql_session.commit.assert_called_once()
+
+
+def test_iter_file_rows_peak_memory_does_not_grow_with_file_size(mock_processor):
+    stream = SyntheticKNWStream(row_count=20_000)
+
+    tracemalloc.start()
+    try:
+        row_count = 0
+        for row in mock_processor.iter_file_rows(stream):
+            row_count += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert row_count == 20_000
+    assert row["DTG"] == "1981-04-13 07:00"
+    assert stream.size > 5_000_000
+    # A few read chunks and a handful of rows, independent of the ~6MB file size
+    assert peak < 1_000_000
+
+
+@pytest.mark.parametrize(
+    "keep_last,result",
+    [
+        (True, [(1, "b"), (2, "a"), (3, "a")]),
+        (False, [(1, "a"), (2, "a"), (3, "a")]),
+    ],
+)
+def test_deduplicate_entries_keeps_first_or_last_occurrence(keep_last, result):
+    entries: List[Tuple] = [(1, "a"), (2, "a"), (1, "b"), (3, "a")]
+
+    assert deduplicate_entries(entries, keep_last=keep_last) == result
+
+
+def test_upsert_strategy_makes_reprocessing_a_file_a_no_op(
+    mock_input_stream, sqlite_session_factory, mocker
+):
+    session = sqlite_session_factory()
+    logger = mocker.MagicMock()
+    proc = Processor(logger, session, LoadStrategy.UPSERT, batch_size=10)
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        file_content = fdata.read()
+
+    for _ in range(2):
+        mock_input_stream.read.side_effect = BytesIO(file_content).read
+        proc.process(mock_input_stream)
+
+    assert session.query(KNWData).count() == 94
+    logger.log.assert_called_with(
+        message="Upserted 94 rows into knw_data with ON CONFLICT DO NOTHING, "
+        "dropped 0 duplicate rows",
+        severity=20,
+    )
+
+
+@pytest.mark.parametrize(
+    "on_conflict,expected_f010",
+    [(OnConflict.UPDATE, [3.0, 4.0]), (OnConflict.NOTHING, [1.0, 4.0])],
+)
+def test_upsert_strategy_resolves_conflicts_and_in_file_duplicates(
+    mock_processor, mock_row, sqlite_session_factory, mocker, on_conflict, expected_f010
+):
+    session = sqlite_session_factory()
+    stored = Processor.parse_row({**mock_row, "F010": "1.0"})
+    session.add(KNWData(**dict(zip(KNW_COLUMNS, stored))))
+    session.commit()
+    rows = [
+        {**mock_row, "F010": "2.0"},
+        {**mock_row, "DTG": "2022-01-01 14:00", "F010": "4.0"},
+        {**mock_row, "F010": "3.0"},
+    ]
+    mocker.patch("KNWToSQL.knw_to_sql.Processor.iter_file_rows", return_value=rows)
+    mock_processor.sql_session = session
+    mock_processor.load_strategy = LoadStrategy.UPSERT
+    mock_processor.on_conflict = on_conflict
+
+    mock_processor.process(mocker.MagicMock())
+
+    result = session.query(KNWData.f010).order_by(KNWData.dtg).all()
+    assert [f010 for f010, in result] == expected_f010
+    assert mock_processor.logger.log.call_args[1]["message"].endswith(
+        "dropped 1 duplicate rows"
+    )
+
+
+def test_process_commits_in_chunks_and_stores_checkpoint(
+    mock_input_stream, sqlite_session_factory, mocker
+):
+    session = sqlite_session_factory()
+    commit_spy = mocker.spy(session, "commit")
+    proc = Processor(mocker.MagicMock(), session, commit_every=40)
+
+    proc.process(mock_input_stream)
+
+    assert commit_spy.call_count == 3
+    assert session.query(KNWData).count() == 94
+    checkpoint = session.get(KNWCheckpoint, "knw.csv")
+    assert checkpoint.row_count == 94
+    assert checkpoint.last_dtg == datetime(1979, 1, 4, 22)
+
+
+def test_process_resumes_after_last_committed_chunk(
+    mock_input_stream, sqlite_session_factory, mocker
+):
+    session = sqlite_session_factory()
+    logger = mocker.MagicMock()
+    proc = Processor(logger, session, commit_every=40)
+    add_entries = proc.add_entries
+    chunk_starts = []
+
+    def fail_on_second_chunk(entries):
+        chunk_starts.append(entries[0][0])
+        if len(chunk_starts) == 2:
+            raise SQLAlchemyError("connection lost")
+        return add_entries(entries)
+
+    mocker.patch.object(proc, "add_entries", side_effect=fail_on_second_chunk)
+
+    with pytest.raises(SQLAlchemyError):
+        proc.process(mock_input_stream)
+
+    assert session.query(KNWData).count() == 40
+    assert session.get(KNWCheckpoint, "knw.csv").last_dtg == datetime(1979, 1, 2, 16)
+
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        mock_input_stream.read.side_effect = BytesIO(fdata.read()).read
+    result = proc.process(mock_input_stream)
+
+    assert result == 54
+    assert chunk_starts == [
+        datetime(1979, 1, 1, 1),
+        datetime(1979, 1, 2, 17),
+        datetime(1979, 1, 2, 17),
+        datetime(1979, 1, 4, 9),
+    ]
+    assert session.query(KNWData).count() == 94
+    assert session.get(KNWCheckpoint, "knw.csv").row_count == 94
+    logger.log.assert_any_call(
+        message="Resuming knw.csv after 1979-01-02 16:00:00, 40 rows already loaded",
+        severity=20,
+    )
+
+
+def test_process_raises_error_when_committing_a_nameless_file_in_chunks(
+    mock_input_stream, sqlite_session_factory, mocker
+):
+    mock_input_stream.name = None
+    proc = Processor(mocker.MagicMock(), sqlite_session_factory(), commit_every=40)
+
+    with pytest.raises(KNWError) as excinfo:
+        proc.process(mock_input_stream)
+
+    assert str(excinfo.value) == (
+        "Checkpoints are keyed by file name, cannot commit a nameless file"
+    )
+
+
+def test_iter_entries_skips_rows_at_or_before_after_without_parsing_them(
+    mock_processor, mock_input_stream, mocker
+):
+    parse_spy = mocker.spy(Processor, "parse_row")
+
+    result = list(
+        mock_processor.iter_entries(mock_input_stream, after=datetime(1979, 1, 4, 20))
+    )
+
+    assert [entry[0] for entry in result] == [
+        datetime(1979, 1, 4, 21),
+        datetime(1979, 1, 4, 22),
+    ]
+    assert parse_spy.call_count == 2
+
+
+@pytest.mark.parametrize("commit_every", [None, 10])
+def test_incremental_process_only_parses_rows_after_latest_dtg(
+    mock_input_stream, sqlite_session_factory, mocker, mock_row, commit_every
+):
+    session = sqlite_session_factory()
+    stored = Processor.parse_row({**mock_row, "DTG": "1979-01-04 19:00"})
+    session.add(KNWData(**dict(zip(KNW_COLUMNS, stored))))
+    session.commit()
+    parse_spy = mocker.spy(Processor, "parse_row")
+    logger = mocker.MagicMock()
+    proc = Processor(logger, session, commit_every=commit_every, incremental=True)
+
+    proc.process(mock_input_stream)
+
+    assert parse_spy.call_count == 3
+    assert session.query(KNWData).count() == 4
+    logger.log.assert_any_call(
+        message="Skipping rows at or before watermark 1979-01-04 19:00:00",
+        severity=20,
+    )
+
+
+def test_get_watermark_returns_none_for_empty_table(sqlite_session_factory, mocker):
+    proc = Processor(mocker.MagicMock(), sqlite_session_factory(), incremental=True)
+
+    assert proc.get_watermark() is None
+
+
+def test_find_body_start_returns_offset_of_first_data_line():
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        data = fdata.read()
+
+    result = find_body_start(data)
+
+    assert data[result:].startswith(b"1979-01-01 01:00\t")
+
+
+def test_find_body_start_raises_error_on_incomplete_header():
+    with pytest.raises(KNWError) as excinfo:
+        find_body_start(b"#kdc:filename=x\n")
+
+    assert str(excinfo.value) == "Could not find the end of the KNW file header"
+
+
+@pytest.mark.parametrize("range_bytes", [1, 5, 8, 20, 1000])
+def test_read_ranges_returns_contiguous_line_aligned_ranges(range_bytes):
+    data = b"".join(b"line %d\n" % i for i in range(10)) + b"last"
+
+    result = list(read_ranges(BytesIO(data), range_bytes))
+
+    assert result[0][0] == 0
+    for (start, chunk), (next_start, _) in zip(result, result[1:]):
+        assert start + len(chunk) == next_start
+        assert chunk.endswith(b"\n")
+    assert b"".join(chunk for _, chunk in result) == data
+
+
+@pytest.mark.parametrize("load_strategy", [LoadStrategy.ORM, LoadStrategy.UPSERT])
+def test_process_parallel_loads_all_ranges_into_one_table(tmp_path, load_strategy):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    session = create_sqlite_session(url)
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        data = fdata.read()
+
+    report = process_parallel(
+        file=BytesIO(data),
+        name="knw.csv",
+        session_factory=partial(create_sqlite_session, url),
+        logger=ConsoleLogger(),
+        workers=3,
+        range_bytes=10_000,
+        load_strategy=load_strategy,
+    )
+
+    assert report.succeeded
+    assert report.row_count == 94
+    assert len(report.results) == 3
+    assert session.query(KNWData).count() == 94
+
+
+def test_process_parallel_reports_failed_ranges_without_stopping_others(
+    tmp_path, caplog
+):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    session = create_sqlite_session(url)
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        data = fdata.read().replace(b"\t98158.5\n", b"\tnot_a_number\n")
+
+    report = process_parallel(
+        file=BytesIO(data),
+        name="knw.csv",
+        session_factory=partial(create_sqlite_session, url),
+        logger=ConsoleLogger(),
+        workers=2,
+        range_bytes=15_000,
+    )
+
+    assert not report.succeeded
+    assert [result.error is None for result in report.results] == [False, True]
+    assert report.row_count == session.query(KNWData).count() > 0
+    assert caplog.records[-1].levelno == logging.ERROR
+    assert (
+        "failed: Could not parse KNW row 1979-01-01 01:00: could not convert string to float"
+        in caplog.records[-1].getMessage()
+    )
+
+
+@pytest.mark.parametrize("parser", list(ParserType))
+def test_process_parallel_reports_truncated_last_range(tmp_path, parser):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    create_sqlite_session(url)
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        data = fdata.read().rstrip()
+    # Cut the last row off halfway through its values
+    data = data[: data.rfind(b"\t") - 40]
+
+    report = process_parallel(
+        file=BytesIO(data),
+        name="knw.csv",
+        session_factory=partial(create_sqlite_session, url),
+        logger=ConsoleLogger(),
+        workers=2,
+        range_bytes=15_000,
+        parser=parser,
+    )
+
+    assert not report.succeeded
+    assert [result.error is None for result in report.results] == [True, True, False]
+    assert "Could not parse KNW" in str(report.results[-1].error)
+
+
+def test_process_parallel_looks_up_watermark_once_for_all_ranges(tmp_path, mock_row):
+    url = f"sqlite:///{tmp_path / 'knw.db'}"
+    session = create_sqlite_session(url)
+    stored = Processor.parse_row({**mock_row, "DTG": "1979-01-04 19:00"})
+    session.add(KNWData(**dict(zip(KNW_COLUMNS, stored))))
+    session.commit()
+    with open(get_file("files/mockknwfile.csv"), "rb") as fdata:
+        data = fdata.read()
+
+    report = process_parallel(
+        file=BytesIO(data),
+        name="knw.csv",
+        session_factory=partial(create_sqlite_session, url),
+        logger=ConsoleLogger(),
+        workers=4,
+        incremental=True,
+        range_bytes=8_000,
+    )
+
+    assert report.row_count == 3
+    assert session.query(KNWData).count() == 4
+
+
+def test_parallel_ingest_report_summary():
+    report = ParallelIngestReport(
+        name="knw.csv",
+        results=[
+            RangeResult(0, 10, 30, 1.0),
+            RangeResult(10, 20, 0, 0.5, "oops"),
+        ],
+        seconds=2.0,
+    )
+
+    assert not report.succeeded
+    assert report.rows_per_second == 15.0
+    assert report.summary() == (
+        "Loaded 30 rows from knw.csv in 2 ranges in 2.00s (15 rows/s)\n"
+        "Range 10-20 failed: oops"
+    )
+
+
+def test_process_file_closes_session_and_logs_pool_stats(
+    mock_input_stream, mock_row, mocker
+):
+    mocker.patch(
+        "KNWToSQL.knw_to_sql.Processor.iter_file_rows", return_value=[mock_row]
+    )
+    mock_session, mock_logger = mocker.MagicMock(), mocker.MagicMock()
+    mock_session.get_bind().pool.stats.summary.return_value = "checkouts=1"
+
+    result = process_file(mock_input_stream, mock_session, mock_logger)
+
+    assert result == 1
+    mock_session.commit.assert_called_once()
+    mock_session.close.assert_called_once()
+    mock_logger.log.assert_called_with(
+        message="Postgres connection pool: checkouts=1", severity=20
+    )
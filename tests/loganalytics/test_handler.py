@@ -0,0 +1,96 @@
+import logging
+
+import pytest
+
+from loganalytics.handler import (
+    LogAnalyticsWorkspaceHandler,
+    get_law_logger,
+)
+from loganalytics.law import DEFAULT_CLOSE_TIMEOUT
+
+
+@pytest.fixture
+def mock_law_logger(mocker):
+    return mocker.MagicMock()
+
+
+def test_handler_sends_formatted_records_at_or_above_level(mock_law_logger, mocker):
+    logger = get_law_logger(
+        "test_handler_level", mock_law_logger, level=logging.WARNING
+    )
+    format_spy = mocker.spy(LogAnalyticsWorkspaceHandler, "format")
+
+    logger.info("Uploading file: %s", "file.nc")
+    logger.warning("Slow upload of %s", "file.nc")
+
+    mock_law_logger.log.assert_called_once_with(
+        message="Slow upload of file.nc", severity=logging.WARNING
+    )
+    assert format_spy.call_count == 1
+
+
+def test_handler_rate_limits_per_message_key(mock_law_logger, mocker):
+    monotonic_mock = mocker.patch("loganalytics.handler.monotonic", return_value=0.0)
+    logger = get_law_logger(
+        "test_handler_rate",
+        mock_law_logger,
+        rate_limits={"Uploading file: %s": 2, "upload": 1},
+        rate_window=60.0,
+    )
+    handler = logger.handlers[0]
+    assert isinstance(handler, LogAnalyticsWorkspaceHandler)
+
+    for i in range(4):
+        logger.info("Uploading file: %s", i)
+    logger.info("Other message")
+    logger.info("Keyed %s", 1, extra={"law_key": "upload"})
+    logger.info("Keyed %s", 2, extra={"law_key": "upload"})
+    monotonic_mock.return_value = 60.0
+    logger.info("Uploading file: %s", 4)
+
+    messages = [call.kwargs["message"] for call in mock_law_logger.log.call_args_list]
+    assert messages == [
+        "Uploading file: 0",
+        "Uploading file: 1",
+        "Other message",
+        "Keyed 1",
+        "Uploading file: 4",
+    ]
+    assert handler.suppressed == {"Uploading file: %s": 2, "upload": 1}
+
+
+def test_handler_samples_per_message_key(mock_law_logger):
+    values = iter([0.1, 0.6, 0.4])
+    handler = LogAnalyticsWorkspaceHandler(
+        mock_law_logger,
+        sample_rates={"Sampled %s": 0.5},
+        random_fn=lambda: next(values),
+    )
+    logger = logging.getLogger("test_handler_sample")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    for i in range(3):
+        logger.info("Sampled %s", i)
+
+    messages = [call.kwargs["message"] for call in mock_law_logger.log.call_args_list]
+    assert messages == ["Sampled 0", "Sampled 2"]
+    assert handler.suppressed["Sampled %s"] == 1
+    logger.removeHandler(handler)
+
+
+def test_get_law_logger_replaces_earlier_handler(mock_law_logger):
+    get_law_logger("test_handler_replace", mock_law_logger)
+    logger = get_law_logger("test_handler_replace", mock_law_logger)
+
+    assert len(logger.handlers) == 1
+    assert not logger.propagate
+
+
+def test_handler_flush_waits_at_most_close_timeout(mock_law_logger):
+    handler = LogAnalyticsWorkspaceHandler(mock_law_logger)
+
+    handler.flush()
+
+    mock_law_logger.flush.assert_called_once_with(timeout=DEFAULT_CLOSE_TIMEOUT)
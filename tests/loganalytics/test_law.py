@@ -2,8 +2,11 @@ import base64
 import hashlib
 import hmac
 import json
+import pickle
+import threading
 
 import httpretty
+import requests
 import pytest
 from requests.adapters import Retry
 
@@ -12,6 +15,11 @@ from loganalytics.errors import (
     LogAnalyticsWorkspaceRetryError,
     ValidationError,
 )
+from loganalytics.law import (
+    MAX_SIGNATURE_RETRIES,
+    LogAnalyticsWorkspaceLogger,
+    split_batches,
+)
 
 
 @pytest.mark.freeze_time("2022-01-01")
@@ -58,7 +66,9 @@ def test_log_builds_correct_request(law_logger, mocker):
 
     law_logger.log(message="Test 1-2-3", severity=10)
 
-    signature_mock.assert_called_once_with('{"message": "Test 1-2-3", "severity": 10}')
+    signature_mock.assert_called_once_with(
+        b'{"message": "Test 1-2-3", "severity": 10}', "Sat, 01 Jan 2022 00:00:00 GMT"
+    )
     history = httpretty.latest_requests()
     assert len(history) == 1
     assert history[0].method == "POST"
@@ -103,7 +113,9 @@ def test__log_retries_on_503_response(law_logger, mocker):
         ],
     )
     law_logger._log(message="Test 1-2-3", severity=10)
-    signature_mock.assert_called_once_with('{"message": "Test 1-2-3", "severity": 10}')
+    signature_mock.assert_called_once_with(
+        b'{"message": "Test 1-2-3", "severity": 10}', "Sat, 01 Jan 2022 00:00:00 GMT"
+    )
     history = httpretty.latest_requests()
 
     assert len(history) == 4
@@ -145,7 +157,9 @@ def test__log_raises_retry_error_after_too_many_retries_on_503_response(
     with pytest.raises(LogAnalyticsWorkspaceRetryError) as error:
         law_logger._log(message="Test 1-2-3", severity=10)
 
-    signature_mock.assert_called_once_with('{"message": "Test 1-2-3", "severity": 10}')
+    signature_mock.assert_called_once_with(
+        b'{"message": "Test 1-2-3", "severity": 10}', "Sat, 01 Jan 2022 00:00:00 GMT"
+    )
 
     history = httpretty.latest_requests()
 
@@ -172,7 +186,9 @@ def test__log_raises_response_error_on_non_200_response(law_logger, mocker):
     with pytest.raises(LogAnalyticsWorkspaceResponseError) as error:
         law_logger._log(message="Test 1-2-3", severity=10)
 
-    signature_mock.assert_called_once_with('{"message": "Test 1-2-3", "severity": 10}')
+    signature_mock.assert_called_once_with(
+        b'{"message": "Test 1-2-3", "severity": 10}', "Sat, 01 Jan 2022 00:00:00 GMT"
+    )
 
     history = httpretty.latest_requests()
 
@@ -182,9 +198,7 @@ def test__log_raises_response_error_on_non_200_response(law_logger, mocker):
 
 @httpretty.activate
 @pytest.mark.freeze_time("2022-01-01")
-def test__log_raises_calls_itself_recursively_on_invalid_signature_error(
-    law_logger, mocker
-):
+def test__log_signs_again_on_invalid_signature_error(law_logger, mocker):
     signature_mock = mocker.patch(
         "loganalytics.law.LogAnalyticsWorkspaceLogger._build_signature",
         return_value="test_signature",
@@ -204,16 +218,60 @@ def test__log_raises_calls_itself_recursively_on_invalid_signature_error(
 
     law_logger._log(message="Test 1-2-3", severity=10)
 
-    # We expect 3 posts in total with 2 calls to build_signature as we have one recursive _log call
+    # We expect 3 posts in total with 2 calls to build_signature as the 403 is signed again
     sig_call_args = signature_mock.call_args_list
     assert len(sig_call_args) == 2
     for call in sig_call_args:
-        assert call[0][0] == '{"message": "Test 1-2-3", "severity": 10}'
+        assert call[0][0] == b'{"message": "Test 1-2-3", "severity": 10}'
 
     history = httpretty.latest_requests()
     assert len(history) == 3
 
 
+@httpretty.activate
+@pytest.mark.freeze_time("2022-01-01")
+def test__log_raises_response_error_when_signature_keeps_being_invalid(law_logger):
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://Test_workspace_id.ods.opinsights.azure.com/api/logs?api-version=2016-04-01",
+        body='{"message": "An invalid signature was specified in the Authorization header"}',
+        status=403,
+    )
+
+    with pytest.raises(LogAnalyticsWorkspaceResponseError) as error:
+        law_logger._log(message="Test 1-2-3", severity=10)
+
+    assert "Unexpected response with code 403" in str(error.value)
+    assert len(httpretty.latest_requests()) == MAX_SIGNATURE_RETRIES + 1
+
+
+def test_build_signature_signs_utf8_byte_length(law_logger):
+    data = json.dumps({"message": "Temperatuur 20 °C"}, ensure_ascii=False)
+    date = "Sat, 01 Jan 2022 00:00:00 GMT"
+    expected = base64.b64encode(
+        hmac.new(
+            key=base64.b64decode(law_logger._shared_key),
+            msg=(
+                f"POST\n{len(data.encode())}\napplication/json\nx-ms-date:{date}\n/api/logs"
+            ).encode(),
+            digestmod=hashlib.sha256,
+        ).digest()
+    ).decode()
+
+    assert len(data.encode()) != len(data)
+    assert law_logger._build_signature(data, date) == expected
+    assert law_logger._build_signature(data.encode(), date) == expected
+
+
+def test_logger_raises_validation_error_on_invalid_shared_key():
+    with pytest.raises(ValidationError):
+        LogAnalyticsWorkspaceLogger(
+            workspace_id="Test_workspace_id",
+            shared_key="abc",
+            custom_log_table_name="Test_LAW",
+        )
+
+
 def test__configure_requests_session(law_logger, mocker, mock_http_adapter):
     retry_mock = mocker.patch("loganalytics.law.Retry", return_value=Retry(total=4242))
     adapter_mock = mocker.patch(
@@ -236,3 +294,248 @@ def test__configure_requests_session(law_logger, mocker, mock_http_adapter):
 
     assert len(session.adapters) == 2
     assert session.adapters["https://"] == mock_http_adapter
+
+
+@httpretty.activate
+def test_log_in_batch_mode_posts_one_array_per_batch(law_logger, mocker):
+    signature_mock = mocker.patch(
+        "loganalytics.law.LogAnalyticsWorkspaceLogger._build_signature",
+        return_value="test_signature",
+    )
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://Test_workspace_id.ods.opinsights.azure.com/api/logs?api-version=2016-04-01",
+        status=200,
+    )
+    law_logger.batch = True
+    law_logger.max_batch_records = 2
+
+    law_logger.log(message="one", severity=10)
+    assert httpretty.latest_requests() == []
+    law_logger.log(message="two", severity=20)
+    law_logger.log(message="three", severity=30)
+    law_logger.flush()
+    law_logger.flush()
+
+    bodies = [json.loads(request.body) for request in httpretty.latest_requests()]
+    assert bodies == [
+        [{"message": "one", "severity": 10}, {"message": "two", "severity": 20}],
+        [{"message": "three", "severity": 30}],
+    ]
+    assert signature_mock.call_count == 2
+
+
+@httpretty.activate
+def test_log_in_batch_mode_sends_buffer_when_bytes_or_age_reached(law_logger, mocker):
+    mocker.patch(
+        "loganalytics.law.LogAnalyticsWorkspaceLogger._build_signature",
+        return_value="test_signature",
+    )
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://Test_workspace_id.ods.opinsights.azure.com/api/logs?api-version=2016-04-01",
+        status=200,
+    )
+    monotonic_mock = mocker.patch("loganalytics.law.monotonic", return_value=0.0)
+    law_logger.batch = True
+    law_logger.max_batch_bytes = 100
+
+    law_logger.log(message="x" * 100, severity=10)
+    assert len(httpretty.latest_requests()) == 1
+
+    law_logger.log(message="early", severity=10)
+    monotonic_mock.return_value = law_logger.max_batch_age
+    law_logger.log(message="late", severity=10)
+    assert len(httpretty.latest_requests()) == 2
+    assert len(json.loads(httpretty.latest_requests()[-1].body)) == 2
+
+
+def test_split_batches_keeps_payloads_under_max_bytes():
+    records = [json.dumps({"message": str(i) * 10}) for i in range(5)]
+
+    payloads = list(split_batches(records, max_bytes=60))
+
+    assert all(len(payload.encode()) <= 60 for payload in payloads)
+    assert [record for payload in payloads for record in json.loads(payload)] == [
+        json.loads(record) for record in records
+    ]
+    assert len(payloads) == 3
+    assert list(split_batches(["x" * 100], max_bytes=60)) == ["[" + "x" * 100 + "]"]
+    assert list(split_batches([])) == []
+
+
+def test_pickled_logger_logs_unbatched(law_logger):
+    law_logger.batch = True
+    law_logger.log(message="buffered", severity=10)
+
+    copy = pickle.loads(pickle.dumps(law_logger))
+
+    assert not copy.batch
+    assert copy._buffer == []
+    assert law_logger._buffer != []
+
+
+@pytest.fixture
+def background_logger(mocker):
+    logger = LogAnalyticsWorkspaceLogger(
+        workspace_id="Test_workspace_id",
+        shared_key="test_key==",
+        custom_log_table_name="Test_LAW",
+        background=True,
+        max_queue_size=3,
+    )
+    mocker.patch.object(logger, "_post")
+    yield logger
+    logger.close(timeout=5)
+
+
+def test_background_logger_sends_batches_from_thread_on_flush(background_logger):
+    background_logger.log(message="one", severity=10)
+    background_logger.log(message="two", severity=20)
+
+    assert background_logger.flush(timeout=5)
+
+    background_logger._post.assert_called_once_with(
+        '[{"message": "one", "severity": 10},{"message": "two", "severity": 20}]'
+    )
+    assert background_logger.stats.enqueued == 2
+    assert background_logger.stats.delivered == 2
+    assert background_logger.stats.max_enqueue_seconds > 0
+
+
+def test_background_logger_drops_records_when_queue_is_full(background_logger, mocker):
+    sending = threading.Event()
+    release = threading.Event()
+
+    def slow_post(data):
+        sending.set()
+        release.wait(5)
+
+    background_logger._post.side_effect = slow_post
+    background_logger.max_batch_records = 1
+    background_logger.log(message="blocking", severity=10)
+    assert sending.wait(5)
+
+    for i in range(5):
+        background_logger.log(message=str(i), severity=10)
+
+    assert background_logger.stats.dropped == 2
+    assert not background_logger.flush(timeout=0.05)
+    release.set()
+    assert background_logger.close(timeout=5)
+    assert background_logger.stats.delivered == 4
+    assert not background_logger._thread.is_alive()
+
+
+def test_background_logger_counts_failed_posts_instead_of_raising(background_logger):
+    background_logger._post.side_effect = LogAnalyticsWorkspaceResponseError("Oops")
+
+    background_logger.log(message="one", severity=10)
+
+    assert background_logger.close(timeout=5)
+    assert background_logger.stats.failed == 1
+    assert background_logger.stats.last_error == "Oops"
+
+
+@pytest.fixture
+def spool_logger(tmp_path, mocker):
+    logger = LogAnalyticsWorkspaceLogger(
+        workspace_id="Test_workspace_id",
+        shared_key="test_key==",
+        custom_log_table_name="Test_LAW",
+        spool_path=str(tmp_path / "Test_LAW.spool"),
+    )
+    mocker.patch.object(logger, "_post")
+    return logger
+
+
+def test_logger_spools_records_after_failed_post_and_replays_them(
+    spool_logger, tmp_path, mocker
+):
+    spool_logger._post.side_effect = LogAnalyticsWorkspaceRetryError("LAW is down")
+
+    spool_logger.log(message="one", severity=10)
+    spool_logger.log(message="two", severity=20)
+
+    # After the first failure records are spooled without posting
+    assert spool_logger._post.call_count == 1
+    assert spool_logger.stats.spooled == 2
+
+    replaying_logger = LogAnalyticsWorkspaceLogger(
+        workspace_id="Test_workspace_id",
+        shared_key="test_key==",
+        custom_log_table_name="Test_LAW",
+        spool_path=str(tmp_path / "Test_LAW.spool"),
+    )
+    post_mock = mocker.patch.object(replaying_logger, "_post")
+    replaying_logger.replay_spool()
+
+    post_mock.assert_called_once_with(
+        '[{"message": "one", "severity": 10},{"message": "two", "severity": 20}]'
+    )
+    assert replaying_logger.stats.replayed == 2
+    assert replaying_logger._spool is not None
+    assert replaying_logger._spool.take() == []
+
+
+def test_logger_spools_only_unsent_batches(spool_logger, mocker):
+    mocker.patch(
+        "loganalytics.law.group_batches", return_value=iter([["1"], ["2"], ["3"]])
+    )
+    spool_logger._post.side_effect = [
+        None,
+        LogAnalyticsWorkspaceRetryError("LAW is down"),
+    ]
+
+    assert spool_logger._send_batches(["1", "2", "3"]) == 2
+    assert spool_logger._spool.take() == ["2", "3"]
+
+
+def test_background_logger_spools_failed_deliveries(tmp_path, mocker):
+    logger = LogAnalyticsWorkspaceLogger(
+        workspace_id="Test_workspace_id",
+        shared_key="test_key==",
+        custom_log_table_name="Test_LAW",
+        background=True,
+        spool_path=str(tmp_path / "Test_LAW.spool"),
+    )
+    mocker.patch.object(
+        logger, "_post", side_effect=LogAnalyticsWorkspaceRetryError("LAW is down")
+    )
+    logger.log(message="one", severity=10)
+
+    assert logger.close(timeout=5)
+    assert logger.stats.spooled == 1
+    assert logger.stats.delivered == 0
+    assert logger._spool is not None
+    assert logger._spool.take() == ['{"message": "one", "severity": 10}']
+
+
+def test_logger_drops_rejected_records_instead_of_spooling(spool_logger):
+    response = requests.Response()
+    response.status_code = 400
+    spool_logger._post.side_effect = [
+        LogAnalyticsWorkspaceResponseError("Bad request", response=response),
+        None,
+    ]
+
+    spool_logger.log(message="poison", severity=10)
+    spool_logger.log(message="fine", severity=10)
+
+    assert spool_logger._post.call_count == 2
+    assert spool_logger.stats.failed == 1
+    assert spool_logger.stats.spooled == 0
+    assert spool_logger._spool.take() == []
+
+
+def test_logger_spools_records_on_server_error(spool_logger):
+    response = requests.Response()
+    response.status_code = 500
+    spool_logger._post.side_effect = LogAnalyticsWorkspaceResponseError(
+        "Server error", response=response
+    )
+
+    spool_logger.log(message="one", severity=10)
+
+    assert spool_logger.stats.spooled == 1
+    assert spool_logger._spool.take() == ['{"message": "one", "severity": 10}']
@@ -0,0 +1,15 @@
+import logging
+import pickle
+
+from loganalytics.logger import ConsoleLogger
+
+
+def test_console_logger_logs_through_stdlib_logging_and_pickles(caplog):
+    logger = pickle.loads(pickle.dumps(ConsoleLogger("knw")))
+
+    with caplog.at_level(logging.INFO, logger="knw"):
+        logger.log(message="Loaded 94 rows", severity=logging.INFO)
+
+    assert [(r.name, r.levelno, r.getMessage()) for r in caplog.records] == [
+        ("knw", logging.INFO, "Loaded 94 rows")
+    ]
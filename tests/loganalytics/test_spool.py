@@ -0,0 +1,62 @@
+from loganalytics.spool import RecordSpool
+
+
+def test_spool_returns_appended_records_in_order(tmp_path):
+    spool = RecordSpool(str(tmp_path / "law" / "records.spool"))
+
+    assert spool.append(['{"message": "one"}', '{"message": "tw\\u00f6"}']) == 2
+    assert spool.append(['{"message": "drie °C"}']) == 1
+
+    assert spool.take() == [
+        '{"message": "one"}',
+        '{"message": "tw\\u00f6"}',
+        '{"message": "drie °C"}',
+    ]
+    spool.commit()
+    assert spool.take() == []
+
+
+def test_spool_skips_record_cut_off_by_crash(tmp_path):
+    path = tmp_path / "records.spool"
+    spool = RecordSpool(str(path))
+    spool.append(['{"message": "one"}', '{"message": "two"}'])
+    path.write_bytes(path.read_bytes()[:-3])
+
+    assert spool.take() == ['{"message": "one"}']
+
+
+def test_spool_records_are_taken_by_one_invocation_only(tmp_path):
+    path = str(tmp_path / "records.spool")
+    RecordSpool(path).append(['{"message": "one"}', '{"message": "two"}'])
+
+    first, second = RecordSpool(path), RecordSpool(path)
+
+    assert first.take() == ['{"message": "one"}', '{"message": "two"}']
+    assert second.take() == []
+
+
+def test_spool_returns_stale_interrupted_replay_first(tmp_path):
+    path = str(tmp_path / "records.spool")
+    interrupted = RecordSpool(path)
+    interrupted.append(['{"message": "one"}'])
+    interrupted.take()
+    interrupted.append(['{"message": "two"}'])
+
+    # The interrupted claim is not stale yet, so it still belongs to its replay
+    replaying = RecordSpool(path)
+    assert replaying.take() == ['{"message": "two"}']
+    replaying.commit()
+
+    interrupted.append(['{"message": "three"}'])
+    spool = RecordSpool(path, stale_seconds=0)
+    assert spool.take() == ['{"message": "one"}', '{"message": "three"}']
+    spool.commit()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spool_drops_records_once_full(tmp_path):
+    spool = RecordSpool(str(tmp_path / "records.spool"), max_bytes=48)
+
+    assert spool.append(['{"message": "one"}', '{"message": "two"}', "{}"]) == 2
+    assert spool.size() == 44
+    assert spool.append(["{}"]) == 0
@@ -1,7 +1,11 @@
 import pytest
 from azure.identity import ManagedIdentityCredential
 
-from storage.adls import get_adls_client
+from storage.adls import (
+    UploadSettings,
+    get_adls_client,
+    tune_upload,
+)
 
 
 @pytest.mark.parametrize(
@@ -21,3 +25,43 @@ def test_get_adls_client_correctly_formats_account_string(mocker, name, key, con
     datalake_sc_mock().get_file_system_client.assert_called_once_with(
         file_system=container
     )
+
+
+@pytest.mark.parametrize(
+    "size,result",
+    [
+        (0, UploadSettings(1, 1)),
+        (1000, UploadSettings(1000, 1)),
+        (8 * 1024 * 1024, UploadSettings(8 * 1024 * 1024, 1)),
+        (9 * 1024 * 1024, UploadSettings(4 * 1024 * 1024, 3)),
+        (100 * 1024 * 1024, UploadSettings(4 * 1024 * 1024, 4)),
+    ],
+)
+def test_tune_upload_uses_single_shot_for_small_files_and_bounded_chunks_for_large(
+    size, result
+):
+    assert tune_upload(size) == result
+
+
+def test_tune_upload_respects_custom_settings():
+    assert tune_upload(
+        10, single_shot_threshold=5, chunk_size=2, max_concurrency=8
+    ) == (UploadSettings(2, 5))
+
+
+@pytest.mark.parametrize(
+    "size,result",
+    [
+        (1000, UploadSettings(1000, 1)),
+        (3 * 1024 * 1024, UploadSettings(2 * 1024 * 1024, 1)),
+        (100 * 1024 * 1024, UploadSettings(2 * 1024 * 1024, 1)),
+    ],
+)
+def test_tune_upload_caps_bytes_in_memory_at_max_buffered(size, result):
+    assert tune_upload(size, max_buffered=2 * 1024 * 1024) == result
+
+
+def test_tune_upload_appends_smaller_chunks_in_parallel_within_max_buffered():
+    assert tune_upload(
+        100, single_shot_threshold=50, chunk_size=10, max_concurrency=8, max_buffered=30
+    ) == UploadSettings(10, 3)